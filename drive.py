@@ -1,18 +1,21 @@
+import functools
 import logging
 import multiprocessing as mp
 import pickle
 import queue
 import threading
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 
 import click
-import cv2 as cv
 import robomasterpy as rm
 from pynput import keyboard
 from pynput.keyboard import Key, KeyCode
 from robomasterpy import CTX
 from robomasterpy import framework as rmf
 
+from playground.vision import LatestFrameVision
+from playground.viz import VIZ_FREQUENCY, Display, Publisher
+
 rm.LOG_LEVEL = logging.INFO
 pickle.DEFAULT_PROTOCOL = pickle.HIGHEST_PROTOCOL
 
@@ -22,10 +25,14 @@ TIMEOUT_UNIT: float = 0.1
 QUEUE_TIMEOUT: float = TIMEOUT_UNIT / PUSH_FREQUENCY
 
 
-# just display the streaming video
-def display(frame, **kwargs) -> None:
-    cv.imshow("frame", frame)
-    cv.waitKey(1)
+# just display the streaming video, in the display worker
+def display(frame, publisher: Optional[Publisher] = None, **kwargs) -> None:
+    if publisher is not None and publisher.ready():
+        publisher.publish(frame)
+
+
+def render_frame(frame):
+    return frame
 
 
 def handle_event(cmd: rm.Commander, queues: Tuple[mp.Queue, ...], logger: logging.Logger) -> None:
@@ -151,7 +158,9 @@ def control(cmd: rm.Commander, logger: logging.Logger, **kwargs) -> None:
 @click.command()
 @click.option('--ip', default='', type=str, help='(Optional) IP of Robomaster EP')
 @click.option('--timeout', default=10.0, type=float, help='(Optional) Timeout for commands')
-def cli(ip: str, timeout: float):
+@click.option('--headless', is_flag=True, help='(Optional) Do not show the video')
+@click.option('--viz-frequency', default=VIZ_FREQUENCY, type=float, help='(Optional) Refresh rate of the video window')
+def cli(ip: str, timeout: float, headless: bool, viz_frequency: float):
     # manager is in charge of communicating among processes
     manager: mp.managers.SyncManager = CTX.Manager()
 
@@ -167,9 +176,14 @@ def cli(ip: str, timeout: float):
 
         # enable video streaming
         cmd.stream(True)
-        # rm.Vision is a handler for video streaming
-        # display is the callback function defined above
-        hub.worker(rmf.Vision, 'vision', (None, ip, display))
+        # LatestFrameVision is a handler for video streaming, it hands the newest frame to the callback
+        # display is the callback function defined above, it hands frames over to a Display worker
+        publisher = None
+        if not headless:
+            frame_queue = manager.Queue(1)
+            publisher = Publisher(frame_queue, viz_frequency)
+            hub.worker(Display, 'display', ([('frame', frame_queue, render_frame)], viz_frequency))
+        hub.worker(LatestFrameVision, 'vision', (None, ip, functools.partial(display, publisher=publisher)))
 
         # enable push and event
         cmd.chassis_push_on(PUSH_FREQUENCY, PUSH_FREQUENCY, PUSH_FREQUENCY)
@@ -1,11 +1,14 @@
+import dataclasses
 import enum
+import functools
 import logging
 import math
 import multiprocessing as mp
+import os
 import pickle
 import queue
 import time
-from typing import Tuple, List, Optional
+from typing import Dict, Tuple, List, Optional
 
 import click
 import cv2 as cv
@@ -16,15 +19,33 @@ from robomasterpy import CTX
 from robomasterpy import framework as rmf
 from robomasterpy import measure
 
+from playground import latency, segmentation
+from playground.commands import SETPOINT_MAX_RATE, AsyncCommander, SetpointFilter
+from playground.detection import BALL_ACTUAL_RADIUS, Circle, RoiTracker, ball_distances, find_ball, locate_ball
+from playground.calibration import CameraCalibration
+from playground.detectors import BACKEND_CONTOURS, DETECTORS, make_detector
+from playground.fleet import LOOP_CONTROL, LOOP_VISION, LoopCounter, LoopRates, PushRouter, RateReporter, other_cpus, vision_cpus
+from playground.ipc import FRAME_SHAPE, DetectionMailbox, Mailbox, SharedRing
+from playground.latency import LatencyRecorder
+from playground.ticks import MONOTONIC_CLOCK, TickScheduler
+from playground.tracking import BallKalman
+from playground.tuning import WorkerTuning, load_worker_tunings, tuned, tuning_for
+from playground.replay import STREAM_EVENT, STREAM_PUSH, STREAM_VISION, RecordingChannel, SessionWriter
+from playground.vision import LatestFrameVision, ScheduledVision, VisionHint, VisionHintChannel
+from playground.viz import VIZ_FREQUENCY, Display, Panel, Publisher
+
 rm.LOG_LEVEL = logging.DEBUG
 pickle.DEFAULT_PROTOCOL = pickle.HIGHEST_PROTOCOL
 
-GREEN_LOWER = (29, 90, 90)
-GREEN_UPPER = (64, 255, 255)
-BALL_ACTUAL_RADIUS = 0.065 / 2
-
 QUEUE_SIZE: int = 6
+# frames kept for the display, which reads an annotated frame up to a few vision frames later
+FRAME_RING_SLOTS: int = 8
 SYSTEM_FREQUENCY: int = 30
+# from exposure to the frame reaching vision(), which can not be measured on the host
+CAMERA_LATENCY: float = 0.05
+
+TRANSPORT_QUEUE: str = 'queue'
+TRANSPORT_SHARED_MEMORY: str = 'shm'
 
 
 @enum.unique
@@ -45,6 +66,196 @@ class KeeperState(enum.IntEnum):
         return KeeperState(self._BEGIN + 1)
 
 
+class ChassisMailbox(Mailbox):
+    """
+    Latest chassis position and yaw merged from pushes, read back as ``rm.ChassisPosition(x, y, yaw)``.
+    """
+
+    def __init__(self):
+        self._pending = [0.0, 0.0, 0.0]
+        super().__init__(3)
+
+    def _layout(self) -> dict:
+        return {**super()._layout(), '_pending': [0.0, 0.0, 0.0]}
+
+    def _encode(self, payload):
+        if type(payload) == rm.ChassisPosition:
+            self._pending[0], self._pending[1] = payload.x, payload.y
+        elif type(payload) == rm.ChassisAttitude:
+            self._pending[2] = payload.yaw
+        else:
+            raise ValueError(f'unexpected push content: {payload}')
+        return self._pending
+
+    def _decode(self, array):
+        return rm.ChassisPosition(*array.tolist())
+
+
+@dataclasses.dataclass
+class GraphSnapshot:
+    """
+    What KeeperMind knows at a tick, ages are in seconds and None if never seen.
+    """
+    state: KeeperState
+    position: Tuple[float, float, float]
+    ball_distances: Tuple[float, float, float]
+    vision_age: Optional[float]
+    position_age: Optional[float]
+    hit_age: Optional[float]
+    ball_age: Optional[float]
+    # (stage, count, p50 ms, p99 ms) of the controller process
+    stages: List[Tuple[str, int, float, float]] = dataclasses.field(default_factory=list)
+
+
+class FieldGraph:
+    """
+    Renders a top view of the field with chassis and ball from a ``GraphSnapshot``, runs in the display worker.
+
+    Rendering is incremental on a canvas kept between calls: the field is drawn once, a text line is only
+    rasterized again when its rounded text changes, and chassis and ball are erased and redrawn within their
+    bounding boxes. Nothing is returned when nothing changed, so that the display skips ``cv.imshow()``,
+    and the image returned is drawn over by the next call.
+    """
+    GRAPH_SIZE: int = 600
+    SHAPE_THICKNESS: int = 2
+    AGE_STEP_MS: int = 10  # ages are shown rounded to this, finer ones would change on every snapshot
+    STAGES_TOP: int = 310
+
+    def __init__(self, field_width: float, field_depth: float):
+        if field_width > field_depth:
+            self._pixel_size: float = 0.8 * self.GRAPH_SIZE / field_width  # pixel per meter
+        else:
+            self._pixel_size: float = 0.8 * self.GRAPH_SIZE / field_depth  # pixel per meter
+        self._chassis_width = self._pixel_size * measure.INFANTRY_WIDTH
+        self._chassis_length = self._pixel_size * measure.INFANTRY_LENGTH
+        self._ball_radius = int(BALL_ACTUAL_RADIUS * self._pixel_size)
+        self._base = np.zeros((self.GRAPH_SIZE, self.GRAPH_SIZE, 3), dtype=np.uint8)
+        cv.rectangle(self._base, self._offset(-0.5 * field_width * self._pixel_size, -0.5 * field_depth * self._pixel_size), self._offset(0.5 * field_width * self._pixel_size, 0.5 * field_depth * self._pixel_size), (255, 0, 0), 4)
+
+        # field and text, what shapes are erased to
+        self._background = self._base.copy()
+        self._canvas = self._base.copy()
+        # text drawn at every line origin
+        self._texts: Dict[Tuple[int, int], str] = {}
+        self._stage_count: int = 0
+        # (x0, y0, x1, y1) of the shapes drawn last
+        self._shape_boxes: List[Tuple[int, int, int, int]] = []
+        self._shapes: Optional[Tuple] = None
+
+    def _offset(self, x: float, y: float) -> Tuple[int, int]:
+        center = 0.5 * self.GRAPH_SIZE
+        return int(center + x), int(center + y)
+
+    def _box(self, x0: float, y0: float, x1: float, y1: float) -> Tuple[int, int, int, int]:
+        margin = self.SHAPE_THICKNESS + 1
+        return (max(0, int(x0) - margin), max(0, int(y0) - margin),
+                min(self.GRAPH_SIZE, int(x1) + margin + 1), min(self.GRAPH_SIZE, int(y1) + margin + 1))
+
+    def _restore(self, box: Tuple[int, int, int, int]):
+        x0, y0, x1, y1 = box
+        self._canvas[y0:y1, x0:x1] = self._background[y0:y1, x0:x1]
+
+    def _text(self, text: str, origin: Tuple[int, int], scale: float, color: Tuple[int, int, int], thickness: int) -> bool:
+        """
+        Draw ``text`` on the background unless it is already there.
+
+        :return: whether the background changed
+        """
+        if self._texts.get(origin) == text:
+            return False
+        (_, height), baseline = cv.getTextSize('Ag', cv.FONT_HERSHEY_SIMPLEX, scale, thickness)
+        # the line spans the whole width, the previous text may have been longer
+        top, bottom = max(0, origin[1] - height - thickness), min(self.GRAPH_SIZE, origin[1] + baseline + thickness)
+        self._background[top:bottom] = self._base[top:bottom]
+        cv.putText(self._background, text, origin, cv.FONT_HERSHEY_SIMPLEX, scale, color, thickness)
+        self._canvas[top:bottom] = self._background[top:bottom]
+        self._texts[origin] = text
+        return True
+
+    def _draw_texts(self, snapshot: GraphSnapshot) -> bool:
+        position_x, position_y, position_z = snapshot.position
+        white = (255, 255, 255)
+        lines = [
+            (str(snapshot.state), (20, 20), (0, 0, 255)),
+            ('vision heath: %s ms' % self._rounded_age(snapshot.vision_age), (20, 70), white),
+            ('position heath: %s ms' % self._rounded_age(snapshot.position_age), (20, 120), white),
+            ('hit last seen: %s ms' % self._rounded_age(snapshot.hit_age), (20, 170), white),
+            ('robot position: %.2f, %.2f, %.1f' % (position_x, position_y, position_z), (20, 220), white),
+            ('ball last seen: %s ms' % self._rounded_age(snapshot.ball_age), (20, 270), white),
+        ]
+        changed = False
+        for text, origin, color in lines:
+            changed |= self._text(text, origin, 1, color, 2)
+
+        stage_lines = _stage_lines(snapshot.stages, self.STAGES_TOP, self.GRAPH_SIZE)
+        if len(stage_lines) != self._stage_count:
+            # lines no longer drawn over must be cleared as well
+            self._stage_count = len(stage_lines)
+            (_, height), _ = cv.getTextSize('Ag', cv.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+            top = self.STAGES_TOP - height - 1
+            self._background[top:] = self._base[top:]
+            self._canvas[top:] = self._background[top:]
+            self._texts = {origin: text for origin, text in self._texts.items() if origin[1] < self.STAGES_TOP}
+            changed = True
+        for text, origin in stage_lines:
+            changed |= self._text(text, origin, 0.5, (0, 255, 255), 1)
+        return changed
+
+    def _rounded_age(self, age: Optional[float]) -> str:
+        if age is None:
+            return '%.0f' % _age_ms(age)
+        return '%d' % (round(age * 1000 / self.AGE_STEP_MS) * self.AGE_STEP_MS)
+
+    def __call__(self, snapshot: GraphSnapshot) -> Optional[np.ndarray]:
+        texts_changed = self._draw_texts(snapshot)
+
+        position_x, position_y, _ = snapshot.position
+        chassis_x = position_y
+        chassis_y = position_x
+        chassis_x_pixel, chassis_y_pixel = self._offset(chassis_x * self._pixel_size, chassis_y * self._pixel_size)
+        forward, lateral, _ = snapshot.ball_distances
+        ball_x_pixel, ball_y_pixel = self._offset((lateral + position_y) * self._pixel_size, (forward + position_x) * self._pixel_size)
+        shapes = (chassis_x_pixel, chassis_y_pixel, ball_x_pixel, ball_y_pixel)
+        if shapes == self._shapes and not texts_changed:
+            return None
+
+        # erase the last shapes, then draw all of them again since boxes may overlap
+        for box in self._shape_boxes:
+            self._restore(box)
+        chassis = (chassis_x_pixel - self._chassis_width / 2, chassis_y_pixel - self._chassis_length / 2,
+                   chassis_x_pixel + self._chassis_width / 2, chassis_y_pixel + self._chassis_length / 2)
+        cv.rectangle(self._canvas, (int(chassis[0]), int(chassis[1])), (int(chassis[2]), int(chassis[3])), (0, 0, 255), self.SHAPE_THICKNESS)
+        cv.circle(self._canvas, (ball_x_pixel, ball_y_pixel), self._ball_radius, (0, 255, 0), self.SHAPE_THICKNESS)
+        cv.circle(self._canvas, (ball_x_pixel, ball_y_pixel), 1, (0, 128, 128), self.SHAPE_THICKNESS)
+        ball_extent = max(self._ball_radius, 1) + self.SHAPE_THICKNESS
+        self._shape_boxes = [
+            self._box(*chassis),
+            self._box(ball_x_pixel - ball_extent, ball_y_pixel - ball_extent, ball_x_pixel + ball_extent, ball_y_pixel + ball_extent),
+        ]
+        self._shapes = shapes
+        return self._canvas
+
+
+def _age_ms(age: Optional[float]) -> float:
+    return age * 1000 if age is not None else -1.0
+
+
+def _stage_lines(stages: List[Tuple[str, int, float, float]], top: int, height: int) -> List[Tuple[str, Tuple[int, int]]]:
+    line_height = 20
+    lines = []
+    for index, (stage, count, p50, p99) in enumerate(stages):
+        y = top + index * line_height
+        if y >= height:
+            break
+        lines.append(('%-18s p50 %7.2f ms  p99 %7.2f ms' % (stage, p50, p99), (20, y)))
+    return lines
+
+
+def _draw_stages(image: np.ndarray, stages: List[Tuple[str, int, float, float]], top: int):
+    for text, origin in _stage_lines(stages, top, image.shape[0]):
+        cv.putText(image, text, origin, cv.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+
+
 # Build our own worker for complex task
 class KeeperMind(rmf.Worker):
     MAX_EVENT_LAPSE: float = 20 / 1000.0  # in seconds
@@ -54,14 +265,46 @@ class KeeperMind(rmf.Worker):
     CHASE_EXIT_FORWARD_THRESHOLD: float = 1.4
     DEGREE_EPS: float = 2.0  # in degrees
     DISTANCE_EPS: float = 0.01  # in meters
-    SLEEP_SECONDS: float = 1.0
-    GRAPH_SIZE: int = 600
+    HIT_HOLD_SECONDS: float = 1.0  # standing still after a hit, before starting over
+    REPORT_INTERVAL: float = 10.0
+    # ticks come every period give or take jitter, PID must not skip those coming a bit early
+    PID_SAMPLE_FRACTION: float = 0.5
+    # vision hints while watching
+    IDLE_VISION_FPS: float = 5
+    IDLE_PYRAMID_LEVEL: int = 2
+    FAR_VISION_FPS: float = 10
+    BALL_LOST_AFTER: float = 1.0
 
     def __init__(self, name: str, ip: str,
                  vision: mp.Queue, push: mp.Queue, event: mp.Queue,
                  field_width: float, field_depth: float, timeout: float = 10,
-                 xy_speed: float = 0.4, z_speed: float = 60):
+                 xy_speed: float = 0.4, z_speed: float = 60,
+                 graph: Optional[Publisher] = None, timings: Optional[LatencyRecorder] = None,
+                 async_commands: bool = True, setpoint_rate: float = SETPOINT_MAX_RATE,
+                 ball_filter: bool = False, vision_hint: Optional[VisionHintChannel] = None,
+                 loop_rate: Optional[LoopCounter] = None, control_rate: float = SYSTEM_FREQUENCY,
+                 clock=time, commander=None):
+        """
+        ``graph`` publishes a ``GraphSnapshot`` for the display worker, nothing is drawn without it.
+        ``timings`` collects how long dequeuing, PID and every Commander round trip take,
+        and how old detections are when the controller gets them.
+        With ``async_commands``, commands are pipelined by a background thread instead of blocking the loop
+        until the robot answers, see ``AsyncCommander``.
+        Speed setpoints are de-duplicated and sent at most ``setpoint_rate`` times per second, 0 sends them all.
+        With ``ball_filter``, the ball is tracked by a Kalman filter and predicted to every tick instead of
+        using the latest detection as is.
+        ``vision_hint`` tells vision how many frames to process and how, following the state and the ball.
+        ``loop_rate`` counts iterations of the control loop.
+        ``work()`` runs at ``control_rate`` ticks per second, see ``TickScheduler``, 0 leaves pacing to the caller.
+        ``clock`` provides ``time()`` and ``sleep()``, and ``commander`` replaces the ``rm.Commander`` connecting to ``ip``,
+        they let recorded sessions replay faster than real time.
+        """
         super().__init__(name, None, None, (ip, 0), timeout, True)
+        self._graph = graph
+        self._timings = timings
+        if self._timings is not None:
+            self._timings.install()
+        self._clock = clock
         self._z_speed = z_speed
         self._xy_speed = xy_speed
         self._state: KeeperState = KeeperState.WATCHING
@@ -70,41 +313,54 @@ class KeeperMind(rmf.Worker):
         self._vision = vision
         self._push = push
         self._event = event
-        self._y_pid: simple_pid.PID = simple_pid.PID(-50, -0.5, -2.5, setpoint=0, sample_time=1.0 / SYSTEM_FREQUENCY, output_limits=(-self._xy_speed, self._xy_speed))
-
-        if field_width > field_depth:
-            self._graph_pixel_size: float = 0.8 * self.GRAPH_SIZE / field_width  # pixel per meter
-        else:
-            self._graph_pixel_size: float = 0.8 * self.GRAPH_SIZE / field_depth  # pixel per meter
-        self._graph_chassis_width = self._graph_pixel_size * measure.INFANTRY_WIDTH
-        self._graph_chassis_length = self._graph_pixel_size * measure.INFANTRY_LENGTH
-        self._graph_ball_radius = int(BALL_ACTUAL_RADIUS * self._graph_pixel_size)
-        self._graph_base = np.zeros((self.GRAPH_SIZE, self.GRAPH_SIZE, 3), dtype=np.uint8)
-        cv.rectangle(self._graph_base, self._graph_offset(-0.5 * field_width * self._graph_pixel_size, -0.5 * field_depth * self._graph_pixel_size), self._graph_offset(0.5 * field_width * self._graph_pixel_size, 0.5 * field_depth * self._graph_pixel_size), (255, 0, 0), 4)
+        # live ticks are paced on the monotonic clock, a replay on its own clock
+        tick_clock = MONOTONIC_CLOCK if clock is time else clock
+        self._ticks: Optional[TickScheduler] = TickScheduler(control_rate, tick_clock) if control_rate > 0 else None
+        sample_time = self.PID_SAMPLE_FRACTION / (control_rate if control_rate > 0 else SYSTEM_FREQUENCY)
+        self._y_pid: simple_pid.PID = simple_pid.PID(-50, -0.5, -2.5, setpoint=0, sample_time=sample_time, output_limits=(-self._xy_speed, self._xy_speed))
 
         # dynamic states
         self._position: rm.ChassisPosition = rm.ChassisPosition(0, 0, 0)
         self._position_last_seen: Optional[float] = None
         self._ball_distances: Optional[Tuple[float, float, float]] = None
+        self._ball_filter: Optional[BallKalman] = BallKalman() if ball_filter else None
+        self._vision_hint = vision_hint
+        self._loop_rate = loop_rate
+        self._posted_hint: Optional[VisionHint] = vision_hint.full if vision_hint is not None else None
         self._vision_last_updated: Optional[float] = None
         self._ball_last_seen: Optional[float] = None
         self._armor_hit_id: Optional[int] = None
         self._armor_hit_last_seen: Optional[float] = None
 
         self._last_recenter_time: float = 0
-
-        self._cmd = rm.Commander(ip, timeout)
+        # set after an armor hit, nothing is done until then
+        self._hold_until: Optional[float] = None
+        self._last_report: float = self._clock.time()
+
+        if commander is not None:
+            self._cmd = commander
+        elif async_commands:
+            self._cmd = AsyncCommander(ip, timeout, logger=self.logger)
+        else:
+            self._cmd = rm.Commander(ip, timeout)
+        if self._timings is not None:
+            self._cmd = latency.TimedCalls(self._cmd, 'cmd.')
+        self._setpoints: Optional[SetpointFilter] = None
+        if setpoint_rate > 0:
+            self._setpoints = self._cmd = SetpointFilter(self._cmd, setpoint_rate, clock=self._clock)
         self._cmd.robot_mode(rm.MODE_CHASSIS_LEAD)
         self._cmd.gimbal_moveto(pitch=-10)
 
         self._init_state()
 
-    def _graph_offset(self, x: float, y: float) -> Tuple[int, int]:
-        center = 0.5 * self.GRAPH_SIZE
-        return int(center + x), int(center + y)
+    @property
+    def state(self) -> KeeperState:
+        return self._state
 
     def close(self):
         self._cmd.close()
+        if self._timings is not None:
+            self._timings.dump()
         super().close()
 
     def _next_state(self):
@@ -132,7 +388,8 @@ class KeeperMind(rmf.Worker):
 
     def _dequeue_vision(self):
         vision_data = None
-        now = time.time()
+        now = self._clock.time()
+        # a Mailbox hands out only its latest value, so this takes a single read
         while not self.closed:
             try:
                 vision_data = self._vision.get_nowait()
@@ -140,9 +397,25 @@ class KeeperMind(rmf.Worker):
                 return
 
             self._vision_last_updated = now
-            if vision_data is not None:
-                self._ball_distances = vision_data
-                self._ball_last_seen = now
+            if vision_data is None:
+                continue
+            *distances, captured_at = vision_data
+            # from decoding the frame to the controller acting on it
+            latency.record('frame-to-decision', now - captured_at)
+            self._ball_last_seen = now
+            if self._ball_filter is not None:
+                pose = (self._position.x, self._position.y, self._position.z)
+                self._ball_filter.update(pose, distances[:2], captured_at - CAMERA_LATENCY)
+            else:
+                self._ball_distances = tuple(distances)
+
+    def _predict_ball(self):
+        if self._ball_filter is None or self._ball_last_seen is None:
+            return
+        pose = (self._position.x, self._position.y, self._position.z)
+        predicted = self._ball_filter.relative(pose, self._clock.time())
+        if predicted is not None:
+            self._ball_distances = predicted
 
     def _dequeue_push(self):
         push = None
@@ -152,9 +425,12 @@ class KeeperMind(rmf.Worker):
             except queue.Empty:
                 return
 
-            self._position_last_seen = time.time()
+            self._position_last_seen = self._clock.time()
             if type(push) == rm.ChassisPosition:
                 self._position.x, self._position.y = push.x, push.y
+                # ChassisMailbox merges yaw into position
+                if push.z is not None:
+                    self._position.z = push.z
             elif type(push) == rm.ChassisAttitude:
                 self._position.z = push.yaw
             else:
@@ -167,14 +443,14 @@ class KeeperMind(rmf.Worker):
                 hit = self._event.get_nowait()
             except queue.Empty:
                 return
-            self._armor_hit_last_seen = time.time()
+            self._armor_hit_last_seen = self._clock.time()
             if type(hit) == rm.ArmorHitEvent:
                 self._armor_hit_id = hit.index
             else:
                 raise ValueError(f'unexpected event content: {hit}')
 
     def _recenter_to_field(self):
-        self._last_recenter_time = time.time()
+        self._last_recenter_time = self._clock.time()
         diff_x = 0 if math.fabs(self._position.x) < self.DISTANCE_EPS else self._position.x
         diff_y = 0 if math.fabs(self._position.y) < self.DISTANCE_EPS else self._position.y
         diff_z = 0 if math.fabs(self._position.z) < self.DEGREE_EPS else self._position.z
@@ -182,7 +458,7 @@ class KeeperMind(rmf.Worker):
             self._cmd.chassis_move(-self._position.x, -self._position.y, -diff_z, speed_xy=self._xy_speed, speed_z=self._z_speed)
 
     def _watch(self):
-        now = time.time()
+        now = self._clock.time()
         if now - self._last_recenter_time > 3:
             self._recenter_to_field()
 
@@ -202,12 +478,11 @@ class KeeperMind(rmf.Worker):
                     self._next_state()
                     return False
 
-            time.sleep(self.SLEEP_SECONDS)
-            self._reset_state()
+            self._hold_until = self._clock.time() + self.HIT_HOLD_SECONDS
             return False
 
         # timeout
-        now = time.time()
+        now = self._clock.time()
         if now - self._ball_last_seen > self.BALL_ABSENT_TIMEOUT:
             self._reset_state()
             return False
@@ -250,7 +525,8 @@ class KeeperMind(rmf.Worker):
         if forward < 0.3:
             self._next_state()
             return
-        vy = self._y_pid(lateral)
+        with latency.stage('pid'):
+            vy = self._y_pid(lateral)
         vy = 0 if math.fabs(vy) < 0.1 else vy
         if vy != 0:
             self._cmd.chassis_speed(y=vy)
@@ -263,159 +539,371 @@ class KeeperMind(rmf.Worker):
             return
 
         forward, lateral, horizontal_degree = self._ball_distances
-        vy = self._y_pid(lateral)
+        with latency.stage('pid'):
+            vy = self._y_pid(lateral)
         vy = 0 if math.fabs(vy) < 0.1 else vy
         if vy != 0:
             self._cmd.chassis_speed(x=self._xy_speed, y=vy)
         else:
             self._cmd.chassis_speed(x=self._xy_speed)
 
+    def _hint_vision(self):
+        full = self._vision_hint.full
+        now = self._clock.time()
+        if self._state != KeeperState.WATCHING:
+            hint = full
+        elif self._ball_last_seen is None or now - self._ball_last_seen > self.BALL_LOST_AFTER:
+            # an empty field, vision speeds up by itself once a ball shows up
+            hint = VisionHint(self.IDLE_VISION_FPS, max(full.pyramid_level, self.IDLE_PYRAMID_LEVEL), False, True)
+        elif self._ball_distances[0] > self.CHASE_EXIT_FORWARD_THRESHOLD:
+            hint = VisionHint(self.FAR_VISION_FPS, full.pyramid_level, False, False)
+        else:
+            hint = full
+
+        if hint != self._posted_hint:
+            self._vision_hint.post(hint)
+            self._posted_hint = hint
+
     def _draw_graph(self):
         if self._ball_distances is None:
             return
 
-        graph = self._graph_base.copy()
-
-        chassis_x = self._position.y
-        chassis_y = self._position.x
-        chassis_x_pixel, chassis_y_pixel = self._graph_offset(chassis_x * self._graph_pixel_size, chassis_y * self._graph_pixel_size)
-        cv.rectangle(graph, (int(chassis_x_pixel - self._graph_chassis_width / 2), int(chassis_y_pixel - self._graph_chassis_length / 2)), (int(chassis_x_pixel + self._graph_chassis_width / 2), int(chassis_y_pixel + self._graph_chassis_length / 2)), (0, 0, 255), 2)
-
-        forward, lateral, _ = self._ball_distances
-        ball_x_pixel, ball_y_pixel = self._graph_offset((lateral + self._position.y) * self._graph_pixel_size, (forward + self._position.x) * self._graph_pixel_size)
-
-        cv.circle(graph, (ball_x_pixel, ball_y_pixel), self._graph_ball_radius, (0, 255, 0), 2)
-        cv.circle(graph, (ball_x_pixel, ball_y_pixel), 1, (0, 128, 128), 2)
-        cv.putText(graph, str(self._state), (20, 20), cv.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-
-        now = time.time()
-        cv.putText(graph, 'vision heath: %.2f ms' % ((now - self._vision_last_updated) * 1000 if self._vision_last_updated is not None else -1.0), (20, 70), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        cv.putText(graph, 'position heath: %.2f ms' % ((now - self._position_last_seen) * 1000 if self._position_last_seen is not None else -1.0), (20, 120), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        cv.putText(graph, 'hit last seen: %.2f ms' % ((now - self._armor_hit_last_seen) * 1000 if self._armor_hit_last_seen is not None else -1.0), (20, 170), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        cv.putText(graph, 'robot position: %.2f, %.2f, %2f' % (self._position.x, self._position.y, self._position.z), (20, 220), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        cv.putText(graph, 'ball last seen: %.2f ms' % ((now - self._ball_last_seen) * 1000 if self._vision_last_updated is not None else -1.0), (20, 270), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-
-        cv.imshow('graph', graph)
-        cv.waitKey(1)
+        now = self._clock.time()
+        self._graph.publish(GraphSnapshot(
+            state=self._state,
+            position=(self._position.x, self._position.y, self._position.z),
+            ball_distances=self._ball_distances,
+            vision_age=now - self._vision_last_updated if self._vision_last_updated is not None else None,
+            position_age=now - self._position_last_seen if self._position_last_seen is not None else None,
+            hit_age=now - self._armor_hit_last_seen if self._armor_hit_last_seen is not None else None,
+            ball_age=now - self._ball_last_seen if self._ball_last_seen is not None else None,
+            stages=self._timings.summary() if self._timings is not None else [],
+        ))
 
     def _tick(self):
         self._armor_hit_id = None
 
-        self._dequeue_vision()
-        self._dequeue_push()
-        self._dequeue_event()
-
-        self._draw_graph()
-
-    def work(self) -> None:
-        self._tick()
-
-        if self._state == KeeperState.WATCHING:
-            self._watch()
-        elif self._state == KeeperState.CHASING:
-            self._chase()
-        elif self._state == KeeperState.KICKING:
-            self._kick()
-        else:
-            raise ValueError(f'unknown state {self._state}')
-
-
-def contour_analysis(cnt) -> Tuple[int, int]:
-    approx = cv.approxPolyDP(cnt, 0.01 * cv.arcLength(cnt, True), True)
-    area = cv.contourArea(cnt)
-    return len(approx), area
+        with latency.stage('dequeue'):
+            self._dequeue_vision()
+            self._dequeue_push()
+            self._dequeue_event()
+        self._predict_ball()
 
+        if self._graph is not None and self._graph.ready():
+            self._draw_graph()
 
-def biggest_circle_cnt(cnts: List):
-    found_cnt = None
-    found_edges = 0
-    found_area = 0
-
-    for cnt in cnts:
-        edges, area = contour_analysis(cnt)
-        if edges > 8 \
-                and 260 < area < 20000 \
-                and edges > found_edges \
-                and area > found_area:
-            found_edges = edges
-            found_area = area
-            found_cnt = cnt
-
-    return found_cnt
-
-
-def vision(frame, logger: logging.Logger) -> Optional[Tuple[float, float, float]]:
-    processed = cv.GaussianBlur(frame, (11, 11), 0)
-    processed = cv.cvtColor(processed, cv.COLOR_BGR2HSV)
+    def _hold(self):
+        if self._clock.time() >= self._hold_until:
+            self._hold_until = None
+            self._reset_state()
 
-    mask = cv.inRange(processed, GREEN_LOWER, GREEN_UPPER)
-    mask = cv.morphologyEx(mask, cv.MORPH_OPEN, None)
-    cnts, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    def _report_ticks(self):
+        now = self._clock.time()
+        if now - self._last_report >= self.REPORT_INTERVAL:
+            self._last_report = now
+            self.logger.debug('ticks: %s, late: %s, overruns: %s',
+                              self._ticks.ticks, self._ticks.late, self._ticks.overruns)
 
-    ball_cnt = biggest_circle_cnt(cnts)
-    if ball_cnt is None:
+    def work(self) -> None:
+        if self._ticks is not None:
+            lateness = self._ticks.wait()
+            latency.record('tick-late', lateness)
+            self._report_ticks()
+        if self._loop_rate is not None:
+            self._loop_rate.tick()
+        with latency.stage('work'):
+            self._tick()
+
+            if self._hold_until is not None:
+                self._hold()
+            elif self._state == KeeperState.WATCHING:
+                self._watch()
+            elif self._state == KeeperState.CHASING:
+                self._chase()
+            elif self._state == KeeperState.KICKING:
+                self._kick()
+            else:
+                raise ValueError(f'unknown state {self._state}')
+
+            if self._setpoints is not None:
+                self._setpoints.send_pending()
+            if self._vision_hint is not None:
+                self._hint_vision()
+
+        if self._timings is not None:
+            self._timings.maybe_dump()
+
+
+@dataclasses.dataclass
+class VisionAnnotation:
+    circle: Optional[Circle]
+    roi: Optional[Tuple[int, int, int, int]]
+    distances: Optional[Tuple[float, float, float]]
+    # (stage, count, p50 ms, p99 ms) of the vision process
+    stages: List[Tuple[str, int, float, float]] = dataclasses.field(default_factory=list)
+    # index of the annotated frame in the frame ring
+    frame_index: int = -1
+    # the frame itself when there is no frame ring, that is without shared memory
+    frame: Optional[np.ndarray] = None
+
+
+def _annotated_frame(frames: SharedRing, index: int) -> Optional[np.ndarray]:
+    # the display runs behind vision, the newest frame is mostly a later one
+    if frames.count - 1 == index:
+        latest = frames.latest()
+        if latest is not None and latest[0] == index:
+            return latest[1]
+    return frames.read(index)
+
+
+def render_vision(annotation: VisionAnnotation, frames: Optional[SharedRing] = None) -> Optional[np.ndarray]:
+    """
+    With ``frames``, the annotated frame is read from the ring, None if it is already overwritten.
+    """
+    frame = annotation.frame
+    if frames is not None:
+        frame = _annotated_frame(frames, annotation.frame_index)
+        if frame is None:
+            return None
+    _draw_stages(frame, annotation.stages, frame.shape[0] - 20 * len(annotation.stages))
+    if annotation.roi is not None:
+        x0, y0, x1, y1 = annotation.roi
+        cv.rectangle(frame, (x0, y0), (x1, y1), (255, 0, 0), 1)
+
+    if annotation.circle is None:
         cv.putText(frame, 'no ball detected', (50, 20), cv.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-        cv.imshow('vision', frame)
-        cv.waitKey(1)
-        return None
+        return frame
 
-    (x, y), pixel_radius = cv.minEnclosingCircle(ball_cnt)
-    distance = measure.pinhole_distance(BALL_ACTUAL_RADIUS, pixel_radius)
-    forward, lateral, horizontal_degree = measure.distance_decomposition(x, distance)
+    x, y, pixel_radius = annotation.circle.x, annotation.circle.y, annotation.circle.radius
+    forward, lateral, _ = annotation.distances
     cv.circle(frame, (int(x), int(y)), int(pixel_radius), (0, 255, 0), 2)
     cv.circle(frame, (int(x), int(y)), 1, (0, 0, 255), 2)
     cv.putText(frame, 'forward: %.1f cm' % (forward * 100), (50, 20), cv.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
     cv.putText(frame, 'lateral: %.1f cm' % (lateral * 100), (50, 70), cv.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+    return frame
+
+
+def vision(frame, logger: logging.Logger, tracker: Optional[RoiTracker] = None, pyramid_level: int = 0,
+           detector=find_ball, frames: Optional[SharedRing] = None,
+           recorder: Optional[SessionWriter] = None,
+           annotations: Optional[Publisher] = None,
+           timings: Optional[LatencyRecorder] = None,
+           calibration: Optional[CameraCalibration] = None,
+           tracking: bool = True, captured_at: Optional[float] = None,
+           loop_rate: Optional[LoopCounter] = None) -> Optional[Tuple[float, float, float, float]]:
+    """
+    ``tracking`` switches ``tracker`` off for this frame, as hinted by the controller.
+    With ``calibration``, distances come from the undistorted circle instead of the nominal focal length.
+    ``captured_at`` is when the frame was decoded, default to now. ``loop_rate`` counts processed frames.
+    Frames are put into ``frames`` for the display and other readers, instead of being pickled with annotations.
+
+    :return: forward and lateral distance in meters, horizontal angle in degrees and the time the frame came in,
+        None if there is no ball
+    """
+    if captured_at is None:
+        captured_at = time.time()
+    if loop_rate is not None:
+        loop_rate.tick()
+    if timings is not None:
+        if latency.current() is not timings:
+            timings.install()
+        # handing the last result to the queue and waiting for a newer frame
+        timings.since('frame-wait')
+        # time the frame spent between decoding and processing
+        timings.record('frame-age', time.time() - captured_at)
+
+    if frames is not None:
+        with latency.stage('frame-ring'):
+            frames.put(frame)
+    if recorder is not None:
+        with latency.stage('record'):
+            recorder.write(frame, captured_at)
+
+    if not tracking and tracker is not None:
+        # the ROI is stale once tracking comes back
+        tracker.reset()
+        tracker = None
+    with latency.stage('locate'):
+        circle = locate_ball(frame, tracker, pyramid_level, detector)
+    distances = ball_distances(circle, calibration, (frame.shape[1], frame.shape[0])) if circle is not None else None
+
+    # drawing is left to the display worker
+    if annotations is not None and annotations.ready():
+        roi = tracker.roi if tracker is not None else None
+        stages = timings.summary() if timings is not None else []
+        if frames is not None:
+            annotation = VisionAnnotation(circle, roi, distances, stages, frame_index=frames.count - 1)
+        else:
+            annotation = VisionAnnotation(circle, roi, distances, stages, frame=frame)
+        annotations.publish(annotation)
 
-    cv.imshow('vision', frame)
-    cv.waitKey(1)
-
-    return forward, lateral, horizontal_degree
+    if timings is not None:
+        timings.maybe_dump()
+        timings.mark('frame-wait')
+    if distances is None:
+        return None
+    return (*distances, captured_at)
 
 
 @click.command()
-@click.option('--ip', default='', type=str, help='(Optional) IP of Robomaster EP')
+@click.option('--ip', 'ips', default=('',), type=str, multiple=True, help='(Optional) IP of Robomaster EP, repeat to keep goal with several robots')
 @click.option('--timeout', default=10.0, type=float, help='(Optional) Timeout for commands')
 @click.option('--max-width', default=0.5, type=float, help='(Optional) Field width')
 @click.option('--max-depth', default=0.5, type=float, help='(Optional) Field depth')
 @click.option('--xy-speed', default=0.4, type=float, help='(Optional) Speed in x and y direction')
 @click.option('--z-speed', default=60, type=float, help='(Optional) Speed in z direction(chassis roll)')
-def cli(ip: str, timeout: float, max_width: float, max_depth: float, xy_speed: float, z_speed: float):
+@click.option('--tracking/--no-tracking', default=False, help='(Optional) Search around the last detected ball instead of the full frame')
+@click.option('--tracking-misses', default=5, type=int, help='(Optional) Misses before tracking falls back to full frame search')
+@click.option('--pyramid-level', default=0, type=click.IntRange(0, 3), help='(Optional) Find candidates on frame downscaled by 2^level first')
+@click.option('--segmentation', 'segmentation_backend', default=segmentation.BACKEND_BLUR_HSV, type=click.Choice(segmentation.BACKENDS), help='(Optional) Backend classifying ball pixels')
+@click.option('--detector', 'detector_backend', default=BACKEND_CONTOURS, type=click.Choice(DETECTORS), help='(Optional) Backend finding the ball, see tools/bench-detector.py detectors')
+@click.option('--transport', default=TRANSPORT_QUEUE, type=click.Choice((TRANSPORT_QUEUE, TRANSPORT_SHARED_MEMORY)), help='(Optional) Channel for detections, pushes and displayed frames, shm requires Python 3.8+')
+@click.option('--record', default=None, type=click.Path(file_okay=False), help='(Optional) Directory to record video, pushes and events for tools/replay.py')
+@click.option('--headless', is_flag=True, help='(Optional) Skip all rendering and windows')
+@click.option('--viz-frequency', default=VIZ_FREQUENCY, type=float, help='(Optional) Refresh rate of vision and graph windows')
+@click.option('--async-commands/--blocking-commands', default=True, help='(Optional) Pipeline controller commands in the background instead of waiting for every answer')
+@click.option('--setpoint-rate', default=SETPOINT_MAX_RATE, type=float, help='(Optional) Max speed setpoints per second and actuator, unchanged ones are dropped, 0 sends every one')
+@click.option('--control-rate', default=SYSTEM_FREQUENCY, type=click.FloatRange(min=1), help='(Optional) Control loop ticks per second, late ticks and overruns are logged')
+@click.option('--ball-filter/--no-ball-filter', default=False, help='(Optional) Track the ball with a Kalman filter, predicted to every tick')
+@click.option('--adaptive-vision/--no-adaptive-vision', default=False, help='(Optional) Process few, downscaled frames while watching an empty field, every frame with ROI tracking while chasing')
+@click.option('--calibration', 'calibration_path', default=None, type=click.Path(exists=True, dir_okay=False), help='(Optional) calibration.json from tools/calibrate-camera.py for accurate distances')
+@click.option('--hsv-profile', default=None, type=click.Path(exists=True, dir_okay=False), help='(Optional) HSV bounds from tools/find-ball.py tune, default to hsv-profile.json if there is one')
+@click.option('--worker-config', default=None, type=click.Path(exists=True, dir_okay=False), help='(Optional) JSON of CPU affinity, nice, SCHED_FIFO priority and OpenCV threads per worker, which then log their loop periods')
+@click.option('--latency', 'latency_dir', default=None, type=click.Path(file_okay=False), help='(Optional) Directory to dump per-stage latency histograms of vision and controller, also shown in windows')
+def cli(ips: Tuple[str, ...], timeout: float, max_width: float, max_depth: float, xy_speed: float, z_speed: float,
+        tracking: bool, tracking_misses: int, pyramid_level: int, segmentation_backend: str, detector_backend: str,
+        transport: str, record: Optional[str], headless: bool, viz_frequency: float, async_commands: bool,
+        setpoint_rate: float, control_rate: float, ball_filter: bool, adaptive_vision: bool,
+        calibration_path: Optional[str], hsv_profile: Optional[str], worker_config: Optional[str],
+        latency_dir: Optional[str]):
+    assert len(ips) == len(set(ips)), f'robots given more than once: {ips}'
+    fleet = len(ips) > 1
+    assert not (fleet and '' in ips), 'give the IP of every robot when running several'
+    tunings = load_worker_tunings(worker_config) if worker_config is not None else {}
     manager: mp.managers.SyncManager = CTX.Manager()
+    shared: List = []
 
     with manager:
         hub = rmf.Hub()
-        cmd = rm.Commander(ip=ip, timeout=timeout)
-        ip = cmd.get_ip()
-
-        # queues
-        vision_queue = manager.Queue(QUEUE_SIZE)
-        push_queue = manager.Queue(QUEUE_SIZE)
-        event_queue = manager.Queue(QUEUE_SIZE)
-
-        # vision
-        cmd.stream(True)
-        hub.worker(rmf.Vision, 'vision', (vision_queue, ip, vision), {'none_is_valid': True})
-
-        # push and event
-        cmd.chassis_push_on(position_freq=SYSTEM_FREQUENCY, attitude_freq=SYSTEM_FREQUENCY)
-        cmd.armor_sensitivity(10)
-        cmd.armor_event(rm.ARMOR_HIT, True)
-        hub.worker(rmf.PushListener, 'chassis-push', (push_queue,))
-        hub.worker(rmf.EventListener, 'armor-event', (event_queue, ip))
-
-        # controller
-        hub.worker(KeeperMind, 'controller',
+
+        def worker(worker_class, name: str, args: Tuple, kwargs: Optional[dict] = None, cpus=None):
+            # cores picked for vision, or the rest for other workers, unless the config says otherwise
+            if cpus is None:
+                cpus = rest_cpus
+            tuning = tuning_for(tunings, name)
+            if cpus is not None and (tuning is None or tuning.cpus is None):
+                tuning = dataclasses.replace(tuning or WorkerTuning(report_interval=0), cpus=cpus)
+            hub.worker(tuned(worker_class, tuning), name, args, kwargs)
+        # one display, one push listener and one rate report serve all robots
+        panels: List[Panel] = []
+        push_routes = {}
+        rates = LoopRates(ips) if fleet else None
+        cpus = vision_cpus(len(ips)) if fleet else [None]
+        rest_cpus = other_cpus(cpus) if fleet else None
+
+        for index, ip in enumerate(ips):
+            cmd = rm.Commander(ip=ip, timeout=timeout)
+            ip = cmd.get_ip()
+            suffix = f'-{ip}' if fleet else ''
+            robot_record = os.path.join(record, ip) if record is not None and fleet else record
+
+            # queues
+            if transport == TRANSPORT_SHARED_MEMORY:
+                # vision and push are latest-wins, events stay on a lossless queue
+                vision_queue = DetectionMailbox(4)
+                push_queue = ChassisMailbox()
+                shared.extend((vision_queue, push_queue))
+            else:
+                vision_queue = manager.Queue(QUEUE_SIZE)
+                push_queue = manager.Queue(QUEUE_SIZE)
+            event_queue = manager.Queue(QUEUE_SIZE)
+
+            # visualization, a stale item is as good as a dropped one
+            vision_annotations, graph, frame_ring = None, None, None
+            if not headless:
+                annotation_queue = manager.Queue(1)
+                graph_queue = manager.Queue(1)
+                vision_annotations = Publisher(annotation_queue, viz_frequency)
+                graph = Publisher(graph_queue, viz_frequency)
+                if transport == TRANSPORT_SHARED_MEMORY:
+                    # annotations only carry the index of their frame, the display reads it from here
+                    frame_ring = SharedRing(FRAME_SHAPE, slots=FRAME_RING_SLOTS)
+                    shared.append(frame_ring)
+                panels.extend((
+                    (f'vision{suffix}', annotation_queue, functools.partial(render_vision, frames=frame_ring)),
+                    (f'graph{suffix}', graph_queue, FieldGraph(max_width, max_depth)),
+                ))
+
+            # vision
+            cmd.stream(True)
+            # lookup tables are built here once and cached on disk for the vision process
+            segmenter = segmentation.make_segmenter(segmentation_backend, *segmentation.hsv_bounds(hsv_profile))
+            detector = make_detector(detector_backend, segmenter)
+            calibration = CameraCalibration.load(calibration_path) if calibration_path is not None else None
+            vision_hint = None
+            robot_tracking = tracking
+            if adaptive_vision:
+                # ROI tracking is switched on while chasing and kicking
+                vision_hint = VisionHintChannel(VisionHint(0, pyramid_level, True, False))
+                robot_tracking = True
+            tracker = RoiTracker(tracking_misses, pyramid_level, detector) if robot_tracking else None
+            recorder = SessionWriter(robot_record, STREAM_VISION) if robot_record is not None else None
+            processing = functools.partial(vision, tracker=tracker, pyramid_level=pyramid_level, detector=detector,
+                                           frames=frame_ring, recorder=recorder, annotations=vision_annotations,
+                                           calibration=calibration,
+                                           timings=LatencyRecorder(f'vision{suffix}', latency_dir) if latency_dir is not None else None,
+                                           loop_rate=rates.counter(index, LOOP_VISION) if rates is not None else None)
+            if vision_hint is not None:
+                worker(ScheduledVision, f'vision{suffix}', (vision_queue, ip, processing, vision_hint),
+                       {'none_is_valid': True}, cpus[index])
+            else:
+                worker(LatestFrameVision, f'vision{suffix}', (vision_queue, ip, processing),
+                       {'none_is_valid': True}, cpus[index])
+
+            # push and event
+            cmd.chassis_push_on(position_freq=SYSTEM_FREQUENCY, attitude_freq=SYSTEM_FREQUENCY)
+            cmd.armor_sensitivity(10)
+            cmd.armor_event(rm.ARMOR_HIT, True)
+            push_out, event_out = push_queue, event_queue
+            if robot_record is not None:
+                push_out = RecordingChannel(push_queue, SessionWriter(robot_record, STREAM_PUSH))
+                event_out = RecordingChannel(event_queue, SessionWriter(robot_record, STREAM_EVENT))
+            if fleet:
+                push_routes[ip] = push_out
+            else:
+                worker(rmf.PushListener, 'chassis-push', (push_out,))
+            worker(rmf.EventListener, f'armor-event{suffix}', (event_out, ip))
+
+            # controller
+            worker(KeeperMind, f'controller{suffix}',
                    (ip, vision_queue, push_queue, event_queue, max_width, max_depth),
                    {
                        'timeout': timeout,
                        'xy_speed': xy_speed,
                        'z_speed': z_speed,
+                       'graph': graph,
+                       'timings': LatencyRecorder(f'controller{suffix}', latency_dir) if latency_dir is not None else None,
+                       'async_commands': async_commands,
+                       'setpoint_rate': setpoint_rate,
+                       'ball_filter': ball_filter,
+                       'vision_hint': vision_hint,
+                       'loop_rate': rates.counter(index, LOOP_CONTROL) if rates is not None else None,
+                       'control_rate': control_rate,
                    },
                    )
 
-        hub.run()
-
+        if len(push_routes) > 0:
+            worker(PushRouter, 'chassis-push', (push_routes,))
+        if len(panels) > 0:
+            worker(Display, 'display', (panels, viz_frequency))
+        if rates is not None:
+            worker(RateReporter, 'loop-rates', (rates,))
+
+        try:
+            hub.run()
+        finally:
+            for block in shared:
+                block.close()
 
 if __name__ == '__main__':
     cli()
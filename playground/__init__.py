@@ -0,0 +1,3 @@
+"""
+Building blocks shared by goalkeeper, drive and tools.
+"""
@@ -0,0 +1,84 @@
+import collections
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+from robomasterpy import CTX
+
+from playground.detection import Circle, find_ball
+from playground.ipc import SharedSlots
+
+# set in each pool process by _init_worker()
+_slots: Optional[SharedSlots] = None
+_pyramid_level: int = 0
+_detector = find_ball
+
+
+def _init_worker(slots: SharedSlots, pyramid_level: int, detector):
+    global _slots, _pyramid_level, _detector
+    _slots = slots
+    _pyramid_level = pyramid_level
+    _detector = detector
+
+
+def _detect(slot: int, frame: Optional[np.ndarray] = None) -> Optional[Circle]:
+    if frame is None:
+        frame = _slots[slot]
+    return _detector(frame, pyramid_level=_pyramid_level)
+
+
+def detect_batch(frames: Iterable[np.ndarray], workers: Optional[int] = None, window: Optional[int] = None,
+                 pyramid_level: int = 0, detector=find_ball) -> Iterator[Optional[Circle]]:
+    """
+    Detect the ball on every frame over a process pool, yield the results in input order.
+
+    Frames are copied into shared memory slots instead of being pickled, one slot per frame in flight,
+    and at most ``window`` frames are in flight, so that memory stays bounded on long recordings.
+    Frames are independent: there is no ROI tracking, and no drawing or imshow.
+    A ``detector`` depending on the previous frame, like ``TemplateDetector``, sees every worker's share only.
+    Frames whose shape differs from the first one are pickled to the pool.
+
+    :param workers: pool size, default to number of CPUs.
+    :param window: frames in flight, default to twice the pool size.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if window is None:
+        window = 2 * workers
+    assert workers > 0 and window > 0, f'workers and window must be positive, got {workers}, {window}'
+
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        return
+
+    slots = SharedSlots(first.shape, first.dtype, window)
+    free = collections.deque(range(window))
+    in_flight = collections.deque()
+    try:
+        with ProcessPoolExecutor(workers, mp_context=CTX, initializer=_init_worker,
+                                 initargs=(slots, pyramid_level, detector)) as executor:
+            for frame in _chain(first, frames):
+                if len(free) == 0:
+                    future, slot = in_flight.popleft()
+                    yield future.result()
+                    free.append(slot)
+
+                slot = free.popleft()
+                if frame.shape == slots.shape and frame.dtype == slots.dtype:
+                    slots[slot][...] = frame
+                    in_flight.append((executor.submit(_detect, slot), slot))
+                else:
+                    in_flight.append((executor.submit(_detect, slot, frame), slot))
+
+            while len(in_flight) > 0:
+                future, _ = in_flight.popleft()
+                yield future.result()
+    finally:
+        slots.close()
+
+
+def _chain(first: np.ndarray, rest: Iterator[np.ndarray]) -> Iterator[np.ndarray]:
+    yield first
+    yield from rest
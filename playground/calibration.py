@@ -0,0 +1,109 @@
+import hashlib
+import json
+import math
+import os
+from typing import Optional, Tuple
+
+import cv2 as cv
+import numpy as np
+
+from playground.detection import BALL_ACTUAL_RADIUS, Circle
+from playground.segmentation import LUT_CACHE_DIR
+
+# points on the circle undistorted along with its center
+CIRCLE_SAMPLES: int = 16
+
+
+class CameraCalibration:
+    """
+    Camera matrix and distortion coefficients as written by ``tools/calibrate-camera.py calc``,
+    for frames of ``image_size`` (width, height); the camera matrix is scaled for other sizes.
+
+    Distances come from undistorting a few points of the detected circle rather than the frame.
+    Full frame undistortion maps are built on first use and cached on disk keyed by calibration and size.
+    """
+
+    def __init__(self, camera_matrix, dist_coeffs, image_size: Optional[Tuple[int, int]] = None,
+                 cache_dir: Optional[str] = LUT_CACHE_DIR):
+        self.camera_matrix = np.array(camera_matrix, dtype=np.float64).reshape(3, 3)
+        self.dist_coeffs = np.array(dist_coeffs, dtype=np.float64).ravel()
+        self.image_size = None if image_size is None else tuple(image_size)
+        self._cache_dir = cache_dir
+        self._maps = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_maps'] = {}
+        return state
+
+    @classmethod
+    def load(cls, path: str, cache_dir: Optional[str] = LUT_CACHE_DIR) -> 'CameraCalibration':
+        with open(path) as reader:
+            properties = json.load(reader)
+        return cls(properties['camera_matrix'], properties['distortion_coefficients'], properties.get('image_size'),
+                   cache_dir)
+
+    def camera_matrix_for(self, size: Tuple[int, int]) -> np.ndarray:
+        if self.image_size is None or tuple(size) == self.image_size:
+            return self.camera_matrix
+        scale = np.diag([size[0] / self.image_size[0], size[1] / self.image_size[1], 1.0])
+        return scale @ self.camera_matrix
+
+    def _cache_path(self, size: Tuple[int, int]) -> Optional[str]:
+        if self._cache_dir is None:
+            return None
+        digest = hashlib.sha1(self.camera_matrix_for(size).tobytes() + self.dist_coeffs.tobytes()).hexdigest()[:16]
+        return os.path.join(self._cache_dir, f'undistort-{digest}-{size[0]}x{size[1]}.npz')
+
+    def undistort_maps(self, size: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        ``cv.initUndistortRectifyMap()`` tables for ``cv.remap()`` of frames of ``size`` (width, height).
+        """
+        size = tuple(size)
+        maps = self._maps.get(size)
+        if maps is not None:
+            return maps
+
+        path = self._cache_path(size)
+        if path is not None and os.path.exists(path):
+            with np.load(path) as cached:
+                maps = cached['map1'], cached['map2']
+        else:
+            camera_matrix = self.camera_matrix_for(size)
+            maps = cv.initUndistortRectifyMap(camera_matrix, self.dist_coeffs, None, camera_matrix, size, cv.CV_16SC2)
+            if path is not None:
+                os.makedirs(self._cache_dir, exist_ok=True)
+                # several processes may build the same maps at once
+                temp_path = f'{path}.{os.getpid()}.npz'
+                np.savez(temp_path, map1=maps[0], map2=maps[1])
+                os.replace(temp_path, path)
+        self._maps[size] = maps
+        return maps
+
+    def undistort(self, frame: np.ndarray) -> np.ndarray:
+        map1, map2 = self.undistort_maps((frame.shape[1], frame.shape[0]))
+        return cv.remap(frame, map1, map2, cv.INTER_LINEAR)
+
+    def ball_distances(self, circle: Circle, size: Tuple[int, int],
+                       ball_radius: float = BALL_ACTUAL_RADIUS) -> Tuple[float, float, float]:
+        """
+        Like ``detection.ball_distances()``, from the rays through the circle undistorted.
+        The ball subtends the mean angle between the rays of its edge and their axis,
+        which gives the distance without assuming a focal length or a linear angle model.
+
+        :param size: width and height of the frame ``circle`` was found on
+        :return: forward and lateral distance in meters, horizontal angle in degrees
+        """
+        angles = np.linspace(0, 2 * math.pi, CIRCLE_SAMPLES, endpoint=False)
+        points = np.column_stack((circle.x + circle.radius * np.cos(angles), circle.y + circle.radius * np.sin(angles)))
+        # normalized image coordinates, the rays are (x, y, 1)
+        normalized = cv.undistortPoints(points.reshape(-1, 1, 2), self.camera_matrix_for(size), self.dist_coeffs)
+        rays = np.column_stack((normalized.reshape(-1, 2), np.ones(CIRCLE_SAMPLES)))
+        rays /= np.linalg.norm(rays, axis=1, keepdims=True)
+        axis = rays.mean(axis=0)
+        axis /= np.linalg.norm(axis)
+        half_angle = float(np.mean(np.arccos(np.clip(rays @ axis, -1.0, 1.0))))
+
+        distance = ball_radius / math.sin(half_angle)
+        rad = math.atan2(axis[0], axis[2])
+        return distance * math.cos(rad), distance * math.sin(rad), math.degrees(rad)
@@ -0,0 +1,240 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import cv2 as cv
+import numpy as np
+from robomasterpy import CTX
+
+from playground.segmentation import LUT_CACHE_DIR
+
+CHARUCO_CACHE_DIR: str = os.path.join(LUT_CACHE_DIR, 'charuco')
+MIN_VIEW_CORNERS: int = 4
+MAX_VIEWS: int = 40
+COVERAGE_GRID: Tuple[int, int] = (8, 6)  # cells across and down the image
+
+
+@dataclass(frozen=True)
+class BoardSpec:
+    """
+    Parameters of the printed ChArUco board, boards are built from it in every process.
+    """
+    x: int = 9
+    y: int = 7
+    square_length: float = 0.02
+    marker_length: float = 0.015
+    dictionary: int = cv.aruco.DICT_APRILTAG_36h11
+
+    @property
+    def key(self) -> str:
+        return f'{self.x}x{self.y}-{self.square_length}-{self.marker_length}-{self.dictionary}'
+
+    def create(self):
+        """
+        :return: board and dictionary
+        """
+        dictionary = cv.aruco.getPredefinedDictionary(self.dictionary)
+        board = cv.aruco.CharucoBoard_create(self.x, self.y, self.square_length, self.marker_length, dictionary)
+        return board, dictionary
+
+
+@dataclass
+class View:
+    """
+    ChArUco corners found on one calibration image, ``corners`` and ``ids`` are None if there is none.
+    """
+    path: str
+    size: Optional[Tuple[int, int]]  # width, height, None if the image can not be read
+    corners: Optional[np.ndarray]
+    ids: Optional[np.ndarray]
+
+    @property
+    def usable(self) -> bool:
+        return self.corners is not None and len(self.corners) >= MIN_VIEW_CORNERS
+
+
+def detect_corners(frame, board, dictionary):
+    corners, ids, rejected = cv.aruco.detectMarkers(frame, dictionary)
+    corners, ids, rejected, recovered = cv.aruco.refineDetectedMarkers(frame, board, corners, ids, rejected)
+    if corners is None or len(corners) == 0:
+        return None, None
+    retval, charuco_corners, charuco_ids = cv.aruco.interpolateCornersCharuco(corners, ids, frame, board)
+    return charuco_corners, charuco_ids
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as reader:
+        for chunk in iter(lambda: reader.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CornerCache:
+    """
+    Views on disk keyed by image content and board, so that renamed or copied images are not detected again.
+    """
+
+    def __init__(self, directory: str, spec: BoardSpec):
+        self._directory = directory
+        self._spec = spec
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self._directory, f'{digest}-{self._spec.key}.npz')
+
+    def load(self, path: str, digest: str) -> Optional[View]:
+        cache_path = self._path(digest)
+        if not os.path.exists(cache_path):
+            return None
+        with np.load(cache_path) as cached:
+            corners = cached['corners'] if 'corners' in cached else None
+            ids = cached['ids'] if 'ids' in cached else None
+            return View(path, tuple(cached['size'].tolist()), corners, ids)
+
+    def save(self, digest: str, view: View):
+        os.makedirs(self._directory, exist_ok=True)
+        arrays = {'size': np.array(view.size)}
+        if view.corners is not None:
+            arrays['corners'] = view.corners
+            arrays['ids'] = view.ids
+        # several runs may share the cache
+        temp_path = f'{self._path(digest)}.{os.getpid()}.npz'
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, self._path(digest))
+
+
+# set in each pool process by _init_worker()
+_board = None
+_dictionary = None
+
+
+def _init_worker(spec: BoardSpec):
+    global _board, _dictionary
+    _board, _dictionary = spec.create()
+
+
+def _detect(path: str) -> View:
+    frame = cv.imread(path)
+    if frame is None:
+        return View(path, None, None, None)
+    corners, ids = detect_corners(frame, _board, _dictionary)
+    return View(path, (frame.shape[1], frame.shape[0]), corners, ids)
+
+
+def collect_views(paths: Iterable[str], spec: BoardSpec, workers: Optional[int] = None,
+                  cache_dir: Optional[str] = CHARUCO_CACHE_DIR,
+                  progress: Optional[Callable[[View, bool], None]] = None) -> Iterator[View]:
+    """
+    Find ChArUco corners on every image over a process pool, yield views as they complete, cached ones first.
+
+    :param workers: pool size, default to number of CPUs.
+    :param progress: called with every view and whether it came from the cache
+    """
+    cache = CornerCache(cache_dir, spec) if cache_dir is not None else None
+    pending = []
+    for path in paths:
+        digest = file_digest(path) if cache is not None else None
+        view = cache.load(path, digest) if cache is not None else None
+        if view is None:
+            pending.append((path, digest))
+            continue
+        if progress is not None:
+            progress(view, True)
+        yield view
+
+    if len(pending) == 0:
+        return
+    with ProcessPoolExecutor(workers, mp_context=CTX, initializer=_init_worker, initargs=(spec,)) as executor:
+        futures = {executor.submit(_detect, path): digest for path, digest in pending}
+        for future in as_completed(futures):
+            view = future.result()
+            # unreadable images may still be being written
+            if cache is not None and view.size is not None:
+                cache.save(futures[future], view)
+            if progress is not None:
+                progress(view, False)
+            yield view
+
+
+def _object_points(board, view: View) -> np.ndarray:
+    return np.array(board.chessboardCorners, dtype=np.float32)[view.ids.ravel()]
+
+
+def _coverage(views: List[View]) -> np.ndarray:
+    """
+    :return: which cells of ``COVERAGE_GRID`` hold corners, one row per view
+    """
+    columns, rows = COVERAGE_GRID
+    cells = np.zeros((len(views), columns * rows), dtype=bool)
+    for i, view in enumerate(views):
+        corners = view.corners.reshape(-1, 2)
+        column = np.clip((corners[:, 0] / view.size[0] * columns).astype(int), 0, columns - 1)
+        row = np.clip((corners[:, 1] / view.size[1] * rows).astype(int), 0, rows - 1)
+        cells[i, row * columns + column] = True
+    return cells
+
+
+def _poses(views: List[View], board) -> np.ndarray:
+    """
+    :return: board normal x and y, and log distance of every view, under a rough pinhole camera
+    """
+    width, height = views[0].size
+    camera_matrix = np.array([[width, 0, width / 2], [0, width, height / 2], [0, 0, 1]], dtype=np.float64)
+    poses = np.zeros((len(views), 3))
+    for i, view in enumerate(views):
+        ok, rvec, tvec = cv.solvePnP(_object_points(board, view), view.corners.reshape(-1, 2).astype(np.float32),
+                                     camera_matrix, None)
+        if not ok:
+            continue
+        normal = cv.Rodrigues(rvec)[0][:, 2]
+        poses[i] = normal[0], normal[1], np.log(max(np.linalg.norm(tvec), 1e-6))
+    return poses
+
+
+def select_views(views: List[View], board, max_views: int = MAX_VIEWS) -> List[View]:
+    """
+    Pick at most ``max_views`` views which cover the image plane and vary the board pose,
+    since near duplicates slow calibration down without making it more accurate.
+
+    Views are added greedily, each time the one adding the most of rarely covered cells of ``COVERAGE_GRID``
+    plus pose distance to the closest view already picked.
+    """
+    if len(views) <= max_views:
+        return list(views)
+
+    cells = _coverage(views)
+    poses = _poses(views, board)
+    counts = np.zeros(cells.shape[1])
+    # distance to the closest picked pose, 1 being the spread of a board tilted by 45 degrees
+    novelty = np.ones(len(views))
+    picked = np.zeros(len(views), dtype=bool)
+    for _ in range(max_views):
+        gain = cells @ (1.0 / (1.0 + counts)) / cells.shape[1]
+        score = np.where(picked, -np.inf, gain + novelty)
+        best = int(np.argmax(score))
+        picked[best] = True
+        counts += cells[best]
+        distances = np.linalg.norm(poses - poses[best], axis=1) / np.sqrt(0.5)
+        novelty = np.minimum(novelty, distances)
+    return [view for view, chosen in zip(views, picked) if chosen]
+
+
+def reprojection_error(views: List[View], board, camera_matrix: np.ndarray, dist_coeffs: np.ndarray) -> float:
+    """
+    RMS reprojection error in pixels of ``views`` under fixed intrinsics, with the pose of every view fitted,
+    which measures intrinsics calibrated on some views against others.
+    """
+    squared = 0.0
+    points = 0
+    for view in views:
+        object_points = _object_points(board, view)
+        image_points = view.corners.reshape(-1, 2).astype(np.float32)
+        ok, rvec, tvec = cv.solvePnP(object_points, image_points, camera_matrix, dist_coeffs)
+        if not ok:
+            continue
+        projected, _ = cv.projectPoints(object_points, rvec, tvec, camera_matrix, dist_coeffs)
+        squared += float(np.sum((projected.reshape(-1, 2) - image_points) ** 2))
+        points += len(image_points)
+    return float(np.sqrt(squared / max(1, points)))
@@ -0,0 +1,376 @@
+import collections
+import inspect
+import itertools
+import logging
+import socket
+import threading
+import time
+from typing import Optional, Tuple, List, Dict
+
+import robomasterpy as rm
+from robomasterpy.client import CTRL_PORT, DEFAULT_BUF_SIZE
+
+from playground import latency
+from playground.latency import Histogram
+
+# hides the network round trip, deeper pipelines only queue setpoints up in the robot
+PIPELINE_DEPTH: int = 2
+FLUSH_TIMEOUT: float = 1.0
+
+# setpoints of the same actuator supersede each other
+COALESCED_COMMANDS: Dict[Tuple[str, str], str] = {
+    ('chassis', 'speed'): 'chassis',
+    ('chassis', 'wheel'): 'chassis',
+    ('gimbal', 'speed'): 'gimbal',
+}
+LOW_PRIORITY_COMMANDS: Tuple[str, ...] = ('led',)
+
+SETPOINT_MAX_RATE: float = 15  # per actuator, in Hz
+# changes within these are not worth sending
+SETPOINT_TOLERANCES: Dict[str, Tuple[float, ...]] = {
+    'chassis_speed': (0.01, 0.01, 1.0),  # m/s, m/s, degree/s
+    'chassis_wheel': (1, 1, 1, 1),  # rpm
+    'gimbal_speed': (1.0, 1.0),  # degree/s
+}
+SETPOINT_ACTUATORS: Dict[str, str] = {
+    'chassis_speed': 'chassis',
+    'chassis_wheel': 'chassis',
+    'gimbal_speed': 'gimbal',
+}
+
+_PRIORITY_NORMAL: int = 0
+_PRIORITY_LOW: int = 1
+_PRIORITY_QUERY: int = 2
+
+
+def _classify(words: Tuple[str, ...]) -> Tuple[int, Optional[str]]:
+    """
+    :return: priority and coalescing key, None if the command must not be coalesced
+    """
+    if '?' in words:
+        return _PRIORITY_QUERY, None
+    key = COALESCED_COMMANDS.get(words[:2])
+    if key is not None:
+        return _PRIORITY_NORMAL, key
+    if words[0] in LOW_PRIORITY_COMMANDS:
+        # e.g. one effect per LED component
+        return _PRIORITY_LOW, ' '.join(words[:4])
+    return _PRIORITY_NORMAL, None
+
+
+class _Request:
+    __slots__ = ('command', 'sent_at', 'response', 'done')
+
+    def __init__(self, command: str, wait: bool):
+        self.command = command
+        self.sent_at: float = 0.0
+        self.response: Optional[str] = None
+        self.done: Optional[threading.Event] = threading.Event() if wait else None
+
+
+class AsyncCommander(rm.Commander):
+    """
+    Commander for control loops: setting commands return ``'ok'`` at once and are sent by a background thread,
+    queries, whose commands have a ``?``, still wait for their answer.
+
+    * a speed command replaces the pending one of the same actuator, only the latest target is sent;
+    * LED effects are sent only when nothing else is pending, the latest per component;
+    * everything else is sent in order.
+
+    Up to ``pipeline`` commands are in flight, answers come back in order and are matched by a receiver thread,
+    which keeps the ack latency in ``ack_latency`` and logs every answer that is not ok.
+    Pipelining relies on answers ending with ``;``, use a ``pipeline`` of 1 otherwise.
+    Arguments are checked by ``rm.Commander`` as usual, but failures show up in the log instead of raising.
+    """
+
+    def __init__(self, ip: str = '', timeout: float = 30, pipeline: int = PIPELINE_DEPTH,
+                 logger: Optional[logging.Logger] = None):
+        assert pipeline > 0, f'pipeline must be positive, got {pipeline}'
+        # entering SDK mode in super().__init__() talks synchronously
+        super().__init__(ip, timeout)
+        self._pipeline = pipeline
+        self._logger = logger if logger is not None else logging.getLogger(__name__)
+        self._cond = threading.Condition()
+        self._ids = itertools.count()
+        self._pending: Dict[object, _Request] = collections.OrderedDict()
+        self._low: Dict[object, _Request] = collections.OrderedDict()
+        self._in_flight: collections.deque = collections.deque()
+        self.ack_latency = Histogram()
+        self.sent: int = 0
+        self.coalesced: int = 0
+        self.failed: int = 0
+
+        self._sender = threading.Thread(target=self._send_loop, name='commander-sender', daemon=True)
+        self._receiver = threading.Thread(target=self._receive_loop, name='commander-receiver', daemon=True)
+        self._sender.start()
+        self._receiver.start()
+
+    def do(self, *args) -> str:
+        assert len(args) > 0, 'empty arg not accepted'
+        assert not self._closed, 'connection is already closed'
+        words = tuple(map(str, args))
+        priority, key = _classify(words)
+        request = _Request(' '.join(words) + ';', priority == _PRIORITY_QUERY)
+
+        with self._cond:
+            pending = self._low if priority == _PRIORITY_LOW else self._pending
+            if key is None:
+                key = next(self._ids)
+            elif pending.pop(key, None) is not None:
+                self.coalesced += 1
+            # superseded or not, the newest goes last so that it stays behind commands issued before it
+            pending[key] = request
+            self._cond.notify_all()
+
+        if request.done is None:
+            return 'ok'
+        if not request.done.wait(self._timeout):
+            raise socket.timeout(f'no answer to {request.command}')
+        return request.response
+
+    def _send_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and (len(self._in_flight) >= self._pipeline or not (self._pending or self._low)):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                _, request = (self._pending if self._pending else self._low).popitem(last=False)
+                request.sent_at = time.perf_counter()
+                self._in_flight.append(request)
+                self.sent += 1
+            try:
+                self._conn.sendall(request.command.encode())
+            except OSError:
+                if not self._closed:
+                    self._logger.exception('sending %s', request.command)
+                return
+
+    def _answers(self, buffer: str) -> Tuple[List[str], str]:
+        """
+        :return: complete answers in ``buffer`` and what is left of it
+        """
+        if self._pipeline == 1:
+            return [buffer.strip(' ;')], ''
+        *answers, rest = buffer.split(';')
+        return [answer.strip() for answer in answers], rest
+
+    def _receive_loop(self):
+        buffer = ''
+        while not self._closed:
+            try:
+                data = self._conn.recv(DEFAULT_BUF_SIZE)
+            except socket.timeout:
+                if self._in_flight:
+                    self._logger.warning('no answer to %s in %s s', self._in_flight[0].command, self._timeout)
+                continue
+            except OSError:
+                return
+            if not data:
+                return
+
+            answers, buffer = self._answers(buffer + data.decode())
+            for answer in answers:
+                with self._cond:
+                    if not self._in_flight:
+                        self._logger.warning('unexpected answer %s', answer)
+                        continue
+                    request = self._in_flight.popleft()
+                    self._cond.notify_all()
+                elapsed = time.perf_counter() - request.sent_at
+                self.ack_latency.record(elapsed)
+                latency.record('cmd-ack', elapsed)
+                request.response = answer
+                if request.done is not None:
+                    request.done.set()
+                elif answer != 'ok':
+                    self.failed += 1
+                    self._logger.warning('%s: %s', request.command, answer)
+
+    def flush(self, timeout: float = FLUSH_TIMEOUT) -> bool:
+        """
+        Wait until every command is answered.
+
+        :return: False on timeout
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._pending or self._low or self._in_flight:
+                remaining = deadline - time.time()
+                if remaining <= 0 or self._closed:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        if self._closed:
+            return
+        # the last command is likely a stop
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        try:
+            self._conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        super().close()
+        self._sender.join()
+        self._receiver.join()
+
+
+class SdkStandIn:
+    """
+    Local stand-in for the plaintext SDK port of a robot. Commands are handled one at a time,
+    each taking ``delay`` seconds, and are answered with ``ok;``, queries with ``0;``.
+    Received commands are kept in ``commands`` as (time, command).
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = CTRL_PORT, delay: float = 0.005):
+        self._delay = delay
+        self._closed = False
+        self.commands: List[Tuple[float, str]] = []
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen()
+        self._threads = [threading.Thread(target=self._accept_loop, daemon=True)]
+        self._threads[0].start()
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self._serve, args=(conn,), daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _serve(self, conn: socket.socket):
+        buffer = ''
+        with conn:
+            while not self._closed:
+                try:
+                    data = conn.recv(DEFAULT_BUF_SIZE)
+                except OSError:
+                    return
+                if not data:
+                    return
+                *commands, buffer = (buffer + data.decode()).split(';')
+                for command in commands:
+                    self.commands.append((time.time(), command))
+                    time.sleep(self._delay)
+                    answer = '0;' if '?' in command else 'ok;'
+                    conn.sendall(answer.encode())
+
+    def close(self):
+        self._closed = True
+        # wakes up accept()
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()
+        self._threads[0].join()
+
+
+class SetpointFilter:
+    """
+    Stands in front of a Commander and cuts setpoint traffic, other commands pass through untouched.
+
+    * a setpoint within ``tolerances`` of the last one sent to the same actuator is dropped;
+    * an actuator gets at most ``max_rate`` setpoints per second, the latest one held back goes out
+      on a later call or ``send_pending()`` once it is due;
+    * a stop, where every value is zero, is never rate limited and is sent at once, unless the last command
+      of the actuator is the same stop;
+    * any other command of an actuator, like ``chassis_move``, forgets its last and held back setpoints,
+      since the robot no longer follows them.
+
+    ``clock`` provides ``time()``, like in ``KeeperMind``.
+    """
+    _SIGNATURES = {name: inspect.signature(getattr(rm.Commander, name)) for name in SETPOINT_TOLERANCES}
+
+    def __init__(self, commander, max_rate: float = SETPOINT_MAX_RATE,
+                 tolerances: Dict[str, Tuple[float, ...]] = SETPOINT_TOLERANCES, clock=time):
+        assert max_rate > 0, f'max_rate must be positive, got {max_rate}'
+        self._commander = commander
+        self._period = 1.0 / max_rate
+        self._tolerances = tolerances
+        self._clock = clock
+        self._actuators = {SETPOINT_ACTUATORS[name] for name in tolerances}
+        # actuator: (command, values, sent at)
+        self._last: Dict[str, Tuple[str, Tuple[float, ...], float]] = {}
+        # actuator: (command, values)
+        self._pending: Dict[str, Tuple[str, Tuple[float, ...]]] = {}
+        self.sent: int = 0
+        self.duplicates: int = 0
+        self.deferred: int = 0
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._tolerances:
+            def setpoint(*args, **kwargs) -> str:
+                return self._setpoint(name, args, kwargs)
+            return setpoint
+        attribute = getattr(self._commander, name)
+        actuator = name.split('_', 1)[0]
+        if not callable(attribute) or actuator not in self._actuators:
+            return attribute
+
+        def command(*args, **kwargs):
+            self._last.pop(actuator, None)
+            self._pending.pop(actuator, None)
+            return attribute(*args, **kwargs)
+        return command
+
+    def _values(self, name: str, args: tuple, kwargs: dict) -> Tuple[float, ...]:
+        bound = self._SIGNATURES[name].bind(None, *args, **kwargs)
+        bound.apply_defaults()
+        return tuple(bound.arguments.values())[1:]
+
+    def _close_to(self, name: str, values: Tuple[float, ...], other: Tuple[float, ...]) -> bool:
+        return all(abs(a - b) <= tolerance for a, b, tolerance in zip(values, other, self._tolerances[name]))
+
+    def _send(self, actuator: str, name: str, values: Tuple[float, ...], now: float) -> str:
+        self._pending.pop(actuator, None)
+        self._last[actuator] = (name, values, now)
+        self.sent += 1
+        return getattr(self._commander, name)(*values)
+
+    def _setpoint(self, name: str, args: tuple, kwargs: dict) -> str:
+        values = self._values(name, args, kwargs)
+        actuator = SETPOINT_ACTUATORS[name]
+        now = self._clock.time()
+        last = self._last.get(actuator)
+
+        # safety first, a stop is never held back, only dropped when the robot is already stopped by it
+        if not any(values):
+            if last is not None and last[0] == name and last[1] == values:
+                self._pending.pop(actuator, None)
+                self.duplicates += 1
+                return 'ok'
+            return self._send(actuator, name, values, now)
+
+        if last is not None and last[0] == name and self._close_to(name, values, last[1]):
+            # also cancels a held back setpoint, the robot already has this one
+            self._pending.pop(actuator, None)
+            self.duplicates += 1
+            return 'ok'
+
+        if last is None or now - last[2] >= self._period:
+            return self._send(actuator, name, values, now)
+
+        self._pending[actuator] = (name, values)
+        self.deferred += 1
+        return 'ok'
+
+    def send_pending(self):
+        """
+        Send held back setpoints which are due, call it regularly.
+        """
+        now = self._clock.time()
+        for actuator, (name, values) in list(self._pending.items()):
+            if now - self._last[actuator][2] >= self._period:
+                self._send(actuator, name, values, now)
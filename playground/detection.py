@@ -0,0 +1,282 @@
+import math
+from dataclasses import dataclass
+from typing import Tuple, List, Optional
+
+import cv2 as cv
+import numpy as np
+from robomasterpy import measure
+
+from playground import latency
+from playground.segmentation import BLUR_KERNEL_SIZE, BlurHsvSegmenter
+
+BALL_ACTUAL_RADIUS = 0.065 / 2
+MIN_BALL_AREA: float = 260
+MAX_BALL_AREA: float = 20000
+PYRAMID_MAX_CANDIDATES: int = 8
+MIN_POLYGON_EDGES: int = 8
+MIN_CIRCULARITY: float = 0.6  # a disk traced on pixels scores about 0.9, a square 0.785
+# roundness dominates the score, a contour 10% less round must be more than twice as big to win
+CIRCULARITY_WEIGHT: float = 8
+MAX_ASPECT_RATIO: float = 2.0
+MIN_FILL_RATIO: float = 0.5  # share of the bounding box, a disk fills pi / 4
+
+
+@dataclass
+class Circle:
+    x: float
+    y: float
+    radius: float
+
+
+def contour_analysis(cnt) -> Tuple[int, float, float]:
+    """
+    :return: edges of the approximated polygon, area, and circularity 4*pi*area/perimeter^2,
+        which is 1 for a circle and smaller for anything else
+    """
+    perimeter = cv.arcLength(cnt, True)
+    approx = cv.approxPolyDP(cnt, 0.01 * perimeter, True)
+    area = cv.contourArea(cnt)
+    circularity = 4 * math.pi * area / perimeter ** 2 if perimeter > 0 else 0.0
+    return len(approx), area, circularity
+
+
+def biggest_circle_cnt(cnts: List):
+    """
+    The ball sized contour scoring best on ``area * circularity ** CIRCULARITY_WEIGHT``,
+    which neither depends on the order of ``cnts`` nor lets a big ragged blob beat a smaller round one.
+    """
+    found_cnt = None
+    found_score = 0.0
+
+    for cnt in cnts:
+        edges, area, circularity = contour_analysis(cnt)
+        if edges <= MIN_POLYGON_EDGES or not MIN_BALL_AREA < area < MAX_BALL_AREA or circularity < MIN_CIRCULARITY:
+            continue
+        score = area * circularity ** CIRCULARITY_WEIGHT
+        if score > found_score:
+            found_score = score
+            found_cnt = cnt
+
+    return found_cnt
+
+
+def _component_candidates(mask: np.ndarray, min_area: float, max_area: float,
+                          min_fill: float = MIN_FILL_RATIO) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Filter the connected components of ``mask`` by area, aspect ratio and how much of their bounding box
+    they fill, all at once on the stats of ``cv.connectedComponentsWithStats``.
+
+    :return: labels, and stats rows of the survivors with their label appended, biggest first
+    """
+    # the default algorithm runs about three times slower on a single thread
+    _, labels, stats, _ = cv.connectedComponentsWithStatsWithAlgorithm(mask, 8, cv.CV_32S, cv.CCL_GRANA)
+    stats = np.column_stack((stats, np.arange(len(stats))))[1:]  # drop the background
+    width = stats[:, cv.CC_STAT_WIDTH].astype(np.float32)
+    height = stats[:, cv.CC_STAT_HEIGHT].astype(np.float32)
+    area = stats[:, cv.CC_STAT_AREA]
+    keep = (area > min_area) & (area < max_area) \
+        & (np.maximum(width, height) <= MAX_ASPECT_RATIO * np.minimum(width, height)) \
+        & (area >= min_fill * width * height)
+    survivors = stats[keep]
+    return labels, survivors[np.argsort(-survivors[:, cv.CC_STAT_AREA], kind='stable')]
+
+
+def _component_contours(mask: np.ndarray, offset: Tuple[int, int] = (0, 0)) -> List:
+    """
+    Outer contours of the components of ``mask`` which might be the ball, traced on their bounding boxes only.
+    """
+    with latency.stage('components'):
+        # pixel counts run a little larger than contour areas, the exact bounds are checked on the contours
+        labels, survivors = _component_candidates(mask, MIN_BALL_AREA, MAX_BALL_AREA * 1.2)
+    cnts = []
+    with latency.stage('contours'):
+        for x, y, w, h, _, label in survivors:
+            component = (labels[y:y + h, x:x + w] == label).view(np.uint8)
+            component_cnts, _ = cv.findContours(component, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE,
+                                                offset=(int(offset[0] + x), int(offset[1] + y)))
+            cnts.extend(component_cnts)
+    return cnts
+
+
+DEFAULT_SEGMENTER = BlurHsvSegmenter()
+
+
+def ball_mask(frame: np.ndarray, segmenter=DEFAULT_SEGMENTER, blur_size: int = BLUR_KERNEL_SIZE) -> np.ndarray:
+    return clean_mask(segmenter(frame, blur_size))
+
+
+def clean_mask(mask: np.ndarray) -> np.ndarray:
+    with latency.stage('morphology'):
+        return cv.morphologyEx(mask, cv.MORPH_OPEN, None)
+
+
+def _coarse_candidates(frame: np.ndarray, pyramid_level: int, segmenter) -> List[Tuple[int, int, int, int]]:
+    """
+    Find blobs which might be the ball on a frame downscaled by ``2 ** pyramid_level``,
+    return their bounding boxes in full resolution.
+    """
+    scale = 2 ** pyramid_level
+    height, width = frame.shape[:2]
+    small = cv.resize(frame, (width // scale, height // scale), interpolation=cv.INTER_AREA)
+    blur_size = max(3, (BLUR_KERNEL_SIZE // scale) | 1)
+    # polygon edges are meaningless on a few pixels, leave them to refinement and keep the loose filters only
+    min_area = MIN_BALL_AREA / scale ** 2 / 2
+    max_area = MAX_BALL_AREA / scale ** 2 * 2
+    _, survivors = _component_candidates(ball_mask(small, segmenter, blur_size), min_area, max_area,
+                                         MIN_FILL_RATIO / 2)
+
+    boxes = []
+    margin = 2 * scale
+    for x, y, w, h, _, _ in survivors[:PYRAMID_MAX_CANDIDATES].tolist():
+        boxes.append((max(0, x * scale - margin), max(0, y * scale - margin),
+                      min(width, (x + w) * scale + margin), min(height, (y + h) * scale + margin)))
+    return boxes
+
+
+def find_ball(frame: np.ndarray, offset: Tuple[int, int] = (0, 0), pyramid_level: int = 0,
+              segmenter=DEFAULT_SEGMENTER) -> Optional[Circle]:
+    """
+    Full pipeline on ``frame``, which may be a crop; ``offset`` is the crop's top-left corner
+    so that the returned circle is in the coordinates of the original frame.
+
+    With a positive ``pyramid_level``, candidates are found on a downscaled frame first,
+    then ``minEnclosingCircle`` is refined on full resolution crops around them.
+    """
+    if pyramid_level > 0:
+        with latency.stage('pyramid'):
+            boxes = _coarse_candidates(frame, pyramid_level, segmenter)
+        cnts = []
+        for x0, y0, x1, y1 in boxes:
+            mask = ball_mask(frame[y0:y1, x0:x1], segmenter)
+            cnts.extend(_component_contours(mask, (offset[0] + x0, offset[1] + y0)))
+    else:
+        cnts = _component_contours(ball_mask(frame, segmenter), offset)
+
+    return _best_circle(cnts)
+
+
+def _best_circle(cnts: List) -> Optional[Circle]:
+    with latency.stage('contour-scoring'):
+        ball_cnt = biggest_circle_cnt(cnts)
+    if ball_cnt is None:
+        return None
+
+    with latency.stage('enclosing-circle'):
+        (x, y), radius = cv.minEnclosingCircle(ball_cnt)
+    return Circle(x, y, radius)
+
+
+def ball_in_mask(mask: np.ndarray) -> Optional[Circle]:
+    """
+    The second half of ``find_ball()``, on a mask from ``ball_mask()`` or of the same kind.
+    """
+    return _best_circle(_component_contours(mask))
+
+
+class RoiTracker:
+    """
+    Search only a region of interest around the last detection, grown by the predicted motion.
+    Fall back to a full-frame search after ``max_misses`` misses in a row,
+    or when the ball reaches the edge of the region of interest.
+    """
+    ROI_RADIUS_FACTOR: float = 3.0  # half size of ROI, in ball radii
+    ROI_MARGIN: int = 16  # in pixels
+    EDGE_MARGIN: int = 2  # in pixels
+
+    def __init__(self, max_misses: int = 5, pyramid_level: int = 0, detector=find_ball):
+        assert max_misses > 0, f'max_misses must be positive, got {max_misses}'
+        self._max_misses = max_misses
+        self._pyramid_level = pyramid_level
+        self._detector = detector
+        self._last: Optional[Circle] = None
+        self._velocity: Tuple[float, float] = (0.0, 0.0)  # pixel per frame
+        self._misses: int = 0
+        self.roi: Optional[Tuple[int, int, int, int]] = None  # x0, y0, x1, y1 of the latest search
+        self.full_searches: int = 0
+        self.roi_searches: int = 0
+
+    def reset(self):
+        self._last = None
+        self._velocity = (0.0, 0.0)
+        self._misses = 0
+        self.roi = None
+
+    def _predict_roi(self, height: int, width: int) -> Tuple[int, int, int, int]:
+        steps = self._misses + 1
+        vx, vy = self._velocity
+        x = self._last.x + vx * steps
+        y = self._last.y + vy * steps
+        half = self._last.radius * self.ROI_RADIUS_FACTOR + math.hypot(vx, vy) * steps + self.ROI_MARGIN * steps
+        x0, y0 = max(0, int(x - half)), max(0, int(y - half))
+        x1, y1 = min(width, int(math.ceil(x + half))), min(height, int(math.ceil(y + half)))
+        return x0, y0, x1, y1
+
+    def _touches_roi_edge(self, circle: Circle, height: int, width: int) -> bool:
+        x0, y0, x1, y1 = self.roi
+        margin = circle.radius + self.EDGE_MARGIN
+        # ROI edges which are also frame edges do not count
+        return (x0 > 0 and circle.x - margin < x0) \
+            or (y0 > 0 and circle.y - margin < y0) \
+            or (x1 < width and circle.x + margin > x1) \
+            or (y1 < height and circle.y + margin > y1)
+
+    def _update(self, circle: Circle):
+        if self._last is not None:
+            steps = self._misses + 1
+            self._velocity = ((circle.x - self._last.x) / steps, (circle.y - self._last.y) / steps)
+        self._last = circle
+        self._misses = 0
+
+    def _full_search(self, frame: np.ndarray) -> Optional[Circle]:
+        self.full_searches += 1
+        height, width = frame.shape[:2]
+        self.roi = (0, 0, width, height)
+        circle = self._detector(frame, pyramid_level=self._pyramid_level)
+        if circle is None:
+            self.reset()
+            return None
+        self._update(circle)
+        return circle
+
+    def __call__(self, frame: np.ndarray) -> Optional[Circle]:
+        if self._last is None:
+            return self._full_search(frame)
+
+        self.roi_searches += 1
+        height, width = frame.shape[:2]
+        self.roi = self._predict_roi(height, width)
+        x0, y0, x1, y1 = self.roi
+        circle = self._detector(frame[y0:y1, x0:x1], (x0, y0))
+        if circle is not None and not self._touches_roi_edge(circle, height, width):
+            self._update(circle)
+            return circle
+
+        self._misses += 1
+        if circle is not None or self._misses >= self._max_misses:
+            return self._full_search(frame)
+        return None
+
+
+def locate_ball(frame: np.ndarray, tracker: Optional[RoiTracker] = None, pyramid_level: int = 0,
+                detector=find_ball) -> Optional[Circle]:
+    """
+    :param detector: ``find_ball()`` or any detector of ``playground.detectors``, unused with ``tracker``
+    """
+    if tracker is not None:
+        return tracker(frame)
+    return detector(frame, pyramid_level=pyramid_level)
+
+
+def ball_distances(circle: Circle, calibration=None,
+                   size: Tuple[int, int] = (measure.HORIZONTAL_PIXELS, measure.VERTICAL_PIXELS)) -> Tuple[float, float, float]:
+    """
+    :param calibration: ``calibration.CameraCalibration`` of the camera, without it distances follow
+        the focal length and linear angle model of robomasterpy for 720p
+    :param size: width and height of the frame ``circle`` was found on, used with ``calibration``
+    :return: forward and lateral distance in meters, horizontal angle in degrees
+    """
+    with latency.stage('distance'):
+        if calibration is not None:
+            return calibration.ball_distances(circle, size)
+        distance = measure.pinhole_distance(BALL_ACTUAL_RADIUS, circle.radius)
+        return measure.distance_decomposition(circle.x, distance)
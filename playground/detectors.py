@@ -0,0 +1,171 @@
+"""
+Ball detectors share the signature of ``find_ball()``: ``detector(frame, offset=(0, 0), pyramid_level=0)``
+returns a ``Circle`` in the coordinates of the original frame, or None. ``frame`` may be a crop,
+``offset`` being its top-left corner, and ``pyramid_level`` is only a hint which detectors may ignore.
+"""
+
+import math
+from typing import Optional, Tuple
+
+import cv2 as cv
+import numpy as np
+
+from playground import latency
+from playground.detection import DEFAULT_SEGMENTER, MAX_BALL_AREA, MIN_BALL_AREA, Circle, find_ball
+
+BACKEND_CONTOURS: str = 'contours'
+BACKEND_HOUGH: str = 'hough'
+BACKEND_TEMPLATE: str = 'template'
+DETECTORS = (BACKEND_CONTOURS, BACKEND_HOUGH, BACKEND_TEMPLATE)
+
+MIN_BALL_RADIUS: float = math.sqrt(MIN_BALL_AREA / math.pi)
+MAX_BALL_RADIUS: float = math.sqrt(MAX_BALL_AREA / math.pi)
+
+
+class ContourDetector:
+    """
+    Segmentation, then the roundest ball sized contour, see ``find_ball()``.
+    """
+
+    def __init__(self, segmenter=DEFAULT_SEGMENTER):
+        self._segmenter = segmenter
+
+    def __call__(self, frame: np.ndarray, offset: Tuple[int, int] = (0, 0), pyramid_level: int = 0) -> Optional[Circle]:
+        return find_ball(frame, offset, pyramid_level, self._segmenter)
+
+
+class HoughDetector:
+    """
+    ``cv.HoughCircles`` on the grayscale frame downscaled by ``scale``. Circles come strongest first,
+    the first one whose inscribed square is filled with enough ball colored pixels wins;
+    fills of all circles are read at once from the integral image of the downscaled mask.
+    """
+    MIN_COLOR_FILL: float = 0.5
+    CANNY_THRESHOLD: float = 100
+    ACCUMULATOR_THRESHOLD: float = 18
+
+    def __init__(self, segmenter=DEFAULT_SEGMENTER, scale: int = 2):
+        assert scale >= 1, f'scale must be positive, got {scale}'
+        self._segmenter = segmenter
+        self._scale = scale
+
+    def _color_fills(self, small: np.ndarray, circles: np.ndarray) -> np.ndarray:
+        integral = cv.integral((self._segmenter(small, 3) > 0).view(np.uint8))
+        height, width = small.shape[:2]
+        x, y, radius = circles[:, 0], circles[:, 1], circles[:, 2]
+        half = np.maximum(1, radius / math.sqrt(2))
+        x0 = np.clip(x - half, 0, width).astype(np.int32)
+        x1 = np.clip(x + half + 1, 0, width).astype(np.int32)
+        y0 = np.clip(y - half, 0, height).astype(np.int32)
+        y1 = np.clip(y + half + 1, 0, height).astype(np.int32)
+        colored = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        return colored / np.maximum(1, (x1 - x0) * (y1 - y0))
+
+    def __call__(self, frame: np.ndarray, offset: Tuple[int, int] = (0, 0), pyramid_level: int = 0) -> Optional[Circle]:
+        scale = self._scale
+        height, width = frame.shape[:2]
+        with latency.stage('hough'):
+            small = frame
+            if scale > 1:
+                small = cv.resize(frame, (width // scale, height // scale), interpolation=cv.INTER_AREA)
+            gray = cv.medianBlur(cv.cvtColor(small, cv.COLOR_BGR2GRAY), 5)
+            min_radius = max(2, int(MIN_BALL_RADIUS / scale))
+            circles = cv.HoughCircles(gray, cv.HOUGH_GRADIENT, 1, 2 * min_radius,
+                                      param1=self.CANNY_THRESHOLD, param2=self.ACCUMULATOR_THRESHOLD,
+                                      minRadius=min_radius, maxRadius=int(math.ceil(MAX_BALL_RADIUS / scale)))
+        if circles is None:
+            return None
+
+        with latency.stage('hough-color'):
+            circles = circles[0]
+            colored = np.flatnonzero(self._color_fills(small, circles) >= self.MIN_COLOR_FILL)
+        if len(colored) == 0:
+            return None
+        x, y, radius = circles[colored[0]] * scale
+        return Circle(float(x) + offset[0], float(y) + offset[1], float(radius))
+
+
+class TemplateDetector:
+    """
+    Normalized cross-correlation of the last detection around where it was, which is cheap next to segmenting
+    the whole frame. ``seeder`` finds the ball when there is no template, when the match is poor,
+    and every ``reseed_interval`` frames so that the radius follows the distance of the ball.
+
+    Detections depend on the previous frame, so that frames must come in order.
+    """
+    MIN_SCORE: float = 0.7
+    SEARCH_RADIUS_FACTOR: float = 2.0  # half size of the search window, in ball radii, around the template
+    TEMPLATE_RADIUS_FACTOR: float = 1.2  # half size of the template, in ball radii
+
+    def __init__(self, seeder=find_ball, reseed_interval: int = 10):
+        assert reseed_interval > 0, f'reseed_interval must be positive, got {reseed_interval}'
+        self._seeder = seeder
+        self._reseed_interval = reseed_interval
+        self._template: Optional[np.ndarray] = None
+        self._last: Optional[Circle] = None
+        self._matches: int = 0
+        self.seeds: int = 0
+
+    def reset(self):
+        self._template = None
+        self._last = None
+
+    def _seed(self, frame: np.ndarray, offset: Tuple[int, int], pyramid_level: int) -> Optional[Circle]:
+        self.seeds += 1
+        self._matches = 0
+        circle = self._seeder(frame, offset, pyramid_level)
+        if circle is None:
+            self.reset()
+            return None
+
+        half = int(circle.radius * self.TEMPLATE_RADIUS_FACTOR)
+        x, y = int(circle.x) - offset[0], int(circle.y) - offset[1]
+        height, width = frame.shape[:2]
+        if x - half < 0 or y - half < 0 or x + half >= width or y + half >= height:
+            # cut by the frame edge, the next frame is seeded again
+            self.reset()
+            return circle
+        self._template = cv.cvtColor(frame[y - half:y + half + 1, x - half:x + half + 1], cv.COLOR_BGR2GRAY)
+        self._last = circle
+        return circle
+
+    def _match(self, frame: np.ndarray, offset: Tuple[int, int]) -> Optional[Circle]:
+        template_half = self._template.shape[0] // 2
+        search_half = template_half + int(self._last.radius * self.SEARCH_RADIUS_FACTOR)
+        x, y = int(self._last.x) - offset[0], int(self._last.y) - offset[1]
+        height, width = frame.shape[:2]
+        x0, y0 = max(0, x - search_half), max(0, y - search_half)
+        x1, y1 = min(width, x + search_half + 1), min(height, y + search_half + 1)
+        if x1 - x0 <= self._template.shape[1] or y1 - y0 <= self._template.shape[0]:
+            return None
+
+        window = cv.cvtColor(frame[y0:y1, x0:x1], cv.COLOR_BGR2GRAY)
+        scores = cv.matchTemplate(window, self._template, cv.TM_CCOEFF_NORMED)
+        _, score, _, (match_x, match_y) = cv.minMaxLoc(scores)
+        if score < self.MIN_SCORE:
+            return None
+        return Circle(float(x0 + match_x + template_half + offset[0]), float(y0 + match_y + template_half + offset[1]),
+                      self._last.radius)
+
+    def __call__(self, frame: np.ndarray, offset: Tuple[int, int] = (0, 0), pyramid_level: int = 0) -> Optional[Circle]:
+        if self._template is None or self._matches >= self._reseed_interval:
+            return self._seed(frame, offset, pyramid_level)
+
+        with latency.stage('template'):
+            circle = self._match(frame, offset)
+        if circle is None:
+            return self._seed(frame, offset, pyramid_level)
+        self._matches += 1
+        self._last = circle
+        return circle
+
+
+def make_detector(backend: str, segmenter=DEFAULT_SEGMENTER):
+    if backend == BACKEND_CONTOURS:
+        return ContourDetector(segmenter)
+    elif backend == BACKEND_HOUGH:
+        return HoughDetector(segmenter)
+    elif backend == BACKEND_TEMPLATE:
+        return TemplateDetector(ContourDetector(segmenter))
+    else:
+        raise ValueError(f'unknown detector backend {backend}')
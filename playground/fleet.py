@@ -0,0 +1,138 @@
+"""
+Several robots in one process group: one manager, one hub, one display and one push listener serve all of them,
+each robot only adds its vision, event listener and controller processes.
+"""
+
+import os
+import queue
+import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from robomasterpy import CTX
+from robomasterpy import framework as rmf
+
+LOOP_CONTROL: int = 0
+LOOP_VISION: int = 1
+LOOPS = ('control', 'vision')
+
+
+def vision_cpus(robots: int) -> List[Optional[Tuple[int, ...]]]:
+    """
+    A core of its own for the vision worker of every robot, counting down from the last core
+    so that the first cores are left to the other workers, see ``other_cpus()``.
+    Cores are shared once there are more robots than cores.
+
+    :return: cores of every robot, all None where affinity is not supported
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return [None] * robots
+    cpus = sorted(os.sched_getaffinity(0))
+    return [(cpus[-1 - index % len(cpus)],) for index in range(robots)]
+
+
+def other_cpus(vision: List[Optional[Tuple[int, ...]]]) -> Optional[Tuple[int, ...]]:
+    """
+    Cores left to the workers other than vision, so that they do not disturb the pinned vision workers.
+
+    :return: cores no vision worker is pinned to, None where affinity is not supported or no core is left
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return None
+    pinned = {cpu for cpus in vision if cpus is not None for cpu in cpus}
+    left = tuple(sorted(os.sched_getaffinity(0) - pinned))
+    return left if len(left) > 0 else None
+
+
+class PushRouter(rmf.PushListener):
+    """
+    ``rmf.PushListener`` for several robots. Every robot pushes to the same port of the host, which only one socket
+    can bind, so pushes are told apart by the IP they come from and put into the channel of that robot.
+    """
+
+    def __init__(self, name: str, routes: Dict[str, object]):
+        super().__init__(name, None)
+        self._routes = routes
+        self._unknown: Set[str] = set()
+
+    def _route(self, channel, payload):
+        while not self.closed:
+            try:
+                channel.put(payload, block=True, timeout=self.QUEUE_TIMEOUT)
+            except queue.Full:
+                continue
+            break
+
+    def work(self) -> None:
+        self._assert_ready()
+        try:
+            msg, (ip, _) = self._conn.recvfrom(rmf.DEFAULT_BUF_SIZE)
+        except OSError:
+            if self.closed:
+                return
+            else:
+                raise
+        channel = self._routes.get(ip)
+        if channel is None:
+            if ip not in self._unknown:
+                self._unknown.add(ip)
+                self.logger.warning('dropping pushes from unknown robot %s', ip)
+            return
+        for payload in self._parse(msg.decode()):
+            self._route(channel, payload)
+
+
+class LoopCounter:
+    """
+    Iterations of one loop of one robot, in a slot of ``LoopRates`` which only this loop writes.
+    """
+
+    def __init__(self, values, index: int):
+        self._values = values
+        self._index = index
+
+    def tick(self):
+        self._values[self._index] += 1
+
+
+class LoopRates:
+    """
+    Shared iteration counts of the control and vision loops of every robot, must be handed to workers
+    when they are started.
+    """
+
+    def __init__(self, robots: Sequence[str]):
+        self.robots = list(robots)
+        # one writer per slot, no lock needed
+        self._values = CTX.Array('Q', len(self.robots) * len(LOOPS), lock=False)
+
+    def counter(self, robot: int, loop: int) -> LoopCounter:
+        return LoopCounter(self._values, robot * len(LOOPS) + loop)
+
+    def read(self) -> List[int]:
+        return list(self._values)
+
+
+class RateReporter(rmf.Worker):
+    """
+    Logs the loop rates of every robot in Hz every ``interval`` seconds.
+    """
+
+    def __init__(self, name: str, rates: LoopRates, interval: float = 5.0):
+        super().__init__(name, None, None, None, None, True)
+        self._rates = rates
+        self._interval = interval
+        self._last_counts = rates.read()
+        self._last_time = time.time()
+
+    def work(self) -> None:
+        time.sleep(self._interval)
+        counts = self._rates.read()
+        now = time.time()
+        elapsed = now - self._last_time
+        for index, robot in enumerate(self._rates.robots):
+            rates = ', '.join(
+                f'{loop} {(counts[index * len(LOOPS) + i] - self._last_counts[index * len(LOOPS) + i]) / elapsed:.1f} Hz'
+                for i, loop in enumerate(LOOPS))
+            self.logger.info('%s: %s', robot, rates)
+        self._last_counts = counts
+        self._last_time = now
@@ -0,0 +1,348 @@
+import abc
+import queue
+import time
+from typing import Tuple, Optional
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python 3.7 and below
+    shared_memory = None
+
+FRAME_SHAPE: Tuple[int, int, int] = (720, 1280, 3)
+HEADER_ALIGNMENT: int = 64
+
+
+class _SharedBlock(abc.ABC):
+    """
+    A block of shared memory which is created by its owner and attached to when unpickled in worker processes.
+    Subclasses map their numpy views in ``_map()`` and list what is needed to do it again in ``_layout()``.
+    """
+
+    def __init__(self, size: int):
+        assert shared_memory is not None, 'shared memory transport requires Python 3.8 and above'
+        self._owner = True
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._map()
+
+    @abc.abstractmethod
+    def _layout(self) -> dict:
+        pass
+
+    @abc.abstractmethod
+    def _map(self):
+        pass
+
+    def __getstate__(self):
+        return {'name': self._shm.name, **self._layout()}
+
+    def __setstate__(self, state):
+        state = state.copy()
+        name = state.pop('name')
+        self.__dict__.update(state)
+        self._owner = False
+        # workers share the resource tracker of the owner, who unlinks the block on close
+        self._shm = shared_memory.SharedMemory(name=name)
+        self._map()
+
+    def close(self):
+        # views must be released before the buffer
+        for key, value in list(self.__dict__.items()):
+            if isinstance(value, np.ndarray):
+                setattr(self, key, None)
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class SharedRing(_SharedBlock):
+    """
+    Ring buffer of fixed-size numpy array slots in shared memory, for one writer and any number of readers.
+    Readers do not pickle or talk to any other process.
+
+    Each slot has a generation counter working as a seqlock: it is odd while the slot is being written,
+    readers retry or skip when the counter moves under them.
+    This relies on stores becoming visible in program order, which holds on x86.
+
+    The ring is passed to worker processes as an argument, it attaches to the same memory there.
+    ``put()`` and ``get_nowait()`` follow ``queue.Queue`` so that the ring can stand in for the queues of
+    ``robomasterpy.framework`` workers. The reading position is local to each reader.
+    """
+    # how long readers wait for a write in progress, a writer taking longer is taken for dead
+    READ_TIMEOUT: float = 0.5
+
+    def __init__(self, shape: Tuple[int, ...], dtype=np.uint8, slots: int = 4):
+        assert slots > 1, f'at least 2 slots are required, got {slots}'
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        self._slots = slots
+        self._next: int = 0
+        super().__init__(self._header_size() + self._slots * int(np.prod(self._shape)) * self._dtype.itemsize)
+        self._header[:] = 0
+
+    def _header_size(self) -> int:
+        # write count, then one generation counter per slot
+        size = (1 + self._slots) * 8
+        return (size + HEADER_ALIGNMENT - 1) // HEADER_ALIGNMENT * HEADER_ALIGNMENT
+
+    def _layout(self) -> dict:
+        return {
+            '_shape': self._shape,
+            '_dtype': self._dtype,
+            '_slots': self._slots,
+            '_next': 0,
+        }
+
+    def _map(self):
+        self._header = np.ndarray((1 + self._slots,), dtype=np.int64, buffer=self._shm.buf)
+        self._generations = self._header[1:]
+        self._data = np.ndarray((self._slots, *self._shape), dtype=self._dtype, buffer=self._shm.buf, offset=self._header_size())
+
+    @property
+    def count(self) -> int:
+        """
+        number of items ever written
+        """
+        return int(self._header[0])
+
+    def _encode(self, payload) -> np.ndarray:
+        return payload
+
+    def _decode(self, array: np.ndarray):
+        return array
+
+    def write(self, array: np.ndarray):
+        index = int(self._header[0])
+        slot = index % self._slots
+        self._generations[slot] += 1
+        self._data[slot][...] = array
+        self._generations[slot] += 1
+        self._header[0] = index + 1
+
+    def _read(self, index: int) -> Optional[np.ndarray]:
+        """
+        Copy of item ``index``, or None if it has been overwritten.
+
+        :raises TimeoutError: if writing the slot stays unfinished for ``READ_TIMEOUT`` seconds
+        """
+        slot = index % self._slots
+        expected = 2 * (index // self._slots + 1)
+        deadline = None
+        while True:
+            before = int(self._generations[slot])
+            if before & 1:
+                if before > expected:
+                    return None
+                if deadline is None:
+                    deadline = time.monotonic() + self.READ_TIMEOUT
+                elif time.monotonic() > deadline:
+                    raise TimeoutError(f'a write to the ring is unfinished after {self.READ_TIMEOUT} s, '
+                                       f'did the writer die?')
+                # let the writer finish
+                time.sleep(0)
+                continue
+            if before != expected:
+                return None
+            array = self._data[slot].copy()
+            if int(self._generations[slot]) == before:
+                return array
+
+    def read(self, index: int) -> Optional[np.ndarray]:
+        """
+        Copy of item ``index``, or None if it is not written yet or has been overwritten.
+        """
+        if not 0 <= index < self.count:
+            return None
+        return self._read(index)
+
+    def latest(self) -> Optional[Tuple[int, np.ndarray]]:
+        """
+        The newest item and its index, or None if nothing is written yet.
+        """
+        while True:
+            count = self.count
+            if count == 0:
+                return None
+            array = self._read(count - 1)
+            if array is not None:
+                return count - 1, array
+
+    def put(self, payload, block: bool = True, timeout: Optional[float] = None):
+        # never blocks, the oldest item is overwritten
+        self.write(self._encode(payload))
+
+    def put_nowait(self, payload):
+        self.put(payload, False)
+
+    def get_nowait(self):
+        while True:
+            count = self.count
+            if self._next >= count:
+                raise queue.Empty
+            # reader fell behind, skip items that are being overwritten
+            self._next = max(self._next, count - self._slots + 1)
+            array = self._read(self._next)
+            self._next += 1
+            if array is not None:
+                return self._decode(array)
+
+
+class SharedSlots(_SharedBlock):
+    """
+    Fixed-size numpy array slots in shared memory without any synchronization,
+    who may touch which slot is agreed on by other means, like waiting for a future.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype=np.uint8, slots: int = 4):
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        self._slots = slots
+        super().__init__(self._slots * int(np.prod(self._shape)) * self._dtype.itemsize)
+
+    def _layout(self) -> dict:
+        return {
+            '_shape': self._shape,
+            '_dtype': self._dtype,
+            '_slots': self._slots,
+        }
+
+    def _map(self):
+        self._data = np.ndarray((self._slots, *self._shape), dtype=self._dtype, buffer=self._shm.buf)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    def __len__(self) -> int:
+        return self._slots
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self._data[index]
+
+
+def _encode_detection(payload, size: int) -> np.ndarray:
+    if payload is None:
+        return np.full(size, np.nan)
+    return np.asarray(payload, dtype=np.float64)
+
+
+def _decode_detection(array: np.ndarray):
+    if np.isnan(array).all():
+        return None
+    return tuple(array.tolist())
+
+
+class DetectionRing(SharedRing):
+    """
+    Ring of fixed length float tuples, where None is stored as NaN.
+    """
+
+    def __init__(self, size: int, slots: int = 16):
+        super().__init__((size,), np.float64, slots)
+
+    def _encode(self, payload) -> np.ndarray:
+        return _encode_detection(payload, self._shape[0])
+
+    def _decode(self, array: np.ndarray):
+        return _decode_detection(array)
+
+
+class Mailbox(_SharedBlock):
+    """
+    Single slot holding the latest fixed length float64 vector, for one writer and any number of readers.
+    Suits latest-wins data like detections and chassis pushes, use a queue where every message counts.
+
+    The slot is guarded by a seqlock whose counter doubles as the version: it is odd while being written,
+    and ``version = counter // 2`` counts posts so far. Reading is a few memory loads, without syscalls.
+    This relies on stores becoming visible in program order, which holds on x86.
+
+    ``put()`` and ``get_nowait()`` follow ``queue.Queue``, where ``get_nowait()`` returns the value only
+    if it is newer than what this reader got last time, so that drain-the-queue loops finish in one read.
+    """
+    # how long readers wait for a post in progress, a writer taking longer is taken for dead
+    READ_TIMEOUT: float = 0.5
+
+    def __init__(self, size: int):
+        self._size = size
+        self._seen: int = 0
+        super().__init__(8 + size * 8)
+        self._counter[0] = 0
+
+    def _layout(self) -> dict:
+        return {
+            '_size': self._size,
+            '_seen': 0,
+        }
+
+    def _map(self):
+        self._counter = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._data = np.ndarray((self._size,), dtype=np.float64, buffer=self._shm.buf, offset=8)
+
+    @property
+    def version(self) -> int:
+        return int(self._counter[0]) // 2
+
+    def _encode(self, payload) -> np.ndarray:
+        return payload
+
+    def _decode(self, array: np.ndarray):
+        return array
+
+    def post(self, values):
+        self._counter[0] += 1
+        self._data[...] = values
+        self._counter[0] += 1
+
+    def read(self) -> Tuple[int, Optional[np.ndarray]]:
+        """
+        Version and a copy of the latest values, values are None before the first post.
+
+        :raises TimeoutError: if a post stays unfinished for ``READ_TIMEOUT`` seconds
+        """
+        deadline = None
+        while True:
+            before = int(self._counter[0])
+            if before & 1:
+                if deadline is None:
+                    deadline = time.monotonic() + self.READ_TIMEOUT
+                elif time.monotonic() > deadline:
+                    raise TimeoutError(f'a post to the mailbox is unfinished after {self.READ_TIMEOUT} s, '
+                                       f'did the writer die?')
+                # let the writer finish
+                time.sleep(0)
+                continue
+            if before == 0:
+                return 0, None
+            values = self._data.copy()
+            if int(self._counter[0]) == before:
+                return before // 2, values
+
+    def put(self, payload, block: bool = True, timeout: Optional[float] = None):
+        self.post(self._encode(payload))
+
+    def put_nowait(self, payload):
+        self.put(payload, False)
+
+    def get_nowait(self):
+        if self.version == self._seen:
+            raise queue.Empty
+        version, values = self.read()
+        self._seen = version
+        return self._decode(values)
+
+
+class DetectionMailbox(Mailbox):
+    """
+    Mailbox of a fixed length float tuple, where None is stored as NaN.
+    """
+
+    def _encode(self, payload) -> np.ndarray:
+        return _encode_detection(payload, self._size)
+
+    def _decode(self, array: np.ndarray):
+        return _decode_detection(array)
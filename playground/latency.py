@@ -0,0 +1,217 @@
+"""
+Per-stage latency histograms, one recorder per process.
+
+A worker installs its recorder once, after which ``stage()`` and ``record()`` anywhere in that process
+feed it; without an installed recorder they cost next to nothing. Nothing is shared between processes,
+so there are no locks, every process dumps its own summary to ``<directory>/<name>.json``.
+"""
+
+import json
+import math
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# buckets grow by 1% from 1 us to 100 s, so percentiles are off by 1% at most
+HISTOGRAM_MIN: float = 1e-6
+HISTOGRAM_MAX: float = 100.0
+HISTOGRAM_PRECISION: float = 0.01
+DUMP_INTERVAL: float = 5.0
+
+_LOG_BASE = math.log1p(HISTOGRAM_PRECISION)
+_BUCKETS = int(math.log(HISTOGRAM_MAX / HISTOGRAM_MIN) / _LOG_BASE) + 2
+
+
+class Histogram:
+    """
+    Log-bucketed histogram of durations in seconds with bounded relative error, like HdrHistogram.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(_BUCKETS, dtype=np.int64)
+        self.total: int = 0
+        self.max: float = 0.0
+
+    def record(self, seconds: float):
+        if seconds <= HISTOGRAM_MIN:
+            index = 0
+        else:
+            index = min(_BUCKETS - 1, int(math.log(seconds / HISTOGRAM_MIN) / _LOG_BASE) + 1)
+        self.counts[index] += 1
+        self.total += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: 'Histogram'):
+        self.counts += other.counts
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-th percentile, in seconds.
+        """
+        if self.total == 0:
+            return 0.0
+        rank = max(1, int(math.ceil(q / 100 * self.total)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self.max, HISTOGRAM_MIN * math.exp(index * _LOG_BASE))
+
+
+class _Stage:
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram: Histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.record(time.perf_counter() - self._start)
+
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+class LatencyRecorder:
+    """
+    Histograms of named stages in one process, dumped every ``dump_interval`` seconds if ``directory`` is set.
+    Built in the parent and handed to a worker, which calls ``install()`` in its own process.
+    """
+
+    def __init__(self, name: str, directory: Optional[str] = None, dump_interval: float = DUMP_INTERVAL):
+        self._name = name
+        self._directory = directory
+        self._dump_interval = dump_interval
+        self._histograms: Dict[str, Histogram] = {}
+        self._stages: Dict[str, _Stage] = {}
+        self._marks: Dict[str, float] = {}
+        self._last_dump: float = time.time()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def install(self):
+        global _current
+        _current = self
+
+    def histogram(self, stage: str) -> Histogram:
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            histogram = self._histograms[stage] = Histogram()
+        return histogram
+
+    def stage(self, name: str) -> _Stage:
+        timer = self._stages.get(name)
+        if timer is None:
+            timer = self._stages[name] = _Stage(self.histogram(name))
+        return timer
+
+    def record(self, stage: str, seconds: float):
+        self.histogram(stage).record(seconds)
+
+    def mark(self, stage: str):
+        """
+        Start ``stage`` here, it is recorded by the next ``since()`` even if that is in a later call.
+        """
+        self._marks[stage] = time.perf_counter()
+
+    def since(self, stage: str):
+        start = self._marks.pop(stage, None)
+        if start is not None:
+            self.record(stage, time.perf_counter() - start)
+
+    def _stage_histograms(self) -> List[Tuple[str, Histogram]]:
+        # a copy, other threads of the process may record new stages meanwhile
+        return list(self._histograms.items())
+
+    def summary(self) -> List[Tuple[str, int, float, float]]:
+        """
+        :return: (stage, count, p50 in ms, p99 in ms) in the order stages were first seen
+        """
+        return [(stage, histogram.total, histogram.percentile(50) * 1000, histogram.percentile(99) * 1000)
+                for stage, histogram in self._stage_histograms()]
+
+    def dump(self):
+        self._last_dump = time.time()
+        if self._directory is None:
+            return
+        os.makedirs(self._directory, exist_ok=True)
+        report = {
+            'name': self._name,
+            'time': self._last_dump,
+            'stages': {
+                stage: {
+                    'count': histogram.total,
+                    'p50_ms': histogram.percentile(50) * 1000,
+                    'p90_ms': histogram.percentile(90) * 1000,
+                    'p99_ms': histogram.percentile(99) * 1000,
+                    'max_ms': histogram.max * 1000,
+                } for stage, histogram in self._stage_histograms()
+            },
+        }
+        path = os.path.join(self._directory, f'{self._name}.json')
+        # readers never see a partial file
+        with open(path + '.tmp', 'w') as output:
+            json.dump(report, output, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def maybe_dump(self):
+        if time.time() - self._last_dump >= self._dump_interval:
+            self.dump()
+
+
+class TimedCalls:
+    """
+    Proxy timing every method call of ``target`` as stage ``prefix + method name``, like round trips of a Commander.
+    """
+
+    def __init__(self, target, prefix: str):
+        self._target = target
+        self._prefix = prefix
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            return attribute
+        stage_name = self._prefix + name
+
+        def timed(*args, **kwargs):
+            with stage(stage_name):
+                return attribute(*args, **kwargs)
+
+        return timed
+
+
+_current: Optional[LatencyRecorder] = None
+
+
+def current() -> Optional[LatencyRecorder]:
+    return _current
+
+
+def stage(name: str):
+    """
+    Context manager timing ``name`` into the installed recorder, if any.
+    """
+    if _current is None:
+        return _NO_STAGE
+    return _current.stage(name)
+
+
+def record(name: str, seconds: float):
+    if _current is not None:
+        _current.record(name, seconds)
@@ -0,0 +1,137 @@
+import heapq
+import os
+import pickle
+import time
+from typing import Iterator, Tuple, List, Optional, Any
+
+import cv2 as cv
+import numpy as np
+
+STREAM_VISION: str = 'vision'
+STREAM_PUSH: str = 'push'
+STREAM_EVENT: str = 'event'
+STREAMS = (STREAM_VISION, STREAM_PUSH, STREAM_EVENT)
+
+JPEG_QUALITY: int = 90
+
+
+class SessionWriter:
+    """
+    Append timestamped records of one stream to ``<directory>/<stream>.log``.
+
+    Records are pickled one after another, frames are stored as JPEG.
+    Every stream is written by a single process, the file is opened lazily so that the writer
+    can be handed to worker processes.
+    """
+
+    def __init__(self, directory: str, stream: str):
+        assert stream in STREAMS, f'unknown stream {stream}'
+        os.makedirs(directory, exist_ok=True)
+        self._path = os.path.join(directory, f'{stream}.log')
+        self._stream = stream
+        self._file = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_file'] = None
+        return state
+
+    def write(self, payload, timestamp: Optional[float] = None):
+        if timestamp is None:
+            timestamp = time.time()
+        if self._stream == STREAM_VISION:
+            ok, encoded = cv.imencode('.jpg', payload, (cv.IMWRITE_JPEG_QUALITY, JPEG_QUALITY))
+            assert ok, 'failed to encode frame'
+            payload = encoded.tobytes()
+        if self._file is None:
+            self._file = open(self._path, 'ab')
+        pickle.dump((timestamp, payload), self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        # workers may be terminated without a chance to flush
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class RecordingChannel:
+    """
+    Stand-in for the ``out`` queue of a worker, records what is put before passing it on.
+    """
+
+    def __init__(self, channel, writer: SessionWriter):
+        self._channel = channel
+        self._writer = writer
+
+    def put(self, payload, block: bool = True, timeout: Optional[float] = None):
+        # a full queue raises and the worker retries, record once it is through
+        self._channel.put(payload, block, timeout)
+        self._writer.write(payload)
+
+
+def read_stream(directory: str, stream: str) -> Iterator[Tuple[float, str, Any]]:
+    path = os.path.join(directory, f'{stream}.log')
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as reader:
+        while True:
+            try:
+                timestamp, payload = pickle.load(reader)
+            except EOFError:
+                return
+            if stream == STREAM_VISION:
+                payload = cv.imdecode(np.frombuffer(payload, dtype=np.uint8), cv.IMREAD_COLOR)
+            yield timestamp, stream, payload
+
+
+def read_session(directory: str) -> Iterator[Tuple[float, str, Any]]:
+    """
+    All records of a session ordered by time, as (timestamp, stream, payload).
+    """
+    return heapq.merge(*(read_stream(directory, stream) for stream in STREAMS), key=lambda record: record[0])
+
+
+class ReplayClock:
+    """
+    Virtual time with the ``time()`` and ``sleep()`` of the time module, sleeping advances the clock.
+    """
+
+    def __init__(self, start: float):
+        self._now = start
+
+    def time(self) -> float:
+        return self._now
+
+    def sleep(self, seconds: float):
+        self._now += seconds
+
+    def advance_to(self, timestamp: float):
+        self._now = max(self._now, timestamp)
+
+
+class FakeCommander:
+    """
+    Stand-in for ``rm.Commander`` which records every command and answers ok.
+    """
+
+    def __init__(self, clock=time, ip: str = '127.0.0.1'):
+        self._clock = clock
+        self._ip = ip
+        self.calls: List[Tuple[float, str, tuple, dict]] = []
+
+    def get_ip(self) -> str:
+        return self._ip
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def command(*args, **kwargs) -> str:
+            self.calls.append((self._clock.time(), name, args, kwargs))
+            return 'ok'
+
+        return command
@@ -0,0 +1,150 @@
+import json
+import os
+from typing import Tuple, Optional
+
+import cv2 as cv
+import numpy as np
+
+from playground import latency
+
+GREEN_LOWER = (29, 90, 90)
+GREEN_UPPER = (64, 255, 255)
+BLUR_KERNEL_SIZE: int = 11
+
+BACKEND_BLUR_HSV: str = 'blur-hsv'
+BACKEND_LUT: str = 'lut'
+BACKENDS = (BACKEND_BLUR_HSV, BACKEND_LUT)
+
+LUT_CACHE_DIR: str = os.path.join(os.path.expanduser('~'), '.cache', 'robo-playground')
+HSV_PROFILE: str = 'hsv-profile.json'
+
+
+class BlurHsvSegmenter:
+    """
+    GaussianBlur, BGR to HSV, then inRange.
+    """
+
+    def __init__(self, lower: Tuple[int, int, int] = GREEN_LOWER, upper: Tuple[int, int, int] = GREEN_UPPER):
+        self.lower = tuple(lower)
+        self.upper = tuple(upper)
+
+    def __call__(self, frame: np.ndarray, blur_size: int = BLUR_KERNEL_SIZE) -> np.ndarray:
+        with latency.stage('blur'):
+            processed = cv.GaussianBlur(frame, (blur_size, blur_size), 0)
+        with latency.stage('hsv'):
+            processed = cv.cvtColor(processed, cv.COLOR_BGR2HSV)
+        with latency.stage('threshold'):
+            return cv.inRange(processed, self.lower, self.upper)
+
+
+class LutSegmenter:
+    """
+    Classify BGR pixels against HSV bounds with one gather from a precomputed table.
+
+    The table has ``2 ** (3 * bits)`` entries, 8 bits is exact(16 MiB) while 6 bits(256 KiB) is cache friendly.
+    Tables are cached on disk keyed by bounds and bits, and rebuilt lazily after unpickling
+    so that they do not travel between processes.
+    There is no blur, leave denoising to the morphology after segmentation.
+    """
+
+    def __init__(self, lower: Tuple[int, int, int] = GREEN_LOWER, upper: Tuple[int, int, int] = GREEN_UPPER,
+                 bits: int = 8, cache_dir: Optional[str] = LUT_CACHE_DIR):
+        assert 4 <= bits <= 8, f'bits must be in [4, 8], got {bits}'
+        self.lower = tuple(lower)
+        self.upper = tuple(upper)
+        self._bits = bits
+        self._cache_dir = cache_dir
+        self._table: Optional[np.ndarray] = None
+        self._load()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_table'] = None
+        return state
+
+    @property
+    def cache_path(self) -> Optional[str]:
+        if self._cache_dir is None:
+            return None
+        bounds = '-'.join(map(str, self.lower + self.upper))
+        return os.path.join(self._cache_dir, f'hsv-lut-{self._bits}-{bounds}.npy')
+
+    def _build(self) -> np.ndarray:
+        shift = 8 - self._bits
+        levels = np.arange(1 << self._bits, dtype=np.uint16)
+        # center of each quantization bin
+        levels = np.minimum((levels << shift) + (1 << shift >> 1), 255).astype(np.uint8)
+        # index is R << 2 * bits | G << bits | B
+        r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+        colors = np.stack((b.ravel(), g.ravel(), r.ravel()), axis=-1).reshape(-1, 1, 3)
+        hsv = cv.cvtColor(colors, cv.COLOR_BGR2HSV)
+        return cv.inRange(hsv, self.lower, self.upper).ravel()
+
+    def _load(self):
+        path = self.cache_path
+        if path is not None and os.path.exists(path):
+            self._table = np.unpackbits(np.load(path)).astype(np.uint8) * 255
+            return
+
+        self._table = self._build()
+        if path is None:
+            return
+        os.makedirs(self._cache_dir, exist_ok=True)
+        # several processes may build the same table at once
+        temp_path = f'{path}.{os.getpid()}.npy'
+        np.save(temp_path, np.packbits(self._table > 0))
+        os.replace(temp_path, path)
+
+    def _index(self, frame: np.ndarray) -> np.ndarray:
+        # BGRA viewed as little endian uint32 is B | G << 8 | R << 16 | A << 24
+        packed = cv.cvtColor(frame, cv.COLOR_BGR2BGRA).view(np.uint32)[..., 0]
+        if self._bits == 8:
+            np.bitwise_and(packed, 0xFFFFFF, out=packed)
+            return packed
+        shift = 8 - self._bits
+        mask = (1 << self._bits) - 1
+        blue = (packed >> shift) & mask
+        green = (packed >> (8 + shift)) & mask
+        red = (packed >> (16 + shift)) & mask
+        return (red << (2 * self._bits)) | (green << self._bits) | blue
+
+    def __call__(self, frame: np.ndarray, blur_size: int = BLUR_KERNEL_SIZE) -> np.ndarray:
+        if self._table is None:
+            self._load()
+        with latency.stage('lut'):
+            return np.take(self._table, self._index(frame))
+
+
+def load_hsv_profile(path: str) -> Tuple[Tuple[int, int, int], Tuple[int, int, int]]:
+    """
+    :return: lower and upper HSV bounds saved by ``tools/find-ball.py tune``
+    """
+    with open(path) as reader:
+        profile = json.load(reader)
+    return tuple(profile['lower']), tuple(profile['upper'])
+
+
+def save_hsv_profile(path: str, lower: Tuple[int, int, int], upper: Tuple[int, int, int]):
+    with open(path, 'w') as output:
+        json.dump({'lower': list(lower), 'upper': list(upper)}, output)
+
+
+def hsv_bounds(path: Optional[str] = None) -> Tuple[Tuple[int, int, int], Tuple[int, int, int]]:
+    """
+    Bounds of the profile at ``path``, else of ``HSV_PROFILE`` in the working directory if there is one,
+    else the defaults.
+    """
+    if path is None and os.path.exists(HSV_PROFILE):
+        path = HSV_PROFILE
+    if path is None:
+        return GREEN_LOWER, GREEN_UPPER
+    return load_hsv_profile(path)
+
+
+def make_segmenter(backend: str, lower: Tuple[int, int, int] = GREEN_LOWER, upper: Tuple[int, int, int] = GREEN_UPPER):
+    if backend == BACKEND_BLUR_HSV:
+        return BlurHsvSegmenter(lower, upper)
+    elif backend == BACKEND_LUT:
+        return LutSegmenter(lower, upper)
+    else:
+        raise ValueError(f'unknown segmentation backend {backend}')
@@ -0,0 +1,70 @@
+import time
+
+# a tick starting later than this fraction of the period is counted as late
+LATE_FRACTION: float = 0.1
+
+
+class MonotonicClock:
+    """
+    ``time()`` and ``sleep()`` on ``time.monotonic()``, which NTP and changes of the system time do not step.
+    """
+
+    @staticmethod
+    def time() -> float:
+        return time.monotonic()
+
+    @staticmethod
+    def sleep(seconds: float):
+        time.sleep(seconds)
+
+
+MONOTONIC_CLOCK = MonotonicClock()
+
+
+class TickScheduler:
+    """
+    Paces a loop to ``frequency`` ticks per second against deadlines a whole number of periods from the first tick,
+    so that the rate does not drift with how long ticks take or how much sleeping overshoots.
+
+    A tick starting after its deadline is late. Once the loop falls a whole period behind, the ticks it missed
+    are skipped and counted as overruns instead of being run back to back to catch up.
+
+    ``clock`` provides ``time()`` and ``sleep()``, monotonic by default so that the wall clock being set
+    neither stalls nor bursts the loop.
+    """
+
+    def __init__(self, frequency: float, clock=MONOTONIC_CLOCK):
+        assert frequency > 0, f'frequency must be positive, got {frequency}'
+        self._period = 1.0 / frequency
+        self._clock = clock
+        self._deadline = None
+        self.ticks: int = 0
+        self.late: int = 0
+        self.overruns: int = 0
+
+    @property
+    def period(self) -> float:
+        return self._period
+
+    def wait(self) -> float:
+        """
+        Sleep until the deadline of the next tick.
+
+        :return: how late the tick starts, in seconds
+        """
+        now = self._clock.time()
+        if self._deadline is None:
+            self._deadline = now
+        if now < self._deadline:
+            self._clock.sleep(self._deadline - now)
+            now = self._clock.time()
+
+        lateness = max(0.0, now - self._deadline)
+        self.ticks += 1
+        if lateness > self._period * LATE_FRACTION:
+            self.late += 1
+        missed = int(lateness // self._period)
+        self.overruns += missed
+        # keep the phase, the next deadline is in the future again
+        self._deadline += (missed + 1) * self._period
+        return lateness
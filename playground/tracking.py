@@ -0,0 +1,123 @@
+import math
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class BallKalman:
+    """
+    Constant velocity Kalman filter of the ball in field coordinates, where the chassis pose is (x, y, yaw in degrees)
+    as pushed by the robot: x forward, y rightward, yaw clockwise.
+
+    Detections relative to the chassis are moved into the field frame with the current pose when they arrive,
+    so that the ball keeps still in the filter while the chassis moves. Estimates are predicted to any time,
+    which compensates the pipeline latency and fills the gaps between frames at the control rate.
+    Detections far from the prediction are rejected, the filter restarts after a few in a row.
+    """
+    ACCELERATION_NOISE: float = 2.0  # std of unmodelled acceleration, in m/s^2
+    MIN_MEASUREMENT_NOISE: float = 0.02  # std, in meters
+    RANGE_NOISE: float = 0.03  # pinhole distance error grows with distance squared
+    INITIAL_SPEED_NOISE: float = 1.0  # std, in m/s
+    GATE: float = 13.8  # chi-square with 2 degrees of freedom, 99.9%
+    MAX_REJECTS: int = 3
+
+    def __init__(self):
+        self._x: Optional[np.ndarray] = None  # x, y, vx, vy
+        self._p: Optional[np.ndarray] = None
+        self._time: float = 0
+        self._rejects: int = 0
+
+    @property
+    def initialized(self) -> bool:
+        return self._x is not None
+
+    def reset(self):
+        self._x = None
+        self._p = None
+        self._rejects = 0
+
+    @staticmethod
+    def _rotation(yaw: float) -> np.ndarray:
+        rad = math.radians(yaw)
+        c, s = math.cos(rad), math.sin(rad)
+        return np.array([[c, -s], [s, c]])
+
+    def _measurement_noise(self, forward: float, yaw: float) -> np.ndarray:
+        distance = math.fabs(forward)
+        forward_std = self.MIN_MEASUREMENT_NOISE + self.RANGE_NOISE * distance ** 2
+        lateral_std = self.MIN_MEASUREMENT_NOISE + self.RANGE_NOISE * distance
+        rotation = self._rotation(yaw)
+        return rotation @ np.diag([forward_std ** 2, lateral_std ** 2]) @ rotation.T
+
+    def _predict(self, at: float) -> Tuple[np.ndarray, np.ndarray]:
+        dt = max(0.0, at - self._time)
+        f = np.eye(4)
+        f[0, 2] = f[1, 3] = dt
+        # white noise acceleration
+        q = self.ACCELERATION_NOISE ** 2 * np.array([
+            [dt ** 4 / 4, 0, dt ** 3 / 2, 0],
+            [0, dt ** 4 / 4, 0, dt ** 3 / 2],
+            [dt ** 3 / 2, 0, dt ** 2, 0],
+            [0, dt ** 3 / 2, 0, dt ** 2],
+        ])
+        return f @ self._x, f @ self._p @ f.T + q
+
+    def update(self, pose: Tuple[float, float, float], distances: Tuple[float, float], at: float) -> bool:
+        """
+        Fuse a detection taken at time ``at``.
+
+        :param pose: chassis x, y in meters and yaw in degrees
+        :param distances: forward and lateral distance of the ball to the chassis, in meters
+        :return: False if the detection is rejected as an outlier
+        """
+        x, y, yaw = pose
+        forward, lateral = distances
+        measured = np.array([x, y]) + self._rotation(yaw) @ np.array([forward, lateral])
+        r = self._measurement_noise(forward, yaw)
+
+        if self._x is None:
+            self._x = np.array([measured[0], measured[1], 0.0, 0.0])
+            self._p = np.zeros((4, 4))
+            self._p[:2, :2] = r
+            self._p[2, 2] = self._p[3, 3] = self.INITIAL_SPEED_NOISE ** 2
+            self._time = at
+            return True
+
+        predicted, p = self._predict(at)
+        innovation = measured - predicted[:2]
+        s = p[:2, :2] + r
+        s_inv = np.linalg.inv(s)
+        if innovation @ s_inv @ innovation > self.GATE:
+            self._rejects += 1
+            if self._rejects >= self.MAX_REJECTS:
+                self.reset()
+                return self.update(pose, distances, at)
+            return False
+
+        k = p[:, :2] @ s_inv
+        self._x = predicted + k @ innovation
+        self._p = (np.eye(4) - k @ np.eye(2, 4)) @ p
+        self._time = max(self._time, at)
+        self._rejects = 0
+        return True
+
+    def estimate(self, at: float) -> Optional[Tuple[float, float, float, float]]:
+        """
+        :return: predicted x, y, vx, vy in field coordinates at time ``at``, None before the first detection
+        """
+        if self._x is None:
+            return None
+        predicted, _ = self._predict(at)
+        return tuple(predicted.tolist())
+
+    def relative(self, pose: Tuple[float, float, float], at: float) -> Optional[Tuple[float, float, float]]:
+        """
+        :return: predicted forward and lateral distance in meters and horizontal angle in degrees
+            to the chassis at ``pose``, like ``ball_distances()``
+        """
+        estimate = self.estimate(at)
+        if estimate is None:
+            return None
+        x, y, yaw = pose
+        forward, lateral = self._rotation(yaw).T @ (np.array(estimate[:2]) - np.array([x, y]))
+        return float(forward), float(lateral), math.degrees(math.atan2(lateral, forward))
@@ -0,0 +1,142 @@
+"""
+Process settings of hub workers from a JSON file, applied in the worker process before the worker is built::
+
+    {
+        "vision": {"cpus": [2, 3], "nice": -5, "cv_threads": 2},
+        "controller": {"cpus": [1], "fifo_priority": 10},
+        "*": {"cpus": [0, 1], "cv_threads": 1}
+    }
+
+Keys are worker names, ``vision-<ip>`` falls back to ``vision`` and ``*`` holds the settings of unlisted workers.
+Settings the system does not permit, like a negative nice or SCHED_FIFO without privileges, are logged and skipped.
+Tuned workers log the distribution of their loop period, to check what the settings do.
+"""
+
+import dataclasses
+import functools
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2 as cv
+
+from playground.latency import Histogram
+
+ANY_WORKER: str = '*'
+REPORT_INTERVAL: float = 10.0
+
+
+@dataclasses.dataclass(frozen=True)
+class WorkerTuning:
+    cpus: Optional[Tuple[int, ...]] = None  # os.sched_setaffinity()
+    nice: Optional[int] = None
+    fifo_priority: Optional[int] = None  # SCHED_FIFO priority, 1 to 99
+    cv_threads: Optional[int] = None  # cv.setNumThreads(), 0 runs OpenCV single threaded
+    report_interval: float = REPORT_INTERVAL  # seconds between loop period reports, 0 for none
+
+    @classmethod
+    def from_dict(cls, properties: dict) -> 'WorkerTuning':
+        unknown = set(properties) - {field.name for field in dataclasses.fields(cls)}
+        assert len(unknown) == 0, f'unknown worker settings: {sorted(unknown)}'
+        properties = dict(properties)
+        if properties.get('cpus') is not None:
+            properties['cpus'] = tuple(properties['cpus'])
+        return cls(**properties)
+
+    def apply(self) -> List[str]:
+        """
+        Apply to the calling process.
+
+        :return: why settings were skipped
+        """
+        skipped = []
+        if self.cpus is not None:
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, self.cpus)
+            else:
+                skipped.append('CPU affinity is not supported on this platform')
+        if self.nice is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, 0, self.nice)
+            except (AttributeError, PermissionError) as e:
+                skipped.append(f'can not set nice to {self.nice}: {e}')
+        if self.fifo_priority is not None:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.fifo_priority))
+            except (AttributeError, PermissionError) as e:
+                skipped.append(f'can not run as SCHED_FIFO {self.fifo_priority}: {e}')
+        if self.cv_threads is not None:
+            cv.setNumThreads(self.cv_threads)
+        return skipped
+
+
+def load_worker_tunings(path: str) -> Dict[str, WorkerTuning]:
+    with open(path) as reader:
+        properties = json.load(reader)
+    return {name: WorkerTuning.from_dict(settings) for name, settings in properties.items()}
+
+
+def tuning_for(tunings: Dict[str, WorkerTuning], name: str) -> Optional[WorkerTuning]:
+    """
+    Settings of worker ``name``, of its role for names like ``vision-<ip>``, or of any worker.
+    """
+    for key in (name, name.rsplit('-', 1)[0], ANY_WORKER):
+        if key in tunings:
+            return tunings[key]
+    return None
+
+
+class LoopPeriods:
+    """
+    Histogram of the time between the starts of consecutive ``work()`` calls, logged and restarted
+    every ``interval`` seconds.
+    """
+
+    def __init__(self, logger, interval: float = REPORT_INTERVAL):
+        self._logger = logger
+        self._interval = interval
+        self._histogram = Histogram()
+        self._last_start: Optional[float] = None
+        self._last_report = time.time()
+
+    def _report(self):
+        histogram = self._histogram
+        self._logger.info('loop period over %d loops: p50 %.2f ms, p90 %.2f ms, p99 %.2f ms, max %.2f ms',
+                          histogram.total, histogram.percentile(50) * 1000, histogram.percentile(90) * 1000,
+                          histogram.percentile(99) * 1000, histogram.max * 1000)
+        self._histogram = Histogram()
+
+    def wrap(self, work):
+        @functools.wraps(work)
+        def timed_work():
+            start = time.perf_counter()
+            if self._last_start is not None:
+                self._histogram.record(start - self._last_start)
+            self._last_start = start
+            if time.time() - self._last_report >= self._interval:
+                self._last_report = time.time()
+                self._report()
+            return work()
+
+        return timed_work
+
+
+def _build_tuned(worker_class, tuning: WorkerTuning, *args, **kwargs):
+    skipped = tuning.apply()
+    worker = worker_class(*args, **kwargs)
+    for reason in skipped:
+        worker.logger.warning(reason)
+    if tuning.report_interval > 0:
+        worker.work = LoopPeriods(worker.logger, tuning.report_interval).wrap(worker.work)
+    return worker
+
+
+def tuned(worker_class, tuning: Optional[WorkerTuning]):
+    """
+    Stands for ``worker_class`` in ``Hub.worker()``, applying ``tuning`` in the worker process before building
+    the worker, so that threads the worker starts inherit it. None leaves the worker as it is.
+    """
+    if tuning is None:
+        return worker_class
+    return functools.partial(_build_tuned, worker_class, tuning)
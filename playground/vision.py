@@ -0,0 +1,220 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+from robomasterpy import CTX
+from robomasterpy import framework as rmf
+
+from playground import latency
+
+
+@dataclass
+class VisionHint:
+    """
+    How much vision the controller needs right now.
+    """
+    fps: float = 0  # frames to process per second, 0 processes every frame
+    pyramid_level: int = 0
+    tracking: bool = True
+    # process every frame as soon as a ball shows up, without waiting for the controller to ask
+    escalate: bool = False
+
+
+class VisionHintChannel:
+    """
+    Latest ``VisionHint`` in shared memory, posted by the controller and read by vision on every frame.
+    ``full`` is the configured hint for when the controller needs everything vision can do.
+
+    Works without ``multiprocessing.shared_memory``, but must be handed to workers when they are started.
+    """
+
+    def __init__(self, full: VisionHint):
+        self.full = full
+        self._values = CTX.Array('d', 4)
+        self.post(full)
+
+    def post(self, hint: VisionHint):
+        with self._values.get_lock():
+            self._values[:] = [hint.fps, hint.pyramid_level, hint.tracking, hint.escalate]
+
+    def read(self) -> VisionHint:
+        with self._values.get_lock():
+            fps, pyramid_level, tracking, escalate = self._values[:]
+        return VisionHint(fps, int(pyramid_level), bool(tracking), bool(escalate))
+
+
+class VisionScheduler:
+    """
+    Decides which frames are processed following the hint of the controller, the rest are skipped.
+    """
+
+    def __init__(self, channel: VisionHintChannel, clock=time):
+        self._channel = channel
+        self._clock = clock
+        self._last_processed: float = 0
+        self._ball_seen: bool = False
+        self.processed: int = 0
+        self.skipped: int = 0
+
+    def due(self) -> Optional[VisionHint]:
+        """
+        :return: the hint to process this frame with, None to skip it
+        """
+        hint = self._channel.read()
+        now = self._clock.time()
+        if hint.fps <= 0 or (hint.escalate and self._ball_seen) or now - self._last_processed >= 1.0 / hint.fps:
+            self._last_processed = now
+            self.processed += 1
+            return hint
+        self.skipped += 1
+        return None
+
+    def done(self, result):
+        self._ball_seen = result is not None
+
+
+class LatestFrame:
+    """
+    Slot for the newest decoded frame and the time it was decoded,
+    a frame not taken before the next one comes in is dropped.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame: Optional[np.ndarray] = None
+        self._decoded_at: float = 0
+        self._ended: bool = False
+        self.decoded: int = 0
+        self.dropped: int = 0
+
+    @property
+    def ended(self) -> bool:
+        return self._ended
+
+    def put(self, frame: np.ndarray, decoded_at: float):
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._decoded_at = decoded_at
+            self.decoded += 1
+            self._cond.notify()
+
+    def end(self):
+        with self._cond:
+            self._ended = True
+            self._cond.notify_all()
+
+    def take(self, timeout: float) -> Tuple[Optional[np.ndarray], float]:
+        """
+        Wait up to ``timeout`` for a frame newer than the last one taken.
+
+        :return: frame and the time it was decoded, None for the frame on timeout or once ended
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._frame is not None or self._ended, timeout)
+            frame, self._frame = self._frame, None
+            return frame, self._decoded_at
+
+
+class LatestFrameVision(rmf.Vision):
+    """
+    ``rmf.Vision`` decoding the stream on a thread of its own, ``processing`` only sees the newest frame.
+    Frames coming in while ``processing`` runs replace each other instead of queueing up in the capture,
+    so that a frame is at most one processing time old when processing starts.
+
+    ``processing`` is called with ``captured_at``, the time the frame was decoded, in addition to ``frame`` and ``logger``.
+    Decoded, dropped and processed frames are logged every ``REPORT_INTERVAL`` seconds.
+    """
+    REPORT_INTERVAL: float = 10.0
+    WAIT_TIMEOUT: float = 0.05  # how often work() gives closing a chance while waiting for a frame
+
+    def __init__(self, name: str, out, ip: str, processing: Callable[..., None], none_is_valid: bool = False):
+        super().__init__(name, out, ip, processing, none_is_valid)
+        self._latest = LatestFrame()
+        self.processed: int = 0
+        self._last_report = time.time()
+        self._decoder = threading.Thread(target=self._decode, name=f'{name}-decoder', daemon=True)
+        self._decoder.start()
+
+    def _decode(self):
+        while not self._latest.ended:
+            # includes waiting for the next frame of the stream
+            with latency.stage('decode'):
+                ok, frame = self._cap.read()
+            if not ok:
+                break
+            self._latest.put(frame, time.time())
+        self._latest.end()
+
+    def close(self):
+        self._latest.end()
+        # the capture is released once the decoder is out of read()
+        if self._decoder is not threading.current_thread():
+            self._decoder.join(self.TIMEOUT)
+        super().close()
+
+    def _next_frame(self) -> Tuple[Optional[np.ndarray], float]:
+        """
+        :return: the newest frame and the time it was decoded, None for the frame if there is none yet
+        """
+        frame, decoded_at = self._latest.take(self.WAIT_TIMEOUT)
+        if frame is None and self._latest.ended and not self.closed:
+            raise ValueError('can not receive frame (stream end?)')
+        return frame, decoded_at
+
+    def _counters(self) -> str:
+        return (f'frames decoded: {self._latest.decoded}, dropped: {self._latest.dropped}, '
+                f'processed: {self.processed}')
+
+    def _report(self):
+        now = time.time()
+        if now - self._last_report >= self.REPORT_INTERVAL:
+            self._last_report = now
+            self.logger.debug(self._counters())
+
+    def _process(self, frame: np.ndarray, **kwargs):
+        self.processed += 1
+        processed = self._processing(frame=frame, logger=self.logger, **kwargs)
+        if processed is not None or self._none_is_valid:
+            with latency.stage('enqueue'):
+                self._outlet(processed)
+        return processed
+
+    def work(self) -> None:
+        frame, decoded_at = self._next_frame()
+        if frame is None:
+            return
+        self._report()
+        self._process(frame, captured_at=decoded_at)
+
+
+class ScheduledVision(LatestFrameVision):
+    """
+    ``LatestFrameVision`` processing frames at the rate the controller hints, the rest are dropped.
+    ``processing`` is called with ``pyramid_level`` and ``tracking`` of the hint in addition to
+    ``frame``, ``logger`` and ``captured_at``.
+    """
+
+    def __init__(self, name: str, out, ip: str, processing: Callable[..., None], hint: VisionHintChannel,
+                 none_is_valid: bool = False):
+        super().__init__(name, out, ip, processing, none_is_valid)
+        self._scheduler = VisionScheduler(hint)
+
+    def _counters(self) -> str:
+        return f'{super()._counters()}, skipped: {self._scheduler.skipped}'
+
+    def work(self) -> None:
+        frame, decoded_at = self._next_frame()
+        if frame is None:
+            return
+        self._report()
+        hint = self._scheduler.due()
+        if hint is None:
+            return
+
+        processed = self._process(frame, captured_at=decoded_at,
+                                  pyramid_level=hint.pyramid_level, tracking=hint.tracking)
+        self._scheduler.done(processed)
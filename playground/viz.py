@@ -0,0 +1,77 @@
+import queue
+import time
+from typing import Callable, List, Optional, Tuple, Any
+
+import cv2 as cv
+import numpy as np
+from robomasterpy import framework as rmf
+
+VIZ_FREQUENCY: float = 10
+
+# window name, channel to read from, and a function turning the latest item into the image to show
+Panel = Tuple[str, Any, Callable[[Any], Optional[np.ndarray]]]
+
+
+class Publisher:
+    """
+    Hands annotated data to a ``Display`` at most ``frequency`` times per second without ever blocking,
+    items are dropped when it is too early or the channel is full.
+
+    Check ``ready()`` before building an item, so that skipped items cost nothing.
+    """
+
+    def __init__(self, channel, frequency: float = VIZ_FREQUENCY, clock=time):
+        self._channel = channel
+        self._period = 1.0 / frequency
+        self._clock = clock
+        self._last_published: float = 0
+
+    def ready(self) -> bool:
+        return self._clock.time() - self._last_published >= self._period
+
+    def publish(self, payload):
+        self._last_published = self._clock.time()
+        try:
+            self._channel.put_nowait(payload)
+        except queue.Full:
+            pass
+
+
+class Display(rmf.Worker):
+    """
+    The only place doing GUI work: shows the latest item of every panel at a limited rate,
+    so that ``cv.imshow()`` and ``cv.waitKey()`` stay out of vision and control loops.
+    """
+
+    def __init__(self, name: str, panels: List[Panel], frequency: float = VIZ_FREQUENCY):
+        super().__init__(name, None, None, None, None, True)
+        self._panels = panels
+        self._period = 1.0 / frequency
+        self._next_time = time.time()
+
+    def _latest(self, channel):
+        item = None
+        while not self.closed:
+            try:
+                item = channel.get_nowait()
+            except queue.Empty:
+                return item
+        return item
+
+    def work(self) -> None:
+        for window, channel, render in self._panels:
+            item = self._latest(channel)
+            if item is None:
+                continue
+            image = render(item)
+            if image is not None:
+                cv.imshow(window, image)
+        cv.waitKey(1)
+
+        self._next_time += self._period
+        delay = self._next_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # fell behind, do not try to catch up
+            self._next_time = time.time()
@@ -0,0 +1,75 @@
+"""
+Compare blocking and pipelined Commander calls from a control loop against a local stand-in of the SDK port.
+"""
+
+import os
+import sys
+import time
+
+import click
+import numpy as np
+import robomasterpy as rm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from playground.commands import PIPELINE_DEPTH, AsyncCommander, SdkStandIn  # noqa: E402
+
+
+def control_loop(cmd: rm.Commander, ticks: int, frequency: float, led_every: int) -> np.ndarray:
+    """
+    A chasing KeeperMind in short: a speed setpoint every tick and an LED effect now and then.
+
+    :return: time spent in Commander calls per tick, in seconds
+    """
+    period = 1.0 / frequency
+    blocked = np.zeros(ticks)
+    next_time = time.perf_counter()
+    for tick in range(ticks):
+        start = time.perf_counter()
+        cmd.chassis_speed(y=round(0.3 * np.sin(tick / 10), 2))
+        if tick % led_every == 0:
+            cmd.led_control(rm.LED_ALL, rm.LED_EFFECT_SOLID, 0, 0, 255 if tick % (2 * led_every) == 0 else 128)
+        blocked[tick] = time.perf_counter() - start
+
+        next_time += period
+        delay = next_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    return blocked
+
+
+@click.command()
+@click.option('--delay', default=0.02, type=float, help='seconds the stand-in takes to answer each command')
+@click.option('--ticks', default=300, type=int, help='control loop ticks per run')
+@click.option('--frequency', default=30, type=float, help='control loop frequency')
+@click.option('--led-every', default=10, type=int, help='ticks between LED effects')
+@click.option('--pipeline', default=PIPELINE_DEPTH, type=int, help='commands in flight for the pipelined Commander')
+def cli(delay: float, ticks: int, frequency: float, led_every: int, pipeline: int):
+    click.echo(f'{"commander":<10} {"tick p50 ms":>12} {"tick p99 ms":>12} {"overruns":>9} {"sent":>6} {"coalesced":>10} {"ack p50 ms":>11} {"ack p99 ms":>11}')
+    for name in ('blocking', 'pipelined'):
+        stand_in = SdkStandIn(delay=delay)
+        try:
+            if name == 'blocking':
+                cmd = rm.Commander('127.0.0.1', timeout=10)
+            else:
+                cmd = AsyncCommander('127.0.0.1', timeout=10, pipeline=pipeline)
+            start = time.time()
+            blocked = control_loop(cmd, ticks, frequency, led_every) * 1000
+            cmd.close()
+            # entering SDK mode does not count
+            sent = sum(1 for at, _ in stand_in.commands if at >= start)
+        finally:
+            stand_in.close()
+
+        overruns = int(np.sum(blocked > 1000 / frequency))
+        if name == 'blocking':
+            ack = f'{"-":>11} {"-":>11}'
+            coalesced = '-'
+        else:
+            ack = f'{cmd.ack_latency.percentile(50) * 1000:>11.2f} {cmd.ack_latency.percentile(99) * 1000:>11.2f}'
+            coalesced = str(cmd.coalesced)
+        click.echo(f'{name:<10} {np.percentile(blocked, 50):>12.3f} {np.percentile(blocked, 99):>12.3f} {overruns:>9} {sent:>6} {coalesced:>10} {ack}')
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,252 @@
+import glob
+import json
+import os
+import sys
+import time
+from typing import List, Optional, Callable, Tuple
+
+import click
+import cv2 as cv
+import numpy as np
+from robomasterpy import measure
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from playground import segmentation  # noqa: E402
+from playground.detection import BALL_ACTUAL_RADIUS, Circle, RoiTracker, find_ball, ball_mask, MIN_BALL_AREA, MAX_BALL_AREA  # noqa: E402
+from playground.detectors import BACKEND_CONTOURS, DETECTORS, make_detector  # noqa: E402
+
+
+def frame_paths(folder: str) -> List[str]:
+    paths = sorted(glob.glob(os.path.join(folder, '*.png')) + glob.glob(os.path.join(folder, '*.jpg')))
+    assert len(paths) > 0, f'no png or jpg found in {folder}'
+    return paths
+
+
+def read_frame(path: str) -> np.ndarray:
+    frame = cv.imread(path)
+    assert frame is not None, f'can not read image {path}'
+    return frame
+
+
+def load_frames(folder: str) -> List[np.ndarray]:
+    return [read_frame(path) for path in frame_paths(folder)]
+
+
+def timed(detect: Callable[[np.ndarray], Optional[Circle]], frames: List[np.ndarray], repeat: int):
+    circles = []
+    latencies = []
+    for frame in frames:
+        circle = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            circle = detect(frame)
+            latencies.append(time.perf_counter() - start)
+        circles.append(circle)
+    return circles, np.array(latencies) * 1000
+
+
+def legacy_find_ball(frame: np.ndarray) -> Optional[Circle]:
+    """
+    Contour scoring before connected components: every contour goes through the polygon test in Python,
+    and a contour must beat both the edges and the area of the best one so far.
+    """
+    cnts, _ = cv.findContours(ball_mask(frame), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    found_cnt = None
+    found_edges = 0
+    found_area = 0
+    for cnt in cnts:
+        edges = len(cv.approxPolyDP(cnt, 0.01 * cv.arcLength(cnt, True), True))
+        area = cv.contourArea(cnt)
+        if edges > 8 and MIN_BALL_AREA < area < MAX_BALL_AREA and edges > found_edges and area > found_area:
+            found_edges = edges
+            found_area = area
+            found_cnt = cnt
+    if found_cnt is None:
+        return None
+    (x, y), radius = cv.minEnclosingCircle(found_cnt)
+    return Circle(x, y, radius)
+
+
+BALL_COLOR = (40, 200, 60)  # BGR, within the default HSV range
+
+
+def cluttered_frame(rng: np.random.Generator, blobs: int, with_ball: bool,
+                    width: int = 1280, height: int = 720) -> Tuple[np.ndarray, Optional[Circle]]:
+    """
+    Synthetic frame with ``blobs`` ball colored shapes like a green carpet or shirt would leave in the mask:
+    specks, stripes, boxes and ragged patches, all kept clear of the ball.
+    """
+    frame = np.full((height, width, 3), (90, 60, 40), np.uint8)
+    ball = None
+    if with_ball:
+        radius = int(rng.integers(12, 60))
+        ball = Circle(float(rng.integers(radius, width - radius)), float(rng.integers(radius, height - radius)), radius)
+
+    drawn = 0
+    while drawn < blobs:
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        if ball is not None and np.hypot(x - ball.x, y - ball.y) < ball.radius + 120:
+            continue
+        kind = rng.integers(0, 4)
+        if kind == 0:
+            cv.circle(frame, (x, y), int(rng.integers(2, 5)), BALL_COLOR, -1)
+        elif kind == 1:
+            cv.line(frame, (x, y), (x + int(rng.integers(-80, 80)), y + int(rng.integers(-80, 80))), BALL_COLOR,
+                    int(rng.integers(4, 9)))
+        elif kind == 2:
+            cv.rectangle(frame, (x, y), (x + int(rng.integers(10, 60)), y + int(rng.integers(10, 60))), BALL_COLOR, -1)
+        else:
+            angles = np.sort(rng.uniform(0, 2 * np.pi, 14))
+            radii = rng.uniform(10, 50, 14)
+            points = np.column_stack((x + radii * np.cos(angles), y + radii * np.sin(angles))).astype(np.int32)
+            cv.fillPoly(frame, [points], BALL_COLOR)
+        drawn += 1
+
+    if ball is not None:
+        cv.circle(frame, (int(ball.x), int(ball.y)), int(ball.radius), BALL_COLOR, -1)
+    return frame, ball
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('folder', type=click.Path(exists=True, file_okay=False))
+@click.option('--level', 'levels', multiple=True, type=click.IntRange(1, 3), default=(1, 2), help='pyramid levels to compare, repeatable')
+@click.option('--repeat', default=3, type=int, help='runs per frame for latency')
+def pyramid(folder: str, levels: List[int], repeat: int):
+    """
+    Accuracy and latency of pyramid detection, compared to full resolution detection on recorded frames.
+    """
+    frames = load_frames(folder)
+    references, reference_latencies = timed(find_ball, frames, repeat)
+    found = sum(circle is not None for circle in references)
+    click.echo(f'{len(frames)} frames, full resolution found ball in {found}')
+    click.echo('level   p50 ms   p99 ms  speedup   found  agreed  radius err px  distance err %')
+    click.echo(f'{0:>5} {np.percentile(reference_latencies, 50):>8.2f} {np.percentile(reference_latencies, 99):>8.2f} {1:>8.2f} {found:>7} {found:>7} {0:>14.3f} {0:>15.2f}')
+
+    for level in levels:
+        circles, latencies = timed(lambda frame: find_ball(frame, pyramid_level=level), frames, repeat)
+        agreed = 0
+        radius_errors = []
+        distance_errors = []
+        for reference, circle in zip(references, circles):
+            if reference is None or circle is None:
+                continue
+            if np.hypot(reference.x - circle.x, reference.y - circle.y) > reference.radius / 2:
+                continue
+            agreed += 1
+            radius_errors.append(abs(reference.radius - circle.radius))
+            reference_distance = measure.pinhole_distance(BALL_ACTUAL_RADIUS, reference.radius)
+            distance = measure.pinhole_distance(BALL_ACTUAL_RADIUS, circle.radius)
+            distance_errors.append(abs(distance - reference_distance) / reference_distance * 100)
+
+        speedup = np.mean(reference_latencies) / np.mean(latencies)
+        radius_error = np.mean(radius_errors) if radius_errors else float('nan')
+        distance_error = np.mean(distance_errors) if distance_errors else float('nan')
+        click.echo(f'{level:>5} {np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 99):>8.2f} {speedup:>8.2f} '
+                   f'{sum(circle is not None for circle in circles):>7} {agreed:>7} {radius_error:>14.3f} {distance_error:>15.2f}')
+
+
+@cli.command()
+@click.option('--frames', 'count', default=100, type=int, help='synthetic frames, a tenth of them without ball')
+@click.option('--blobs', 'blob_counts', multiple=True, type=int, default=(0, 50, 200, 500), help='clutter blobs per frame, repeatable')
+@click.option('--repeat', default=3, type=int, help='runs per frame for latency')
+@click.option('--seed', default=0, type=int)
+def clutter(count: int, blob_counts: List[int], repeat: int, seed: int):
+    """
+    Latency and accuracy of contour scoring on synthetic cluttered frames, legacy scoring against connected components.
+    """
+    detectors = (('legacy', legacy_find_ball), ('components', find_ball))
+    click.echo(f'{count} frames per row, a hit is within half a radius of the ball')
+    click.echo('blobs  detector      p50 ms   p99 ms    hits  misses  false positives')
+    for blobs in blob_counts:
+        rng = np.random.default_rng(seed)
+        frames, balls = zip(*(cluttered_frame(rng, blobs, i % 10 != 9) for i in range(count)))
+        for name, detect in detectors:
+            circles, latencies = timed(detect, list(frames), repeat)
+            hits = misses = false_positives = 0
+            for ball, circle in zip(balls, circles):
+                if ball is None:
+                    false_positives += circle is not None
+                elif circle is not None and np.hypot(ball.x - circle.x, ball.y - circle.y) <= ball.radius / 2:
+                    hits += 1
+                else:
+                    misses += 1
+                    false_positives += circle is not None
+            click.echo(f'{blobs:>5}  {name:<10} {np.percentile(latencies, 50):>9.2f} {np.percentile(latencies, 99):>8.2f} '
+                       f'{hits:>7} {misses:>7} {false_positives:>16}')
+
+
+@cli.command()
+@click.argument('folder', type=click.Path(exists=True, file_okay=False))
+@click.option('--detector', 'detector_backend', default=BACKEND_CONTOURS, type=click.Choice(DETECTORS), help='detector drafting the labels')
+def label(folder: str, detector_backend: str):
+    """
+    Draft FOLDER/labels.json for `detectors` with one detector, to be checked and corrected by hand.
+    Every image maps to [x, y, radius] of the ball, or null when there is no ball.
+    """
+    detector = make_detector(detector_backend)
+    labels = {}
+    for path in frame_paths(folder):
+        circle = detector(read_frame(path))
+        labels[os.path.basename(path)] = None if circle is None else [round(circle.x, 1), round(circle.y, 1), round(circle.radius, 1)]
+    with open(os.path.join(folder, 'labels.json'), 'w') as output:
+        json.dump(labels, output, indent=2)
+    click.echo(f'{len(labels)} labels, {sum(circle is not None for circle in labels.values())} with ball')
+
+
+@cli.command()
+@click.argument('folder', type=click.Path(exists=True, file_okay=False))
+@click.option('--labels', 'labels_path', default=None, type=click.Path(exists=True, dir_okay=False), help='labels as written by `label`, default to FOLDER/labels.json')
+@click.option('--detector', 'detector_backends', multiple=True, type=click.Choice(DETECTORS), default=DETECTORS, help='detectors to compare, repeatable')
+@click.option('--segmentation', 'segmentation_backend', default=segmentation.BACKEND_BLUR_HSV, type=click.Choice(segmentation.BACKENDS))
+@click.option('--tracking/--no-tracking', default=False, help='search around the last detection like goalkeeper.py --tracking')
+@click.option('--repeat', default=3, type=int, help='runs over the frames for latency')
+def detectors(folder: str, labels_path: Optional[str], detector_backends: List[str], segmentation_backend: str,
+              tracking: bool, repeat: int):
+    """
+    Frame rate, precision and recall of every detector on the labeled frames of FOLDER, fed in name order
+    like a recording, so that detectors following the ball get their chance.
+    A detection is a hit within half a radius of the label.
+    """
+    if labels_path is None:
+        labels_path = os.path.join(folder, 'labels.json')
+    with open(labels_path) as reader:
+        labels = json.load(reader)
+    paths = [path for path in frame_paths(folder) if os.path.basename(path) in labels]
+    assert len(paths) > 0, f'no frame in {folder} is labeled in {labels_path}'
+    frames = [read_frame(path) for path in paths]
+    balls = [None if labels[os.path.basename(path)] is None else Circle(*labels[os.path.basename(path)]) for path in paths]
+    segmenter = segmentation.make_segmenter(segmentation_backend)
+
+    click.echo(f'{len(frames)} frames, {sum(ball is not None for ball in balls)} with ball')
+    click.echo('detector      fps   p50 ms   p99 ms  precision  recall')
+    for backend in detector_backends:
+        latencies = []
+        circles = []
+        elapsed = 0.0
+        for _ in range(repeat):
+            # followers start from scratch on every run
+            detector = make_detector(backend, segmenter)
+            if tracking:
+                detector = RoiTracker(detector=detector)
+            start = time.perf_counter()
+            circles, run_latencies = timed(detector, frames, 1)
+            elapsed += time.perf_counter() - start
+            latencies.extend(run_latencies)
+
+        hits = sum(ball is not None and circle is not None and np.hypot(ball.x - circle.x, ball.y - circle.y) <= ball.radius / 2
+                   for ball, circle in zip(balls, circles))
+        detections = sum(circle is not None for circle in circles)
+        precision = hits / detections if detections > 0 else float('nan')
+        recall = hits / max(1, sum(ball is not None for ball in balls))
+        click.echo(f'{backend:<10} {len(frames) * repeat / elapsed:>6.1f} {np.percentile(latencies, 50):>8.2f} '
+                   f'{np.percentile(latencies, 99):>8.2f} {precision:>10.3f} {recall:>7.3f}')
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,19 +1,46 @@
 import glob
 import json
 import os
+import sys
+import time
+from typing import List, Optional, Tuple
 
 import click
 import cv2 as cv
-import numpy as np
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-def detect_corners(frame, board, dictionary):
-    corners, ids, rejected = cv.aruco.detectMarkers(frame, dictionary)
-    corners, ids, rejected, recovered = cv.aruco.refineDetectedMarkers(frame, board, corners, ids, rejected)
-    if corners is None or len(corners) == 0:
-        return None, None
-    retval, charuco_corners, charuco_ids = cv.aruco.interpolateCornersCharuco(corners, ids, frame, board)
-    return charuco_corners, charuco_ids
+from playground.calibration import CameraCalibration  # noqa: E402
+from playground.charuco import CHARUCO_CACHE_DIR, MAX_VIEWS, MIN_VIEW_CORNERS, BoardSpec, View, collect_views, reprojection_error, select_views  # noqa: E402
+
+
+def collect(paths: List[str], spec: BoardSpec, workers: Optional[int], cache_dir: Optional[str]) -> List[View]:
+    """
+    Views of ``paths`` with a progress bar.
+    """
+    cached = []
+    with click.progressbar(length=len(paths), label='finding corners') as bar:
+        def progress(view: View, from_cache: bool):
+            cached.append(from_cache)
+            bar.update(1)
+
+        views = list(collect_views(paths, spec, workers, cache_dir, progress))
+    usable = sum(view.usable for view in views)
+    click.echo(f'{usable} of {len(paths)} images have at least {MIN_VIEW_CORNERS} corners, {sum(cached)} from cache')
+    return views
+
+
+def calibrate(views: List[View], board, size: Tuple[int, int], camera_matrix, dist_coeffs):
+    """
+    :return: RMS reprojection error, camera matrix, distortion coefficients and seconds taken
+    """
+    start = time.perf_counter()
+    # later runs start from the previous result
+    flags = cv.CALIB_USE_INTRINSIC_GUESS if camera_matrix is not None else 0
+    retval, camera_matrix, dist_coeffs, rvecs, tvecs = cv.aruco.calibrateCameraCharuco(
+        [view.corners for view in views], [view.ids for view in views], board, size,
+        camera_matrix, dist_coeffs, flags=flags)
+    return retval, camera_matrix, dist_coeffs, time.perf_counter() - start
 
 
 @click.group()
@@ -28,35 +55,60 @@ def cli():
 @click.option('--marker-length', help='number of markers in Y direction', type=float, default=0.015)
 @click.option('--square-length', help='number of markers in Y direction', type=float, default=0.02)
 @click.option('--output-name', help='output file name', type=str, default='calibration.json')
-def calc(folder: str, x: int, y: int, marker_length: int, square_length: int, output_name: str):
-    images = glob.glob(os.path.join(folder, '*.png'))
-    dictionary = cv.aruco.getPredefinedDictionary(cv.aruco.DICT_APRILTAG_36h11)
-    board = cv.aruco.CharucoBoard_create(x, y, square_length, marker_length, dictionary)
-    all_corners = []
-    all_ids = []
-    frame = None
-    for image_path in images:
-        frame = cv.imread(image_path)
-        charuco_corners, charuco_ids = detect_corners(frame, board, dictionary)
-        if charuco_corners is None or len(charuco_corners) < 4:
-            continue
-        all_corners.append(charuco_corners)
-        all_ids.append(charuco_ids)
-    width = frame.shape[1]
-    height = frame.shape[0]
-    click.echo(f'calibrating, based on {len(all_corners)} charuco corners.')
-    retval, camera_matrix, dist_coeffs, rvecs, tvecs = cv.aruco.calibrateCameraCharuco(
-        all_corners, all_ids, board, (width, height), None, None)
-    click.echo('Calibrated, camera_matrix and dist_coeffs:')
-    click.echo(camera_matrix)
-    click.echo(dist_coeffs)
-
-    with open(output_name, 'w') as output:
-        json.dump({
-            'camera_matrix': camera_matrix.tolist(),
-            'distortion_coefficients': dist_coeffs.tolist(),
-        }, output)
-    cv.destroyAllWindows()
+@click.option('--workers', help='processes finding corners, default to number of CPUs', type=int, default=None)
+@click.option('--cache-dir', help='directory caching corners per image and board', type=str, default=CHARUCO_CACHE_DIR)
+@click.option('--no-cache', is_flag=True, help='find corners on every image again')
+@click.option('--watch', help='keep watching FOLDER every WATCH seconds, recalibrating as images are added', type=float, default=0)
+@click.option('--max-views', help='calibrate on at most this many views varying in pose and coverage, 0 uses all', type=int, default=MAX_VIEWS)
+@click.option('--compare', is_flag=True, help='calibrate on all views as well, to compare with the selected ones')
+def calc(folder: str, x: int, y: int, marker_length: int, square_length: int, output_name: str,
+         workers: Optional[int], cache_dir: str, no_cache: bool, watch: float, max_views: int, compare: bool):
+    spec = BoardSpec(x, y, square_length, marker_length)
+    board, _ = spec.create()
+    cache_dir = None if no_cache else cache_dir
+    seen = set()
+    views: List[View] = []
+    camera_matrix, dist_coeffs = None, None
+    while True:
+        paths = sorted(set(glob.glob(os.path.join(folder, '*.png'))) - seen)
+        seen.update(paths)
+        if len(paths) > 0:
+            collected = collect(paths, spec, workers, cache_dir)
+            # retried on the next round
+            seen.difference_update(view.path for view in collected if view.size is None)
+            views = sorted(views + [view for view in collected if view.usable], key=lambda view: view.path)
+        if len(paths) > 0 and len(views) > 0:
+            sizes = {view.size for view in views}
+            assert len(sizes) == 1, f'images of different sizes: {sizes}'
+            width, height = sizes.pop()
+            selected = select_views(views, board, max_views) if max_views > 0 else views
+            click.echo(f'calibrating, based on {len(selected)} of {len(views)} views.')
+            if compare:
+                full = calibrate(views, board, (width, height), None, None)
+            retval, camera_matrix, dist_coeffs, seconds = calibrate(selected, board, (width, height),
+                                                                    camera_matrix, dist_coeffs)
+            click.echo(f'Calibrated in {seconds:.1f} s, reprojection error {retval:.3f} px on selected views, '
+                       f'{reprojection_error(views, board, camera_matrix, dist_coeffs):.3f} px on all views')
+            if compare:
+                full_retval, full_matrix, full_coeffs, full_seconds = full
+                click.echo(f'All views calibrated in {full_seconds:.1f} s, reprojection error {full_retval:.3f} px, '
+                           f'{reprojection_error(views, board, full_matrix, full_coeffs):.3f} px refitting poses')
+            click.echo('camera_matrix and dist_coeffs:')
+            click.echo(camera_matrix)
+            click.echo(dist_coeffs)
+
+            with open(output_name, 'w') as output:
+                json.dump({
+                    'camera_matrix': camera_matrix.tolist(),
+                    'distortion_coefficients': dist_coeffs.tolist(),
+                    'image_size': [width, height],
+                }, output)
+        elif len(views) == 0 and watch <= 0:
+            raise click.ClickException(f'no usable calibration image in {folder}')
+
+        if watch <= 0:
+            break
+        time.sleep(watch)
 
 
 @cli.command()
@@ -64,13 +116,9 @@ def calc(folder: str, x: int, y: int, marker_length: int, square_length: int, ou
 @click.option('--calibration', help='json file containing camera_matrix and distortion_coefficients',
               type=str, default='calibration.json')
 def undistort(input_image: str, calibration: str):
-    properties = {}
-    with open(calibration) as reader:
-        properties = json.load(reader)
     frame = cv.imread(input_image)
-    undistorted = frame.copy()
-    undistorted = cv.undistort(frame, np.array(properties['camera_matrix']),
-                               np.array(properties['distortion_coefficients']))
+    # maps are cached on disk, like the ones of goalkeeper.py --calibration
+    undistorted = CameraCalibration.load(calibration).undistort(frame)
     cv.imshow('original', frame)
     cv.imshow('undistorted', undistorted)
     cv.waitKey(0)
@@ -1,12 +1,22 @@
+import glob
 import math
-from typing import Tuple, List
+import os
+import sys
+import time
+from typing import List, Tuple, Optional
 
 import click
 import cv2 as cv
 import numpy as np
 
-GREEN_LOWER = (29, 90, 90)
-GREEN_UPPER = (64, 255, 255)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from playground import segmentation  # noqa: E402
+from playground.batch import detect_batch  # noqa: E402
+from playground.calibration import CameraCalibration  # noqa: E402
+from playground.detection import Circle, ball_in_mask, ball_mask, clean_mask  # noqa: E402
+from playground.detectors import BACKEND_CONTOURS, DETECTORS, make_detector  # noqa: E402
+
 BALL_ACTUAL_RADIUS = 0.065 / 2
 FOCAL_LENGTH_HD = 710
 HORIZONTAL_DEGREES = 96
@@ -21,43 +31,13 @@ def distance_decomposition(pixel_x: float, distance: float) -> Tuple[float, floa
     return forward_distance, lateral_distance
 
 
-def contour_analysis(cnt) -> Tuple[int, int]:
-    approx = cv.approxPolyDP(cnt, 0.01 * cv.arcLength(cnt, True), True)
-    area = cv.contourArea(cnt)
-    return len(approx), area
-
-
-def biggest_circle_cnt(cnts: List):
-    found_cnt = None
-    found_edges = 0
-    found_area = 0
-
-    for cnt in cnts:
-        edges, area = contour_analysis(cnt)
-        if edges > 8 \
-                and 260 < area < 20000 \
-                and edges > found_edges \
-                and area > found_area:
-            found_edges = edges
-            found_area = area
-            found_cnt = cnt
-
-    return found_cnt
+def process(frame: np.ndarray, segmenter, detector):
+    # same mask and detector as goalkeeper at runtime
+    cv.imshow('mask', ball_mask(frame, segmenter))
+    circle = detector(frame)
+    assert circle is not None, 'failed to find ball'
 
-
-def process(frame: np.ndarray):
-    processed = cv.GaussianBlur(frame, (11, 11), 0)
-    processed = cv.cvtColor(processed, cv.COLOR_BGR2HSV)
-
-    mask = cv.inRange(processed, GREEN_LOWER, GREEN_UPPER)
-    mask = cv.morphologyEx(mask, cv.MORPH_OPEN, None)
-    cv.imshow('mask', mask)
-    cnts, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
-
-    ball_cnt = biggest_circle_cnt(cnts)
-    assert ball_cnt is not None, 'failed to find ball'
-
-    (x, y), radius = cv.minEnclosingCircle(ball_cnt)
+    x, y, radius = circle.x, circle.y, circle.radius
     cv.circle(frame, (int(x), int(y)), int(radius), (0, 255, 0), 2)
     cv.circle(frame, (int(x), int(y)), 1, (0, 0, 255), 2)
 
@@ -68,10 +48,16 @@ def process(frame: np.ndarray):
 
 @click.group()
 @click.option('-i', type=click.Path(exists=True))
+@click.option('--segmentation', 'segmentation_backend', default=segmentation.BACKEND_BLUR_HSV, type=click.Choice(segmentation.BACKENDS), help='(Optional) Backend classifying ball pixels')
+@click.option('--detector', 'detector_backend', default=BACKEND_CONTOURS, type=click.Choice(DETECTORS), help='(Optional) Backend finding the ball')
+@click.option('--hsv-profile', type=click.Path(exists=True, dir_okay=False), help='(Optional) HSV bounds saved by tune, default to hsv-profile.json if there is one')
 @click.pass_context
-def cli(ctx: click.Context, i: str):
+def cli(ctx: click.Context, i: str, segmentation_backend: str, detector_backend: str, hsv_profile: Optional[str]):
     ctx.ensure_object(dict)
     ctx.obj['image_path']: str = i
+    ctx.obj['segmentation_backend'] = segmentation_backend
+    ctx.obj['segmenter'] = segmentation.make_segmenter(segmentation_backend, *segmentation.hsv_bounds(hsv_profile))
+    ctx.obj['detector'] = make_detector(detector_backend, ctx.obj['segmenter'])
 
 
 @cli.command()
@@ -80,7 +66,7 @@ def cli(ctx: click.Context, i: str):
 @click.pass_context
 def focal_length(ctx: click.Context, distance: float, ball_radius: float):
     frame = cv.imread(ctx.obj['image_path'])
-    _, pixel_radius = process(frame)
+    _, pixel_radius = process(frame, ctx.obj['segmenter'], ctx.obj['detector'])
     f: float = distance * pixel_radius / ball_radius
     click.echo(f'focal length: {f}')
     cv.waitKey(0)
@@ -90,10 +76,20 @@ def focal_length(ctx: click.Context, distance: float, ball_radius: float):
 @cli.command()
 @click.option('--focal-length', type=float, help='(Optional) focal length under 720p', default=FOCAL_LENGTH_HD)
 @click.option('--ball-radius', type=float, help='(Optional) ball radius in meter', default=BALL_ACTUAL_RADIUS)
+@click.option('--calibration', 'calibration_path', type=click.Path(exists=True, dir_okay=False), help='(Optional) calibration.json from calibrate-camera.py, used instead of focal length', default=None)
 @click.pass_context
-def position(ctx: click.Context, focal_length: float, ball_radius: float):
+def position(ctx: click.Context, focal_length: float, ball_radius: float, calibration_path: Optional[str]):
     frame = cv.imread(ctx.obj['image_path'])
-    (pixel_x, _), pixel_radius = process(frame)
+    (pixel_x, pixel_y), pixel_radius = process(frame, ctx.obj['segmenter'], ctx.obj['detector'])
+    if calibration_path is not None:
+        calibration = CameraCalibration.load(calibration_path)
+        forward_distance, lateral_distance, _ = calibration.ball_distances(
+            Circle(pixel_x, pixel_y, pixel_radius), (frame.shape[1], frame.shape[0]), ball_radius)
+        click.echo(f'calibrated position: forward {forward_distance}, lateral {lateral_distance}')
+        cv.waitKey(0)
+        cv.destroyAllWindows()
+        return
+
     d = focal_length * ball_radius / pixel_radius
     margin = - focal_length * ball_radius / math.pow(pixel_radius, 2)
     click.echo(f'focal length: {d}, margin for 1px: {margin}, radius in pixel: {pixel_radius}')
@@ -105,5 +101,128 @@ def position(ctx: click.Context, focal_length: float, ball_radius: float):
     cv.destroyAllWindows()
 
 
+@cli.command()
+@click.argument('folder', type=click.Path(exists=True, file_okay=False))
+@click.option('--workers', type=int, default=None, help='(Optional) Processes detecting in parallel, default to number of CPUs')
+@click.option('--window', type=int, default=None, help='(Optional) Frames in flight, default to twice the workers')
+@click.option('--pyramid-level', default=0, type=click.IntRange(0, 3), help='(Optional) Find candidates on frame downscaled by 2^level first')
+@click.option('--focal-length', type=float, help='(Optional) focal length under 720p', default=FOCAL_LENGTH_HD)
+@click.option('--ball-radius', type=float, help='(Optional) ball radius in meter', default=BALL_ACTUAL_RADIUS)
+@click.pass_context
+def batch(ctx: click.Context, folder: str, workers: Optional[int], window: Optional[int], pyramid_level: int,
+          focal_length: float, ball_radius: float):
+    """
+    Find the ball on every image in FOLDER without display, one line per image.
+    """
+    paths = sorted(glob.glob(os.path.join(folder, '*.png')) + glob.glob(os.path.join(folder, '*.jpg')))
+    frames = (cv.imread(path) for path in paths)
+    circles = detect_batch(frames, workers, window, pyramid_level, ctx.obj['detector'])
+    for path, circle in zip(paths, circles):
+        if circle is None:
+            click.echo(f'{os.path.basename(path)}: no ball')
+            continue
+        d = focal_length * ball_radius / circle.radius
+        forward_distance, lateral_distance = distance_decomposition(circle.x, d)
+        click.echo(f'{os.path.basename(path)}: center ({circle.x:.1f}, {circle.y:.1f}), radius {circle.radius:.1f}, '
+                   f'forward {forward_distance:.3f}, lateral {lateral_distance:.3f}')
+
+
+# trackbar, bound index and maximum, hue is halved by OpenCV
+TUNE_TRACKBARS = (('H low', 0, 179), ('S low', 1, 255), ('V low', 2, 255),
+                  ('H high', 0, 179), ('S high', 1, 255), ('V high', 2, 255))
+
+
+def read_sources(sources: List[str], max_frames: int) -> List[np.ndarray]:
+    """
+    Frames of images, folders of images and video clips, at most ``max_frames`` from each clip.
+    """
+    frames = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths = sorted(glob.glob(os.path.join(source, '*.png')) + glob.glob(os.path.join(source, '*.jpg')))
+            frames.extend(cv.imread(path) for path in paths)
+            continue
+        frame = cv.imread(source)
+        if frame is not None:
+            frames.append(frame)
+            continue
+        cap = cv.VideoCapture(source)
+        while len(frames) < max_frames:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+        cap.release()
+    return frames
+
+
+@cli.command()
+@click.argument('sources', nargs=-1, type=click.Path(exists=True))
+@click.option('--output', type=click.Path(dir_okay=False), help='(Optional) profile to write, load it with --hsv-profile', default=segmentation.HSV_PROFILE)
+@click.option('--max-frames', type=int, help='(Optional) frames to read from each clip', default=100)
+@click.pass_context
+def tune(ctx: click.Context, sources: List[str], output: str, max_frames: int):
+    """
+    Tune HSV bounds with trackbars on images, folders of images or clips (SOURCES, default to -i),
+    starting from --hsv-profile or the defaults.
+
+    The mask is made by the --segmentation backend, which is rebuilt with the new bounds
+    once the trackbars stop moving.
+    Press s to save the profile, q or Esc to quit.
+    """
+    if len(sources) == 0:
+        assert ctx.obj['image_path'] is not None, 'give SOURCES or -i'
+        sources = [ctx.obj['image_path']]
+    frames = read_sources(sources, max_frames)
+    assert len(frames) > 0, f'no frame in {sources}'
+    backend = ctx.obj['segmentation_backend']
+    segmenter = ctx.obj['segmenter']
+    bounds = [list(segmenter.lower), list(segmenter.upper)]
+
+    window = 'tune'
+    cv.namedWindow(window)
+    for name, index, maximum in TUNE_TRACKBARS:
+        bound = bounds[0] if name.endswith('low') else bounds[1]
+        cv.createTrackbar(name, window, bound[index], maximum, lambda _: None)
+    if len(frames) > 1:
+        cv.createTrackbar('frame', window, 0, len(frames) - 1, lambda _: None)
+
+    moving = None
+    shown = None
+    while True:
+        index = cv.getTrackbarPos('frame', window) if len(frames) > 1 else 0
+        for name, bound_index, _ in TUNE_TRACKBARS:
+            bound = bounds[0] if name.endswith('low') else bounds[1]
+            bound[bound_index] = cv.getTrackbarPos(name, window)
+        lower, upper = tuple(bounds[0]), tuple(bounds[1])
+        settled = (lower, upper) == moving
+        moving = (lower, upper)
+        if settled and (lower, upper) != (segmenter.lower, segmenter.upper):
+            # building may take a while, like the table of the lut backend
+            segmenter = segmentation.make_segmenter(backend, lower, upper)
+        state = (index, segmenter.lower, segmenter.upper)
+
+        if state != shown:
+            shown = state
+            start = time.perf_counter()
+            mask = clean_mask(segmenter(frames[index]))
+            circle = ball_in_mask(mask)
+            elapsed = (time.perf_counter() - start) * 1000
+
+            preview = frames[index].copy()
+            if circle is not None:
+                cv.circle(preview, (int(circle.x), int(circle.y)), int(circle.radius), (0, 255, 0), 2)
+            cv.putText(preview, f'{elapsed:.1f} ms', (20, 40), cv.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            cv.imshow(window, np.hstack((preview, cv.cvtColor(mask, cv.COLOR_GRAY2BGR))))
+
+        key = cv.waitKey(30) & 0xFF
+        if key == ord('s'):
+            segmentation.save_hsv_profile(output, bounds[0], bounds[1])
+            click.echo(f'saved lower {bounds[0]}, upper {bounds[1]} to {output}')
+        elif key in (ord('q'), 27):
+            break
+    cv.destroyAllWindows()
+
+
 if __name__ == '__main__':
     cli(obj={})
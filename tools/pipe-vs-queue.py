@@ -1,99 +1,237 @@
 """
+Benchmark IPC transports for the payloads passed around in goalkeeper and drive.
+
 Modified from:
 https://stackoverflow.com/questions/48353601/multiprocessing-pipe-is-even-slower-than-multiprocessing-queue/48394435
 """
 
+import json
+import multiprocessing as mp
+import os
+import pickle
+import platform
+import queue
+import struct
 import sys
 import time
-from multiprocessing import Process, Pipe, Queue, SimpleQueue
+from typing import List, Tuple
 
+import click
 import numpy as np
 
-NUM = 20000
-
-
-def worker_pipe(conn):
-    for task_nbr in range(NUM):
-        conn.send(np.random.rand(40, 40, 3))
-    sys.exit(1)
-
-
-def main_pipe(duplex: bool):
-    parent_conn, child_conn = Pipe(duplex=duplex)
-    Process(target=worker_pipe, args=(child_conn,)).start()
-    for num in range(NUM):
-        message = parent_conn.recv()
-
-
-def pipe_test_no_duplex():
-    start_time = time.time()
-    main_pipe(False)
-    end_time = time.time()
-    duration = end_time - start_time
-    msg_per_sec = NUM / duration
-    print("Pipe(no duplex)")
-    print("Duration: " + str(duration))
-    print("Messages Per Second: " + str(msg_per_sec))
-
-
-def pipe_test_duplex():
-    start_time = time.time()
-    main_pipe(True)
-    end_time = time.time()
-    duration = end_time - start_time
-    msg_per_sec = NUM / duration
-    print("Pipe(duplex)")
-    print("Duration: " + str(duration))
-    print("Messages Per Second: " + str(msg_per_sec))
-
-
-def worker_queue(q):
-    for task_nbr in range(NUM):
-        q.put(np.random.rand(40, 40, 3))
-    sys.exit(1)
-
-
-def main_queue():
-    recv_q = Queue()
-    Process(target=worker_queue, args=(recv_q,)).start()
-    for num in range(NUM):
-        message = recv_q.get()
-
-
-def main_simple_queue():
-    recv_q = SimpleQueue()
-    Process(target=worker_queue, args=(recv_q,)).start()
-    for num in range(NUM):
-        message = recv_q.get()
-
-
-def queue_test():
-    start_time = time.time()
-    main_queue()
-    end_time = time.time()
-    duration = end_time - start_time
-    msg_per_sec = NUM / duration
-    print("Queue")
-    print("Duration: " + str(duration))
-    print("Messages Per Second: " + str(msg_per_sec))
-
-
-def simple_queue_test():
-    start_time = time.time()
-    main_simple_queue()
-    end_time = time.time()
-    duration = end_time - start_time
-    msg_per_sec = NUM / duration
-    print("Simple Queue")
-    print("Duration: " + str(duration))
-    print("Messages Per Second: " + str(msg_per_sec))
-
-
-if __name__ == "__main__":
-    queue_test()
-    print()
-    simple_queue_test()
-    print()
-    pipe_test_duplex()
-    print()
-    pipe_test_no_duplex()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from playground.ipc import SharedRing, DetectionRing, DetectionMailbox, shared_memory  # noqa: E402
+
+# same start method as robomasterpy
+CTX = mp.get_context('spawn')
+QUEUE_SIZE: int = 6
+
+PAYLOADS = ('detection', 'small', '720p', '1080p')
+TRANSPORTS = ('manager-queue', 'queue', 'simple-queue', 'pipe', 'pickle5-pipe', 'shm-ring', 'mailbox')
+# shared memory transports keep only the latest items, the receiver may miss some
+LOSSY_TRANSPORTS = ('shm-ring', 'mailbox')
+# fewer latencies than this are not worth a percentile
+MIN_LATENCY_SAMPLES: int = 30
+
+
+def make_payload(name: str):
+    if name == 'detection':
+        return 0.52, -0.13, 12.5
+    elif name == 'small':
+        return np.random.rand(40, 40, 3)
+    elif name == '720p':
+        return np.random.randint(0, 256, (720, 1280, 3), dtype=np.uint8)
+    elif name == '1080p':
+        return np.random.randint(0, 256, (1080, 1920, 3), dtype=np.uint8)
+    else:
+        raise ValueError(f'unknown payload {name}')
+
+
+def payload_size(payload) -> int:
+    if isinstance(payload, np.ndarray):
+        return payload.nbytes
+    return len(payload) * 8
+
+
+def make_channel(transport: str, payload, manager):
+    """
+    :return: (channel for the sender, channel for the receiver, things to close afterwards)
+    """
+    if transport == 'manager-queue':
+        channel = manager.Queue(QUEUE_SIZE)
+        return channel, channel, []
+    elif transport == 'queue':
+        channel = CTX.Queue(QUEUE_SIZE)
+        return channel, channel, []
+    elif transport == 'simple-queue':
+        channel = CTX.SimpleQueue()
+        return channel, channel, []
+    elif transport in ('pipe', 'pickle5-pipe'):
+        receiver, sender = CTX.Pipe(duplex=False)
+        return sender, receiver, []
+    elif transport == 'shm-ring':
+        if isinstance(payload, np.ndarray):
+            channel = SharedRing(payload.shape, payload.dtype, slots=QUEUE_SIZE)
+        else:
+            channel = DetectionRing(len(payload), slots=QUEUE_SIZE)
+        return channel, channel, [channel]
+    elif transport == 'mailbox':
+        channel = DetectionMailbox(len(payload))
+        return channel, channel, [channel]
+    else:
+        raise ValueError(f'unknown transport {transport}')
+
+
+def send(transport: str, channel, index: int, payload):
+    if transport in ('manager-queue', 'queue', 'simple-queue'):
+        channel.put((index, payload))
+    elif transport == 'pipe':
+        channel.send((index, payload))
+    elif transport == 'pickle5-pipe':
+        buffers = []
+        header = pickle.dumps((index, payload), protocol=5, buffer_callback=buffers.append)
+        channel.send_bytes(struct.pack('I', len(buffers)))
+        channel.send_bytes(header)
+        for buffer in buffers:
+            channel.send_bytes(buffer.raw())
+    else:
+        # index is implied by write order
+        channel.put(payload)
+
+
+def sender(transport: str, channel, payload_name: str, count: int, rate: float, sent_at):
+    payload = make_payload(payload_name)
+    interval = 1.0 / rate if rate > 0 else 0.0
+    next_time = time.perf_counter()
+    for index in range(count):
+        if interval > 0:
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_time += interval
+        sent_at[index] = time.perf_counter()
+        send(transport, channel, index, payload)
+
+
+def receive_all(transport: str, channel, count: int, sent_at) -> Tuple[int, List[float]]:
+    """
+    :return: number of received messages, latencies in seconds.
+        Lossy transports only count the messages seen by the reader, their latency is how fresh those were.
+    """
+    latencies = []
+    if transport in LOSSY_TRANSPORTS:
+        last = -1
+        while last < count - 1:
+            if transport == 'shm-ring':
+                latest = channel.latest()
+                index = -1 if latest is None else latest[0]
+            else:
+                index = channel.read()[0] - 1
+            # the last message is never overwritten, so this ends
+            if index > last:
+                latencies.append(time.perf_counter() - sent_at[index])
+                last = index
+        return len(latencies), latencies
+
+    for _ in range(count):
+        if transport in ('manager-queue', 'queue', 'simple-queue'):
+            index, _ = channel.get()
+        elif transport == 'pipe':
+            index, _ = channel.recv()
+        else:
+            buffer_count, = struct.unpack('I', channel.recv_bytes())
+            header = channel.recv_bytes()
+            buffers = [channel.recv_bytes() for _ in range(buffer_count)]
+            index, _ = pickle.loads(header, buffers=buffers)
+        latencies.append(time.perf_counter() - sent_at[index])
+    return count, latencies
+
+
+def run(transport: str, payload_name: str, count: int, rate: float, manager) -> dict:
+    payload = make_payload(payload_name)
+    sending, receiving, closing = make_channel(transport, payload, manager)
+    sent_at = CTX.RawArray('d', count)
+    process = CTX.Process(target=sender, args=(transport, sending, payload_name, count, rate, sent_at))
+
+    process.start()
+    delivered, latencies = receive_all(transport, receiving, count, sent_at)
+    process.join()
+    # from the first send, process start up does not count
+    send_duration = max(sent_at[count - 1] - sent_at[0], 1e-9)
+    for channel in closing:
+        channel.close()
+
+    # what the sender got through, lossy transports never block it so this is not what the receiver sees
+    sent_per_s = (count - 1) / send_duration if count > 1 else 0.0
+    enough = len(latencies) >= MIN_LATENCY_SAMPLES
+    latencies = np.array(latencies) * 1000
+    return {
+        'transport': transport,
+        'payload': payload_name,
+        'payload_bytes': payload_size(payload),
+        'count': count,
+        'rate': rate,
+        'lossy': transport in LOSSY_TRANSPORTS,
+        'send_duration_s': send_duration,
+        'sent_per_s': sent_per_s,
+        'sent_mb_per_s': sent_per_s * payload_size(payload) / 1e6,
+        'delivered': delivered,
+        'delivered_fraction': delivered / count,
+        # age of the message when read, freshness for lossy transports
+        'latency_samples': len(latencies),
+        'latency_p50_ms': float(np.percentile(latencies, 50)) if enough else None,
+        'latency_p99_ms': float(np.percentile(latencies, 99)) if enough else None,
+    }
+
+
+def _ms(value) -> str:
+    return f'{value:>8.3f}' if value is not None else f'{"-":>8}'
+
+
+def supported(transport: str, payload_name: str) -> bool:
+    if transport == 'pickle5-pipe' and pickle.HIGHEST_PROTOCOL < 5:
+        return False
+    if transport in LOSSY_TRANSPORTS and shared_memory is None:
+        return False
+    if transport == 'mailbox' and payload_name != 'detection':
+        return False
+    return True
+
+
+@click.command()
+@click.option('--transport', 'transports', multiple=True, type=click.Choice(TRANSPORTS), default=TRANSPORTS, help='transports to run, repeatable')
+@click.option('--payload', 'payloads', multiple=True, type=click.Choice(PAYLOADS), default=PAYLOADS, help='payloads to send, repeatable')
+@click.option('--count', default=1000, type=int, help='messages per run')
+@click.option('--rate', default=0.0, type=float, help='messages per second, 0 sends as fast as possible. Latency under 0 includes queueing')
+@click.option('--json', 'json_path', default=None, type=click.Path(dir_okay=False, writable=True), help='write results as JSON for regression tracking')
+def cli(transports: List[str], payloads: List[str], count: int, rate: float, json_path: str):
+    results = []
+    click.echo(f'{"transport":<14} {"payload":<10} {"sent/s":>10} {"sent MB/s":>9} {"delivered":>9} {"%":>6} '
+               f'{"p50 ms":>8} {"p99 ms":>8}')
+    with CTX.Manager() as manager:
+        for payload_name in payloads:
+            for transport in transports:
+                if not supported(transport, payload_name):
+                    continue
+                result = run(transport, payload_name, count, rate, manager)
+                results.append(result)
+                click.echo(f'{transport:<14} {payload_name:<10} {result["sent_per_s"]:>10.0f} {result["sent_mb_per_s"]:>9.1f} '
+                           f'{result["delivered"]:>9} {result["delivered_fraction"] * 100:>6.1f} '
+                           f'{_ms(result["latency_p50_ms"])} {_ms(result["latency_p99_ms"])}')
+    click.echo(f'shm-ring and mailbox keep only the latest items, their latency is how fresh delivered items are. '
+               f'Compare them with pipes and queues at the same --rate, percentiles need {MIN_LATENCY_SAMPLES} samples.')
+
+    if json_path is not None:
+        with open(json_path, 'w') as output:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'processor': platform.processor(),
+                'cpus': os.cpu_count(),
+                'results': results,
+            }, output, indent=2)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,192 @@
+import collections
+import heapq
+import itertools
+import json
+import os
+import queue
+import sys
+import time
+from typing import Optional
+
+import click
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from goalkeeper import SYSTEM_FREQUENCY, KeeperMind  # noqa: E402
+from playground import segmentation  # noqa: E402
+from playground.batch import detect_batch  # noqa: E402
+from playground.calibration import CameraCalibration  # noqa: E402
+from playground.commands import SETPOINT_MAX_RATE  # noqa: E402
+from playground.detection import RoiTracker, ball_distances, locate_ball  # noqa: E402
+from playground.detectors import BACKEND_CONTOURS, DETECTORS, make_detector  # noqa: E402
+from playground.latency import LatencyRecorder  # noqa: E402
+from playground.vision import VisionHint, VisionHintChannel, VisionScheduler  # noqa: E402
+from playground.replay import STREAM_EVENT, STREAM_PUSH, STREAM_VISION, FakeCommander, ReplayClock, read_session, read_stream  # noqa: E402
+
+
+def percentiles(latencies) -> dict:
+    if len(latencies) == 0:
+        return {'p50': None, 'p99': None}
+    latencies = np.array(latencies) * 1000
+    return {'p50': float(np.percentile(latencies, 50)), 'p99': float(np.percentile(latencies, 99))}
+
+
+def read_detected_session(directory: str, workers: int, pyramid_level: int, detector):
+    """
+    Like read_session(), but vision payloads are detected circles, computed ahead in a process pool.
+    """
+    timestamps = collections.deque()
+
+    def frames():
+        for timestamp, _, frame in read_stream(directory, STREAM_VISION):
+            timestamps.append(timestamp)
+            yield frame
+
+    # a frame is always taken before its result comes back
+    circles = detect_batch(frames(), workers, pyramid_level=pyramid_level, detector=detector)
+    detected = ((timestamps.popleft(), STREAM_VISION, circle) for circle in circles)
+    return heapq.merge(detected, read_stream(directory, STREAM_PUSH), read_stream(directory, STREAM_EVENT),
+                       key=lambda record: record[0])
+
+
+@click.command()
+@click.argument('session', type=click.Path(exists=True, file_okay=False))
+@click.option('--max-width', default=0.5, type=float, help='(Optional) Field width')
+@click.option('--max-depth', default=0.5, type=float, help='(Optional) Field depth')
+@click.option('--xy-speed', default=0.4, type=float, help='(Optional) Speed in x and y direction')
+@click.option('--z-speed', default=60, type=float, help='(Optional) Speed in z direction(chassis roll)')
+@click.option('--tracking/--no-tracking', default=False, help='(Optional) Search around the last detected ball instead of the full frame')
+@click.option('--tracking-misses', default=5, type=int, help='(Optional) Misses before tracking falls back to full frame search')
+@click.option('--pyramid-level', default=0, type=click.IntRange(0, 3), help='(Optional) Find candidates on frame downscaled by 2^level first')
+@click.option('--segmentation', 'segmentation_backend', default=segmentation.BACKEND_BLUR_HSV, type=click.Choice(segmentation.BACKENDS), help='(Optional) Backend classifying ball pixels')
+@click.option('--detector', 'detector_backend', default=BACKEND_CONTOURS, type=click.Choice(DETECTORS), help='(Optional) Backend finding the ball')
+@click.option('--calibration', 'calibration_path', default=None, type=click.Path(exists=True, dir_okay=False), help='(Optional) calibration.json from tools/calibrate-camera.py for accurate distances')
+@click.option('--hsv-profile', default=None, type=click.Path(exists=True, dir_okay=False), help='(Optional) HSV bounds from tools/find-ball.py tune, default to hsv-profile.json if there is one')
+@click.option('--ball-filter/--no-ball-filter', default=False, help='(Optional) Track the ball with a Kalman filter, predicted to every tick')
+@click.option('--setpoint-rate', default=SETPOINT_MAX_RATE, type=float, help='(Optional) Max speed setpoints per second and actuator, 0 sends every one')
+@click.option('--adaptive-vision/--no-adaptive-vision', default=False, help='(Optional) Skip and downscale frames as hinted by KeeperMind, with ROI tracking while chasing')
+@click.option('--workers', default=0, type=int, help='(Optional) Detect frames ahead in this many processes, 0 detects inline. Per-frame latency is not measured then')
+@click.option('--json', 'json_path', default=None, type=click.Path(dir_okay=False, writable=True), help='(Optional) Write latencies, state transitions and commands as JSON')
+@click.option('--golden', default=None, type=click.Path(exists=True, dir_okay=False), help='(Optional) JSON from an earlier replay, exit with 1 if state transitions differ')
+def cli(session: str, max_width: float, max_depth: float, xy_speed: float, z_speed: float,
+        tracking: bool, tracking_misses: int, pyramid_level: int, segmentation_backend: str, detector_backend: str,
+        calibration_path: Optional[str], hsv_profile: Optional[str], ball_filter: bool, setpoint_rate: float, adaptive_vision: bool, workers: int,
+        json_path: Optional[str], golden: Optional[str]):
+    """
+    Replay a session recorded by goalkeeper.py --record through vision and KeeperMind as fast as possible,
+    with a fake Commander recording the issued commands.
+    """
+    assert not ((tracking or adaptive_vision) and workers > 0), 'tracking and adaptive vision depend on the previous frame, they can not run in parallel'
+    detector = make_detector(detector_backend, segmentation.make_segmenter(segmentation_backend, *segmentation.hsv_bounds(hsv_profile)))
+    calibration = CameraCalibration.load(calibration_path) if calibration_path is not None else None
+    if workers > 0:
+        records = read_detected_session(session, workers, pyramid_level, detector)
+    else:
+        records = read_session(session)
+    first = next(records, None)
+    assert first is not None, f'empty session {session}'
+    start = first[0]
+
+    clock = ReplayClock(start)
+    commander = FakeCommander(clock)
+    # vision and controller stages share this process
+    timings = LatencyRecorder('replay')
+    vision_queue, push_queue, event_queue = queue.Queue(), queue.Queue(), queue.Queue()
+    vision_hint, scheduler = None, None
+    if adaptive_vision:
+        vision_hint = VisionHintChannel(VisionHint(0, pyramid_level, True, False))
+        scheduler = VisionScheduler(vision_hint, clock)
+        tracking = True
+    mind = KeeperMind('controller', commander.get_ip(), vision_queue, push_queue, event_queue, max_width, max_depth,
+                      xy_speed=xy_speed, z_speed=z_speed, timings=timings, setpoint_rate=setpoint_rate, ball_filter=ball_filter,
+                      vision_hint=vision_hint, control_rate=0, clock=clock, commander=commander)
+    tracker = RoiTracker(tracking_misses, pyramid_level, detector) if tracking else None
+
+    # ticks are paced here, on the recorded time
+    period = 1.0 / SYSTEM_FREQUENCY
+    next_tick = start
+    frames = 0
+    vision_latencies = []
+    decision_latencies = []
+    transitions = [[0.0, mind.state.name]]
+
+    wall_start = time.perf_counter()
+    for timestamp, stream, payload in itertools.chain([first], records):
+        while next_tick <= timestamp:
+            clock.advance_to(next_tick)
+            tick_start = time.perf_counter()
+            mind.work()
+            decision_latencies.append(time.perf_counter() - tick_start)
+            if mind.state.name != transitions[-1][1]:
+                transitions.append([round(clock.time() - start, 3), mind.state.name])
+            next_tick += period
+
+        clock.advance_to(timestamp)
+        if stream == STREAM_VISION:
+            frames += 1
+            if workers > 0:
+                circle = payload
+            elif scheduler is not None:
+                hint = scheduler.due()
+                if hint is None:
+                    continue
+                vision_start = time.perf_counter()
+                if not hint.tracking:
+                    tracker.reset()
+                circle = locate_ball(payload, tracker if hint.tracking else None, hint.pyramid_level, detector)
+                vision_latencies.append(time.perf_counter() - vision_start)
+                scheduler.done(circle)
+            else:
+                vision_start = time.perf_counter()
+                circle = locate_ball(payload, tracker, pyramid_level, detector)
+                vision_latencies.append(time.perf_counter() - vision_start)
+            # recorded frames are 720p
+            vision_queue.put(None if circle is None else (*ball_distances(circle, calibration), clock.time()))
+        elif stream == STREAM_PUSH:
+            push_queue.put(payload)
+        else:
+            event_queue.put(payload)
+    wall = time.perf_counter() - wall_start
+    mind.close()
+
+    duration = clock.time() - start
+    report = {
+        'session': session,
+        'duration_s': duration,
+        'wall_s': wall,
+        'speedup': duration / wall if wall > 0 else None,
+        'frames': frames,
+        'frames_processed': scheduler.processed if scheduler is not None else frames,
+        'ticks': len(decision_latencies),
+        'vision_latency_ms': percentiles(vision_latencies),
+        'decision_latency_ms': percentiles(decision_latencies),
+        'stages': {stage: {'count': count, 'p50': p50, 'p99': p99} for stage, count, p50, p99 in timings.summary()},
+        'transitions': transitions,
+        'commands': [[round(at - start, 3), name, list(args), kwargs] for at, name, args, kwargs in commander.calls],
+    }
+    click.echo(f'replayed {duration:.1f} s in {wall:.1f} s ({report["speedup"]:.1f}x), {frames} frames, '
+               f'{report["frames_processed"]} processed, {report["ticks"]} ticks')
+    click.echo(f'vision latency ms: {report["vision_latency_ms"]}')
+    click.echo(f'decision latency ms: {report["decision_latency_ms"]}')
+    click.echo(f'{"stage":<18} {"count":>7} {"p50 ms":>8} {"p99 ms":>8}')
+    for stage, count, p50, p99 in timings.summary():
+        click.echo(f'{stage:<18} {count:>7} {p50:>8.3f} {p99:>8.3f}')
+    click.echo(f'{len(commander.calls)} commands, state transitions:')
+    for at, state in transitions:
+        click.echo(f'  {at:8.3f} s  {state}')
+
+    if json_path is not None:
+        with open(json_path, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if golden is not None:
+        with open(golden) as reader:
+            expected = json.load(reader)['transitions']
+        if expected != transitions:
+            click.echo(f'state transitions differ from {golden}: expected {expected}', err=True)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()